@@ -26,7 +26,8 @@ class ViewEventInline(admin.TabularInline):
 
     model = ViewEvent
     extra = 0
-    readonly_fields = ("asset", "event_type", "timestamp", "raw_payload")
+    fields = ("asset", "event_type", "timestamp", "payload")
+    readonly_fields = fields
     can_delete = False
     show_change_link = True
 
@@ -76,10 +77,11 @@ class SessionItemProgressAdmin(admin.ModelAdmin):
 class ViewEventAdmin(admin.ModelAdmin):
     """Настройки списка и формы для модели `ViewEvent`."""
 
-    list_display = ("session", "asset", "event_type", "timestamp")
-    search_fields = ("session__id", "asset__slug", "event_type")
+    list_display = ("session", "asset", "event_type", "code", "timestamp")
+    search_fields = ("session__id", "asset__slug", "event_type", "code")
     list_filter = ("event_type",)
-    readonly_fields = ("timestamp", "raw_payload")
+    exclude = ("data", "raw_payload")
+    readonly_fields = ("timestamp", "code", "payload")
 
 
 @admin.register(PromoCode)
@@ -0,0 +1,17 @@
+"""
+@file apps.py
+@brief Конфигурация Django-приложения `arb`.
+
+Подключает обработчики сигналов при старте приложения.
+"""
+
+from django.apps import AppConfig
+
+
+class ArbConfig(AppConfig):
+    """Конфигурация приложения `arb`."""
+
+    name = "arb"
+
+    def ready(self):
+        from . import signals  # noqa: F401, PLC0415
@@ -0,0 +1,419 @@
+"""
+@file archive.py
+@brief Архив `ViewEvent` в сжатых поколоночных сегментах на диске.
+
+Закрытые дни лога событий переносятся из MySQL в файлы-сегменты в
+`EVENT_ARCHIVE_DIR` (по одному или несколько на день), после чего строки
+удаляются порциями. Сегмент хранит колонки id, event_type, session, asset,
+timestamp и payload отдельно, каждую сжатую zlib: строки — словарным
+кодированием, id и время — дельтами, поэтому чтение агрегатов распаковывает
+только нужные колонки.
+
+Архивируются только дни, целиком учтённые в агрегатах статистики (все id
+не больше отметки `StatsCheckpoint`), так что `/api/stats` после архивации
+не меняется. Поздние события архивного дня (например, из буфера отложенной
+записи) попадают в следующий сегмент того же дня. Признак «первый
+просмотр в сессии» хранится в `Session.first_asset` и от архива не зависит.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import struct
+import sys
+import uuid
+import zlib
+from array import array
+from collections import Counter
+from datetime import UTC, date, datetime, time, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import StatsCheckpoint, ViewEvent
+from .rollups import CHECKPOINT_NAME
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ARBSEG1\n"
+SEGMENT_SUFFIX = ".seg"
+COLUMNS = ("id", "event_type", "session", "asset", "timestamp", "payload")
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def _to_le(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le(typecode: str, raw: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _delta(values: list[int]) -> array:
+    out = array("q")
+    prev = 0
+    for value in values:
+        out.append(value - prev)
+        prev = value
+    return out
+
+
+def _undelta(deltas: array) -> list[int]:
+    out = []
+    acc = 0
+    for delta in deltas:
+        acc += delta
+        out.append(acc)
+    return out
+
+
+def _dictionary(values: list) -> tuple[list, array]:
+    index = {}
+    codes = array("I")
+    for value in values:
+        codes.append(index.setdefault(value, len(index)))
+    return list(index), codes
+
+
+def encode_segment(day: date, rows: list[tuple]) -> bytes:
+    """
+    @brief Кодирует события одного дня в поколоночный сегмент.
+
+    @param day: День событий
+    @param rows: Кортежи `(id, event_type, session_id, asset_id, timestamp,
+    payload)`, упорядоченные по id
+    @return Содержимое файла сегмента.
+    """
+    ids, types, sessions, assets, stamps, payloads = (
+        list(column) for column in zip(*rows, strict=True)
+    )
+    type_dict, type_codes = _dictionary(types)
+    session_dict, session_codes = _dictionary(sessions)
+    micros = [(stamp - EPOCH) // timedelta(microseconds=1) for stamp in stamps]
+    blobs = {
+        "id": _to_le(_delta(ids)),
+        "event_type": _to_le(type_codes),
+        "session": b"".join(s.bytes for s in session_dict) + _to_le(session_codes),
+        "asset": _to_le(array("q", (-1 if a is None else a for a in assets))),
+        "timestamp": _to_le(_delta(micros)),
+        "payload": "\n".join(
+            json.dumps(p, cls=DjangoJSONEncoder, separators=(",", ":"))
+            for p in payloads
+        ).encode(),
+    }
+    header = {
+        "day": day.isoformat(),
+        "count": len(ids),
+        "min_id": ids[0],
+        "max_id": ids[-1],
+        "event_types": type_dict,
+        "sessions": len(session_dict),
+        "columns": {},
+    }
+    body = bytearray()
+    for name in COLUMNS:
+        compressed = zlib.compress(blobs[name], 6)
+        header["columns"][name] = [len(body), len(compressed)]
+        body += compressed
+    raw_header = json.dumps(header, separators=(",", ":")).encode()
+    return MAGIC + struct.pack("<I", len(raw_header)) + raw_header + bytes(body)
+
+
+class Segment:
+    """
+    @brief Сегмент архива с ленивой распаковкой колонок.
+
+    @ivar path: Путь к файлу
+    @ivar day: День событий
+    @ivar count: Число событий
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        data = path.read_bytes()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"{path} is not an event archive segment")
+        (header_len,) = struct.unpack_from("<I", data, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(data[start : start + header_len])
+        self._body = memoryview(data)[start + header_len :]
+        self.day = date.fromisoformat(self.header["day"])
+        self.count = self.header["count"]
+        self._cache = {}
+
+    def _raw(self, name: str) -> bytes:
+        offset, length = self.header["columns"][name]
+        return zlib.decompress(self._body[offset : offset + length])
+
+    def column(self, name: str) -> list:
+        """
+        @brief Распаковывает одну колонку.
+
+        @param name: Имя колонки из `COLUMNS`
+        @return Список значений в порядке id.
+        """
+        if name in self._cache:
+            return self._cache[name]
+        raw = self._raw(name)
+        if name == "id":
+            values = _undelta(_from_le("q", raw))
+        elif name == "event_type":
+            types = self.header["event_types"]
+            values = [types[code] for code in _from_le("I", raw)]
+        elif name == "session":
+            split = self.header["sessions"] * 16
+            sessions = [uuid.UUID(bytes=raw[i : i + 16]) for i in range(0, split, 16)]
+            values = [sessions[code] for code in _from_le("I", raw[split:])]
+        elif name == "asset":
+            values = [None if a < 0 else a for a in _from_le("q", raw)]
+        elif name == "timestamp":
+            values = [
+                EPOCH + timedelta(microseconds=m) for m in _undelta(_from_le("q", raw))
+            ]
+        elif name == "payload":
+            values = [json.loads(line) for line in raw.decode().split("\n")]
+        else:
+            raise KeyError(name)
+        self._cache[name] = values
+        return values
+
+
+def archive_dir() -> Path:
+    """Каталог сегментов архива."""
+    return Path(settings.EVENT_ARCHIVE_DIR)
+
+
+def _day_dir(day: date) -> Path:
+    return archive_dir() / f"{day:%Y}" / f"{day:%m}"
+
+
+def segments_for_day(day: date) -> list[Segment]:
+    """
+    @brief Сегменты одного дня.
+
+    @param day: День
+    @return Список сегментов (возможно пустой).
+    """
+    directory = _day_dir(day)
+    if not directory.is_dir():
+        return []
+    return [
+        Segment(path)
+        for path in sorted(directory.glob(f"{day.isoformat()}.*{SEGMENT_SUFFIX}"))
+    ]
+
+
+def archived_days(start: date | None = None, end: date | None = None) -> list[date]:
+    """
+    @brief Дни, для которых есть архивные сегменты.
+
+    @param start: Первый день (включительно), None — без ограничения
+    @param end: Последний день (включительно), None — без ограничения
+    @return Отсортированный список дней.
+    """
+    root = archive_dir()
+    if not root.is_dir():
+        return []
+    days = set()
+    for path in root.glob(f"*/*/*{SEGMENT_SUFFIX}"):
+        day = date.fromisoformat(path.name.split(".", 1)[0])
+        if (start is None or day >= start) and (end is None or day <= end):
+            days.add(day)
+    return sorted(days)
+
+
+def iter_events(start: date | None = None, end: date | None = None, columns=COLUMNS):
+    """
+    @brief Перебирает архивные события за период.
+
+    @param start: Первый день (включительно)
+    @param end: Последний день (включительно)
+    @param columns: Нужные колонки
+    @return Генератор словарей `column -> value`.
+    """
+    for day in archived_days(start, end):
+        for segment in segments_for_day(day):
+            data = [segment.column(name) for name in columns]
+            for values in zip(*data, strict=True):
+                yield dict(zip(columns, values, strict=True))
+
+
+def aggregate(
+    start: date | None = None,
+    end: date | None = None,
+    by: tuple[str, ...] = ("asset",),
+    event_types=None,
+) -> Counter:
+    """
+    @brief Считает архивные события за период с группировкой.
+
+    @details Распаковываются только колонки из `by` (и `event_type` при
+    фильтре). Помимо колонок сегмента доступна группировка по `day`.
+
+    @param start: Первый день (включительно)
+    @param end: Последний день (включительно)
+    @param by: Ключи группировки: `day` и/или колонки из `COLUMNS`
+    @param event_types: Учитывать только эти типы событий (None — все)
+    @return `Counter` с ключами-кортежами значений `by`.
+    """
+    wanted = set(event_types) if event_types is not None else None
+    counts = Counter()
+    for day in archived_days(start, end):
+        for segment in segments_for_day(day):
+            keys = [
+                [day] * segment.count if name == "day" else segment.column(name)
+                for name in by
+            ]
+            mask = (
+                [t in wanted for t in segment.column("event_type")]
+                if wanted is not None
+                else None
+            )
+            for i, key in enumerate(zip(*keys, strict=True)):
+                if mask is None or mask[i]:
+                    counts[key] += 1
+    return counts
+
+
+def _day_bounds(day: date) -> tuple[datetime, datetime]:
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return start, timezone.make_aware(
+        datetime.combine(day + timedelta(days=1), time.min), tz
+    )
+
+
+def _write_segment(day: date, payload: bytes, min_id: int, max_id: int) -> Path:
+    directory = _day_dir(day)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{day.isoformat()}.{min_id}-{max_id}{SEGMENT_SUFFIX}"
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as fh:
+        fh.write(payload)
+        fh.flush()
+        os.fsync(fh.fileno())
+    tmp.replace(path)
+    return path
+
+
+def _delete_chunked(ids: list[int], chunk_size: int) -> int:
+    deleted = 0
+    for i in range(0, len(ids), chunk_size):
+        deleted += ViewEvent.objects.filter(id__in=ids[i : i + chunk_size]).delete()[0]
+    return deleted
+
+
+def archive_day(day: date, chunk_size: int | None = None) -> int:
+    """
+    @brief Переносит события одного дня в сегменты и удаляет строки.
+
+    @details События читаются по id порциями по `EVENT_ARCHIVE_SEGMENT_ROWS`;
+    каждая порция атомарно записывается в свой сегмент и только затем
+    удаляется из БД запросами по `chunk_size` строк. Строки, уже лежащие
+    в сегментах этого дня (прерванный прошлый запуск), только удаляются.
+
+    @param day: Закрытый день
+    @param chunk_size: Размер порции удаления (по умолчанию из настроек)
+    @return Число удалённых из БД событий.
+    """
+    chunk_size = chunk_size or settings.EVENT_ARCHIVE_CHUNK_SIZE
+    start, end = _day_bounds(day)
+    archived = set()
+    for segment in segments_for_day(day):
+        archived.update(segment.column("id"))
+    events = ViewEvent.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    deleted = 0
+    last_id = 0
+    while True:
+        rows = list(
+            events.filter(id__gt=last_id)
+            .order_by("id")
+            .only(
+                "id",
+                "event_type",
+                "session_id",
+                "asset_id",
+                "timestamp",
+                "data",
+                "code",
+                "raw_payload",
+            )[: settings.EVENT_ARCHIVE_SEGMENT_ROWS]
+        )
+        if not rows:
+            return deleted
+        last_id = rows[-1].id
+        fresh = [
+            (e.id, e.event_type, e.session_id, e.asset_id, e.timestamp, e.payload)
+            for e in rows
+            if e.id not in archived
+        ]
+        if fresh:
+            path = _write_segment(
+                day, encode_segment(day, fresh), fresh[0][0], fresh[-1][0]
+            )
+            logger.info("archived %d events of %s to %s", len(fresh), day, path)
+        deleted += _delete_chunked([e.id for e in rows], chunk_size)
+
+
+def closed_days(older_than_days: int) -> list[dict]:
+    """
+    @brief Дни лога событий, подходящие по возрасту для архивации.
+
+    @details День готов к архивации (`compacted`), только если все его
+    события уже учтены в агрегатах статистики (id не больше отметки).
+
+    @param older_than_days: Возраст в днях; берутся дни строго раньше
+    `сегодня - older_than_days`
+    @return Список словарей `day`, `events`, `compacted` по возрастанию дня.
+    """
+    cutoff, _ = _day_bounds(timezone.localdate() - timedelta(days=older_than_days))
+    checkpoint = (
+        StatsCheckpoint.objects.filter(name=CHECKPOINT_NAME)
+        .values_list("last_event_id", flat=True)
+        .first()
+    ) or 0
+    rows = (
+        ViewEvent.objects.filter(timestamp__lt=cutoff)
+        .annotate(day=TruncDate("timestamp"))
+        .values("day")
+        .annotate(events=Count("id"), max_id=Max("id"))
+        .order_by("day")
+    )
+    return [
+        {
+            "day": row["day"],
+            "events": row["events"],
+            "compacted": row["max_id"] <= checkpoint,
+        }
+        for row in rows
+    ]
+
+
+def archive_events(older_than_days: int, chunk_size: int | None = None) -> dict:
+    """
+    @brief Архивирует все закрытые и свёрнутые в статистику дни.
+
+    @param older_than_days: Возраст в днях (см. `closed_days`)
+    @param chunk_size: Размер порции удаления
+    @return Словарь `day -> число удалённых событий`.
+    """
+    result = {}
+    for row in closed_days(older_than_days):
+        if not row["compacted"]:
+            logger.info("skipping %s: not compacted into stats yet", row["day"])
+            continue
+        result[row["day"]] = archive_day(row["day"], chunk_size)
+    return result
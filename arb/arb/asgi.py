@@ -2,7 +2,8 @@
 @file asgi.py
 @brief Точка входа ASGI для проекта.
 
-Провайдер `application` для ASGI-серверов (Uvicorn, Daphne).
+Провайдер `application` для ASGI-серверов (Uvicorn, Daphne). HTTP-запросы
+обслуживает Django, соединения WebSocket — `ws.application`.
 """
 
 import os
@@ -11,4 +12,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "arb.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from arb import ws  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        return await ws.application(scope, receive, send)
+    return await django_application(scope, receive, send)
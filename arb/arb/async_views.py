@@ -0,0 +1,267 @@
+"""
+@file async_views.py
+@brief Асинхронные (ASGI) версии горячих эндпоинтов.
+
+`session_start`, `view_event`, `progress` и `promo` повторяют контракт
+DRF-обработчиков из `views.py`, но не занимают поток на время ожидания БД:
+чтения и одиночные вставки идут через асинхронный ORM (`aget`, `acreate`,
+`acount`, `afirst`), а транзакционная регистрация просмотра
+(`scoring.register_view`) и обращения к кэшу выполняются через
+`sync_to_async`. Маршруты переключаются на эти обработчики настройкой
+`ASYNC_VIEWS` (см. `urls.py`); запускать их следует под ASGI-сервером.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import (
+    catalog,
+    db_router,
+    etags,
+    event_sink,
+    idempotency,
+    progress_cache,
+    scoring,
+)
+from .models import PromoCode, Session, User
+from .views import _parse_uuid
+
+
+def async_api_view(methods: list[str]):
+    """
+    @brief Декоратор асинхронного API-обработчика.
+
+    @details Ограничивает методы, отключает CSRF (как `@api_view` для
+    анонимных клиентов) и превращает `Http404` в JSON-ответ 404.
+
+    @param methods: Разрешённые HTTP-методы
+    @return Декоратор.
+    """
+
+    def decorator(func):
+        @csrf_exempt
+        @require_http_methods(methods)
+        @functools.wraps(func)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                return await func(request, *args, **kwargs)
+            except Http404 as exc:
+                return JsonResponse({"detail": str(exc) or "Not found."}, status=404)
+
+        return wrapper
+
+    return decorator
+
+
+def _json_body(request) -> dict | None:
+    """
+    @brief Разбирает JSON-тело запроса.
+
+    @param request: HTTP-запрос
+    @return Словарь (пустой для пустого тела) либо None, если тело некорректно.
+    """
+    if not request.body:
+        return {}
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def _aget_or_404(queryset, object_id):
+    """
+    @brief Асинхронный аналог `get_object_or_404` по первичному ключу UUID.
+
+    @param queryset: QuerySet модели
+    @param object_id: Идентификатор из запроса
+    @return Объект модели.
+    @throws Http404 Если идентификатор некорректен или объект не найден.
+    """
+    parsed_id = _parse_uuid(object_id)
+    obj = None
+    if parsed_id is not None:
+        obj = await queryset.filter(id=parsed_id).afirst()
+    if obj is None:
+        name = queryset.model._meta.object_name  # noqa: SLF001
+        raise Http404(f"No {name} matches the given query.")
+    return obj
+
+
+def _on_session_started(session: Session) -> None:
+    event_sink.log_event(session.id, "session_started", {"event": "session_started"})
+    progress_cache.init_session_progress(session)
+    db_router.stick(session.id)
+    etags.start_session(session.id)
+
+
+@idempotency.idempotent("session_start")
+@async_api_view(["POST"])
+async def session_start(_request):
+    """
+    @brief Создаёт новую сессию и логирует событие старта.
+
+    @param _request: HTTP-запрос без тела
+    @return Идентификатор созданной сессии.
+    """
+    session = await Session.objects.acreate(last_seen=timezone.now(), is_active=True)
+    await sync_to_async(_on_session_started)(session)
+    return JsonResponse({"session_id": str(session.id)}, status=201)
+
+
+@idempotency.idempotent("view_event")
+@async_api_view(["POST"])
+async def view_event(request):
+    """
+    @brief Регистрирует просмотр актива и начисляет очки за первый просмотр.
+
+    @param request: JSON с полями `session_id`, `asset_slug` и доп. payload
+    @return Информация о начисленных очках и текущем счёте сессии.
+    """
+    data = _json_body(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+    session_id = data.get("session_id")
+    asset_slug = data.get("asset_slug")
+    if not session_id or not asset_slug:
+        return JsonResponse(
+            {"detail": "session_id and asset_slug are required"}, status=400
+        )
+    if not isinstance(asset_slug, str):
+        return JsonResponse({"detail": "asset_slug must be a string"}, status=400)
+    parsed_id = _parse_uuid(session_id)
+    if parsed_id is None:
+        raise Http404("No Session matches the given query.")
+    asset = await sync_to_async(catalog.get_asset_or_404)(asset_slug)
+    payload = await sync_to_async(scoring.register_view)(parsed_id, asset, data)
+    return JsonResponse(payload)
+
+
+@etags.conditional("progress", etags.progress_versions)
+@db_router.replica_reads
+@async_api_view(["GET"])
+async def progress(request):
+    """
+    @brief Возвращает прогресс по сессии или пользователю.
+
+    @param request: Query `session_id` или `user_id`, необязательный `campaign`
+    @return Общее число активов, просмотренные и оставшиеся, и очки.
+    """
+    session_id = request.GET.get("session_id")
+    user_id = request.GET.get("user_id")
+    campaign = request.GET.get("campaign")
+    if not session_id and not user_id:
+        return JsonResponse({"detail": "session_id or user_id is required"}, status=400)
+    await sync_to_async(catalog.check_campaign)(campaign)
+    if session_id:
+        parsed_id = _parse_uuid(session_id)
+        record = (
+            await sync_to_async(progress_cache.get_session_progress)(parsed_id)
+            if parsed_id
+            else None
+        )
+        if record is None:
+            session = await _aget_or_404(Session.objects.all(), session_id)
+            parsed_id = session.id
+            record = await sync_to_async(progress_cache.refresh_session_progress)(
+                session
+            )
+        payload = await sync_to_async(progress_cache.progress_payload)(record, campaign)
+        await sync_to_async(event_sink.log_event)(parsed_id, "progress_viewed", payload)
+        return JsonResponse(payload)
+    current = await sync_to_async(catalog.get_catalog)()
+    total_assets = current.campaign_total(campaign)
+    user = await _aget_or_404(User.objects.all(), user_id)
+    seen = user.seen_assets.all()
+    if campaign is not None:
+        seen = seen.filter(asset__campaign=campaign)
+    viewed_assets = await seen.acount()
+    return JsonResponse(
+        {
+            "total_assets": total_assets,
+            "viewed_assets": viewed_assets,
+            "remaining_assets": max(total_assets - viewed_assets, 0),
+            "total_score": user.total_score,
+        }
+    )
+
+
+@etags.conditional("promo", etags.promo_versions)
+@db_router.replica_reads
+@async_api_view(["GET"])
+async def promo(request):
+    """
+    @brief Возвращает активный промокод для пользователя/сессии, если он есть.
+
+    @details Семантика `campaign` та же, что у `views.promo`.
+
+    @param request: Query `session_id` или `user_id` или `email`,
+    необязательный `campaign`
+    @return JSON с `promo_code` либо 404, если условия не выполнены.
+    """
+    session_id = request.GET.get("session_id")
+    user_id = request.GET.get("user_id")
+    email = request.GET.get("email")
+    campaign = request.GET.get("campaign")
+    if not any([session_id, user_id, email]):
+        return JsonResponse(
+            {"detail": "session_id or user_id or email is required"}, status=400
+        )
+    await sync_to_async(catalog.check_campaign)(campaign)
+
+    user = None
+    session = None
+    if session_id:
+        session = await _aget_or_404(Session.objects.select_related("user"), session_id)
+        user = session.user
+    elif user_id:
+        user = await _aget_or_404(User.objects.all(), user_id)
+    elif email:
+        user = await User.objects.filter(email=email).afirst()
+        if not user:
+            return JsonResponse({"detail": "not_found"}, status=404)
+
+    existing_promo = (
+        await PromoCode.objects.filter(user=user, used_at__isnull=True).afirst()
+        if user is not None
+        else None
+    )
+    if existing_promo:
+        if session:
+            result = "issued" if existing_promo.session_id == session.id else "exists"
+            await sync_to_async(event_sink.log_event)(
+                session.id,
+                "promo_checked",
+                {"result": result, "code": existing_promo.code},
+            )
+        return JsonResponse({"promo_code": existing_promo.code})
+
+    if not session:
+        session = (
+            await Session.objects.filter(user=user)
+            .select_related("user")
+            .order_by("-last_seen")
+            .afirst()
+        )
+
+    if session:
+        code = await sync_to_async(scoring.issue_promocode_if_completed)(
+            session, return_existing=True, campaign=campaign
+        )
+        if code:
+            await sync_to_async(event_sink.log_event)(
+                session.id, "promo_checked", {"result": "issued", "code": code}
+            )
+            return JsonResponse({"promo_code": code})
+        await sync_to_async(event_sink.log_event)(
+            session.id, "promo_checked", {"result": "not_completed"}
+        )
+    return JsonResponse({"detail": "not_completed"}, status=404)
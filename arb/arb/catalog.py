@@ -0,0 +1,167 @@
+"""
+@file catalog.py
+@brief Кэш каталога активов в памяти процесса.
+
+Каталог (`slug -> Asset`, `id -> Asset`, число активов и битовые маски
+порядковых номеров по кампаниям) строится одним запросом и живёт в памяти
+каждого процесса gunicorn/celery. Актуальность проверяется по ключу версии
+в общем кэше (Redis): при сохранении или удалении `Asset` версия меняется,
+и все процессы перестраивают каталог при следующем обращении. Проверка
+версии выполняется не чаще раза в `ASSET_CATALOG_CHECK_INTERVAL` секунд.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+from redis import RedisError
+
+from .models import Asset, AssetOrdinalSequence
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "catalog:assets:version"
+
+
+class AssetCatalog:
+    """
+    @brief Неизменяемый снимок каталога активов.
+
+    @ivar version: Версия, с которой снимок был построен
+    @ivar by_slug: Отображение `slug -> Asset`
+    @ivar by_id: Отображение `id -> Asset`
+    @ivar campaign_counts: Число активов в каждой кампании
+    @ivar masks: Маска всех порядковых номеров каждой кампании
+    @ivar by_ordinal: Отображение `(кампания, номер) -> Asset`
+    """
+
+    def __init__(self, version: str | None, assets) -> None:
+        self.version = version
+        self.by_slug = {asset.slug: asset for asset in assets}
+        self.by_id = {asset.id: asset for asset in assets}
+        self.campaign_counts = dict(Counter(asset.campaign for asset in assets))
+        self.by_ordinal = {
+            (asset.campaign, asset.ordinal): asset
+            for asset in assets
+            if asset.ordinal is not None
+        }
+        self.masks = dict.fromkeys(self.campaign_counts, 0)
+        for campaign, ordinal in self.by_ordinal:
+            self.masks[campaign] |= 1 << ordinal
+
+    @property
+    def total(self) -> int:
+        """Общее число активов."""
+        return len(self.by_id)
+
+    def campaign_total(self, campaign: str | None) -> int:
+        """Число активов кампании (None — всех)."""
+        return self.total if campaign is None else self.campaign_counts.get(campaign, 0)
+
+
+_catalog: AssetCatalog | None = None
+_checked_at = 0.0
+
+
+def _current_version() -> str | None:
+    """
+    @brief Читает (или инициализирует) общую версию каталога.
+
+    @return Строка версии либо None, если Redis недоступен.
+    """
+    try:
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = cache.get(VERSION_KEY)
+    except RedisError:
+        logger.warning("asset catalog version check failed")
+        return None
+    return version
+
+
+def get_catalog() -> AssetCatalog:
+    """
+    @brief Возвращает актуальный снимок каталога текущего процесса.
+
+    @details Если Redis недоступен, снимок перестраивается из БД на каждой
+    проверке, чтобы не отдавать устаревшие данные неограниченно долго.
+
+    @return Объект `AssetCatalog`.
+    """
+    global _catalog, _checked_at  # noqa: PLW0603
+    catalog = _catalog
+    now = time.monotonic()
+    if (
+        catalog is not None
+        and now - _checked_at < settings.ASSET_CATALOG_CHECK_INTERVAL
+    ):
+        return catalog
+    version = _current_version()
+    if catalog is None or version is None or catalog.version != version:
+        catalog = AssetCatalog(version, list(Asset.objects.all()))
+        _catalog = catalog
+    _checked_at = now
+    return catalog
+
+
+def get_asset_or_404(slug: str) -> Asset:
+    """
+    @brief Находит актив по slug в каталоге.
+
+    @param slug: Slug актива
+    @return Объект `Asset`.
+    @throws Http404 Если актив не найден.
+    """
+    asset = get_catalog().by_slug.get(slug)
+    if asset is None:
+        raise Http404("No Asset matches the given query.")
+    return asset
+
+
+def check_campaign(campaign: str | None) -> None:
+    """
+    @brief Проверяет, что кампания есть в каталоге.
+
+    @param campaign: Имя кампании или None (все кампании)
+    @throws Http404 Если в кампании нет активов.
+    """
+    if campaign is not None and campaign not in get_catalog().campaign_counts:
+        raise Http404("No campaign matches the given query.")
+
+
+def assign_ordinal(asset: Asset) -> None:
+    """
+    @brief Выдаёт активу следующий порядковый номер его кампании.
+
+    @details Номер берётся из `AssetOrdinalSequence` под блокировкой строки
+    счётчика, поэтому параллельные сохранения не получат один номер.
+
+    @param asset: Несохранённый или перенесённый в другую кампанию `Asset`
+    """
+    with transaction.atomic():
+        sequence, _ = AssetOrdinalSequence.objects.select_for_update().get_or_create(
+            campaign=asset.campaign
+        )
+        sequence.last_ordinal += 1
+        sequence.save(update_fields=["last_ordinal"])
+    asset.ordinal = sequence.last_ordinal
+
+
+def invalidate() -> None:
+    """
+    @brief Сбрасывает каталог во всех процессах, меняя общую версию.
+    """
+    global _catalog  # noqa: PLW0603
+    _catalog = None
+    try:
+        cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    except RedisError:
+        logger.warning("asset catalog invalidation failed")
@@ -0,0 +1,191 @@
+"""
+@file db_router.py
+@brief Чтение с реплик MySQL с привязкой сессии к основной базе после записи.
+
+Обработчики, которым допустимо читать с реплики (`progress`, `promo`,
+`stats`), помечаются декоратором `replica_reads`: на время их вызова
+`ReplicaRouter` направляет чтения на одну из реплик `DATABASE_REPLICAS`,
+запись всегда идёт в `default`. Чтения внутри транзакции на `default`
+тоже остаются на основной базе.
+
+Чтобы посетитель сразу видел свой прогресс, запись, меняющая видимое
+состояние сессии, вызывает `stick(session_id)`: следующие
+`DB_STICKY_SECONDS` секунд запросы этой сессии читают с основной базы.
+Отставание реплики проверяется не чаще раза в `DB_REPLICA_CHECK_INTERVAL`
+секунд; реплика, отстающая больше `DB_REPLICA_MAX_LAG` секунд или
+недоступная, не используется. Если подходящих реплик нет, чтение идёт
+с основной базы. Без `DATABASE_REPLICAS` модуль ничего не делает.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+STICKY_KEY = "db:sticky:{}"
+
+_replica = contextvars.ContextVar("arb_read_replica", default=None)
+_health_lock = threading.Lock()
+# alias -> (monotonic time of the check, usable)
+_health: dict[str, tuple[float, bool]] = {}
+
+
+def replica_lag(alias: str) -> float | None:
+    """
+    @brief Отставание реплики от источника.
+
+    @param alias: Псевдоним реплики в `DATABASES`
+    @return Секунды либо None, если репликация остановлена или статус
+    недоступен. Для СУБД кроме MySQL — 0.
+    """
+    connection = connections[alias]
+    if connection.vendor != "mysql":
+        return 0.0
+    with connection.cursor() as cursor:
+        for statement, column in (
+            ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+            ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+        ):
+            try:
+                cursor.execute(statement)
+            except DatabaseError:
+                continue
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            names = [d[0] for d in cursor.description]
+            lag = row[names.index(column)]
+            return None if lag is None else float(lag)
+    return None
+
+
+def _usable(alias: str) -> bool:
+    now = time.monotonic()
+    with _health_lock:
+        checked = _health.get(alias)
+    if checked and now - checked[0] < settings.DB_REPLICA_CHECK_INTERVAL:
+        return checked[1]
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError:
+        logger.warning("replica %s is unreachable", alias)
+        lag = None
+    usable = lag is not None and lag <= settings.DB_REPLICA_MAX_LAG
+    if not usable:
+        logger.warning("replica %s skipped, lag %s", alias, lag)
+    with _health_lock:
+        _health[alias] = (now, usable)
+    return usable
+
+
+def choose_replica(session_id=None) -> str | None:
+    """
+    @brief Выбирает реплику для чтений запроса.
+
+    @param session_id: Сессия запроса (если известна)
+    @return Псевдоним реплики либо None — читать с основной базы.
+    """
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas:
+        return None
+    if session_id:
+        try:
+            if cache.get(STICKY_KEY.format(session_id)):
+                return None
+        except RedisError:
+            return None
+    usable = [alias for alias in replicas if _usable(alias)]
+    return random.choice(usable) if usable else None  # noqa: S311
+
+
+def stick(*session_ids) -> None:
+    """
+    @brief Направляет чтения сессий на основную базу на `DB_STICKY_SECONDS`.
+
+    @param session_ids: Идентификаторы сессий, состояние которых изменилось
+    """
+    if not settings.DATABASE_REPLICAS or not session_ids:
+        return
+    try:
+        cache.set_many(
+            {STICKY_KEY.format(sid): 1 for sid in session_ids},
+            settings.DB_STICKY_SECONDS,
+        )
+    except RedisError:
+        logger.warning("failed to pin %d sessions to primary", len(session_ids))
+
+
+def replica_reads(view):
+    """
+    @brief Разрешает обработчику читать с реплики.
+
+    @details Сессия берётся из параметра `session_id` строки запроса.
+    Выбранная реплика (или None) сохраняется в `request.read_replica`.
+    Подходит для синхронных и асинхронных обработчиков; ставится над
+    `@api_view`/`@async_api_view`.
+
+    @param view: Обработчик
+    @return Обёрнутый обработчик.
+    """
+    if iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not settings.DATABASE_REPLICAS:
+                return await view(request, *args, **kwargs)
+            alias = await sync_to_async(choose_replica)(request.GET.get("session_id"))
+            request.read_replica = alias
+            token = _replica.set(alias)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _replica.reset(token)
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DATABASE_REPLICAS:
+            return view(request, *args, **kwargs)
+        alias = choose_replica(request.GET.get("session_id"))
+        request.read_replica = alias
+        token = _replica.set(alias)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    @brief Маршрутизатор Django: чтения в `replica_reads` — на реплику.
+    """
+
+    def db_for_read(self, model, **hints):  # noqa: ARG002
+        alias = _replica.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):  # noqa: ARG002
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):  # noqa: ARG002
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):  # noqa: ARG002
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,272 @@
+"""
+@file etags.py
+@brief Версии состояния и условные GET (`ETag` / `If-None-Match`).
+
+`progress`, `promo` и `stats` опрашиваются постоянно, а ответ меняется
+редко. Пути записи после фиксации транзакции меняют версию затронутого
+состояния в общем кэше (Redis): сессии (`etag:session:<id>`), пользователя
+(`etag:user:<id>`) и глобальную версию статистики (`etag:stats`). Версия —
+время изменения в наносекундах, поэтому после вытеснения ключа новая
+версия не совпадёт ни с одной выданной ранее.
+
+Обработчик, обёрнутый `conditional`, до выполнения собирает свой `ETag` из
+версий (одно чтение кэша) и на совпавший `If-None-Match` отвечает `304`, не
+выполняя запросов к БД. Ответы `200` получают `ETag` и
+`Cache-Control: private, no-cache`, так что браузер перепроверяет их сам.
+Кэш недоступен — заголовки не ставятся, ответ считается как обычно.
+
+Ответ, прочитанный с реплики, не помечается, пока версия моложе
+`DB_REPLICA_MAX_LAG`: реплика могла ещё не получить изменение, и
+устаревший ответ закрепился бы под новой версией.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import hashlib
+import logging
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from redis import RedisError
+
+from . import catalog
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "etag:session:{}"
+SESSION_USER_KEY = "etag:session-user:{}"
+USER_KEY = "etag:user:{}"
+STATS_KEY = "etag:stats"
+
+
+def _now() -> int:
+    return time.time_ns()
+
+
+def _store(values: dict) -> None:
+    try:
+        cache.set_many(values, settings.ETAG_VERSION_TTL)
+    except RedisError:
+        logger.warning("etag versions not bumped: %s", ", ".join(values))
+        # a stale version would keep answering 304; better to lose it
+        with contextlib.suppress(RedisError):
+            cache.delete_many(list(values))
+
+
+def start_session(session_id) -> None:
+    """
+    @brief Заводит версии новой сессии (без привязанного пользователя).
+
+    @param session_id: Идентификатор сессии
+    """
+    transaction.on_commit(
+        lambda: _store(
+            {
+                SESSION_KEY.format(session_id): _now(),
+                SESSION_USER_KEY.format(session_id): "",
+            }
+        )
+    )
+
+
+def link_session(session_id, user_id) -> None:
+    """
+    @brief Запоминает пользователя сессии и меняет версии обоих.
+
+    @param session_id: Идентификатор сессии
+    @param user_id: Идентификатор пользователя
+    """
+    transaction.on_commit(
+        lambda: _store(
+            {
+                SESSION_KEY.format(session_id): _now(),
+                SESSION_USER_KEY.format(session_id): str(user_id),
+                USER_KEY.format(user_id): _now(),
+            }
+        )
+    )
+
+
+def bump(session_ids=(), user_ids=(), stats: bool = False) -> None:
+    """
+    @brief Меняет версии после фиксации текущей транзакции.
+
+    @param session_ids: Сессии, чей прогресс или промокод изменился
+    @param user_ids: Пользователи, чей счёт, активы или промокод изменились
+    @param stats: Изменились счётчики статистики
+    """
+    keys = [SESSION_KEY.format(sid) for sid in session_ids if sid]
+    keys += [USER_KEY.format(uid) for uid in user_ids if uid]
+    if stats:
+        keys.append(STATS_KEY)
+    if keys:
+        transaction.on_commit(lambda: _store(dict.fromkeys(keys, _now())))
+
+
+def _versions(keys: list[str], required=()) -> dict | None:
+    """
+    @brief Читает версии; недостающие заводит заново.
+
+    @param keys: Ключи версий
+    @param required: Ключи, без которых `ETag` не строится
+    @return Словарь `ключ -> версия` либо None.
+    """
+    try:
+        found = cache.get_many(keys)
+        for key in keys:
+            if key in found:
+                continue
+            if key in required:
+                return None
+            cache.add(key, _now(), settings.ETAG_VERSION_TTL)
+            found[key] = cache.get(key)
+    except RedisError:
+        logger.warning("etag versions unavailable")
+        return None
+    return found
+
+
+def _parse_id(value) -> str | None:
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+def progress_versions(request) -> dict | None:
+    """
+    @brief Версии ответа `progress`: сессии или пользователя.
+
+    @param request: HTTP-запрос
+    @return Версии либо None (запрос без условной поддержки).
+    """
+    if request.GET.get("session_id"):
+        session_id = _parse_id(request.GET["session_id"])
+        return _versions([SESSION_KEY.format(session_id)]) if session_id else None
+    user_id = _parse_id(request.GET.get("user_id"))
+    return _versions([USER_KEY.format(user_id)]) if user_id else None
+
+
+def promo_versions(request) -> dict | None:
+    """
+    @brief Версии ответа `promo`: сессии и её пользователя или пользователя.
+
+    @details Для сессии нужна связь с пользователем (заводится при старте
+    сессии): его промокоды из других сессий тоже меняют ответ. Поиск по
+    `email` условно не поддерживается.
+
+    @param request: HTTP-запрос
+    @return Версии либо None.
+    """
+    if request.GET.get("session_id"):
+        session_id = _parse_id(request.GET["session_id"])
+        if session_id is None:
+            return None
+        link = SESSION_USER_KEY.format(session_id)
+        found = _versions([SESSION_KEY.format(session_id), link], required=(link,))
+        if found and found[link]:
+            user = _versions([USER_KEY.format(found[link])])
+            found = {**found, **user} if user else None
+        return found
+    if request.GET.get("user_id"):
+        user_id = _parse_id(request.GET["user_id"])
+        return _versions([USER_KEY.format(user_id)]) if user_id else None
+    return None
+
+
+def stats_versions(_request) -> dict | None:
+    """
+    @brief Версия ответа `stats` (глобальная).
+
+    @param _request: HTTP-запрос
+    @return Версии либо None.
+    """
+    return _versions([STATS_KEY])
+
+
+def _make_tag(route: str, versions_func, request) -> tuple[str, int] | None:
+    if request.method not in ("GET", "HEAD"):
+        return None
+    versions = versions_func(request)
+    current = catalog.get_catalog().version
+    if not versions or current is None:
+        return None
+    # "today" in stats and catalog totals change without a write of ours
+    parts = [route, current, timezone.localdate().isoformat()]
+    parts.append(request.GET.get("campaign", ""))
+    parts += [f"{key}={versions[key]}" for key in sorted(versions)]
+    digest = hashlib.sha1("|".join(parts).encode(), usedforsecurity=False)
+    newest = max((v for v in versions.values() if isinstance(v, int)), default=0)
+    return f'"{digest.hexdigest()[:24]}"', newest
+
+
+def _not_modified(request, tag) -> HttpResponseNotModified | None:
+    if tag is None:
+        return None
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if tag[0] not in etags and "*" not in etags:
+        return None
+    response = HttpResponseNotModified()
+    response["ETag"] = tag[0]
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _finish(request, response, tag):
+    if tag is None or response.status_code != 200:
+        return response
+    lag_ns = settings.DB_REPLICA_MAX_LAG * 1_000_000_000
+    if getattr(request, "read_replica", None) and _now() - tag[1] <= lag_ns:
+        return response
+    response["ETag"] = tag[0]
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional(route: str, versions_func):
+    """
+    @brief Декоратор условного GET по версиям состояния.
+
+    @details Подходит для синхронных и асинхронных обработчиков; ставится
+    над `replica_reads`, чтобы `304` не выбирал реплику.
+
+    @param route: Имя маршрута (входит в `ETag`)
+    @param versions_func: Функция `request -> версии | None`
+    @return Декоратор.
+    """
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                tag = await sync_to_async(_make_tag)(route, versions_func, request)
+                response = _not_modified(request, tag)
+                if response is not None:
+                    return response
+                response = await view(request, *args, **kwargs)
+                return _finish(request, response, tag)
+
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            tag = _make_tag(route, versions_func, request)
+            response = _not_modified(request, tag)
+            if response is not None:
+                return response
+            return _finish(request, view(request, *args, **kwargs), tag)
+
+        return wrapper
+
+    return decorator
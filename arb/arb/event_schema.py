@@ -0,0 +1,295 @@
+"""
+@file event_schema.py
+@brief Схемы полезной нагрузки событий `ViewEvent` и компактное кодирование.
+
+Для каждого типа события объявлена схема: известные поля кодируются в
+двоичную колонку `ViewEvent.data` (байт версии схемы, битовая маска
+присутствия, затем значения: целые — zigzag varint, строки — длина и UTF-8,
+перечисления — байт номера), промокод выносится в индексируемую колонку
+`ViewEvent.code`. Поля, совпадающие со значениями колонок строки
+(`session_id`), и константы не хранятся вовсе. Неизвестные поля и значения
+неожиданного типа остаются в JSON-колонке `raw_payload`, которая обычно
+пуста; если они больше `EVENT_PAYLOAD_MAX_BYTES`, вместо них сохраняется
+отметка об обрезке.
+
+Строки, записанные до появления схем (`data` пуст), читаются как есть.
+Новую версию схемы нужно регистрировать рядом со старой, а не вместо неё,
+чтобы старые строки продолжали декодироваться.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+INT = "int"
+STR = "str"
+BOOL = "bool"
+TRUNCATED_KEY = "_truncated"
+
+
+class EventSchema:
+    """
+    @brief Объявленная форма полезной нагрузки одного типа события.
+
+    @ivar event_type: Тип события
+    @ivar version: Версия схемы (первый байт `data`)
+    @ivar fields: Кортеж `(имя, вид)`; вид — `INT`, `STR`, `BOOL` или
+    кортеж допустимых строк (перечисление)
+    @ivar constants: Поля с постоянным значением, которые не хранятся
+    @ivar session_field: Имя поля, равного идентификатору сессии строки
+    @ivar code_field: Имя поля, хранимого в колонке `code`
+    """
+
+    def __init__(
+        self,
+        event_type: str,
+        fields=(),
+        *,
+        version: int = 1,
+        constants=None,
+        session_field: str | None = None,
+        code_field: str | None = None,
+    ) -> None:
+        self.event_type = event_type
+        self.version = version
+        self.fields = tuple(fields)
+        self.constants = dict(constants or {})
+        self.session_field = session_field
+        self.code_field = code_field
+
+
+def _accepts(kind, value) -> bool:
+    if kind == INT:
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind == STR:
+        return isinstance(value, str)
+    if kind == BOOL:
+        return isinstance(value, bool)
+    return isinstance(value, str) and value in kind
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _pack(schema: EventSchema, values: dict, has_session: bool) -> bytes:
+    out = bytearray([schema.version])
+    # the bit after the field bits records that the session id was present
+    mask = int(has_session) << len(schema.fields)
+    for index, (name, _kind) in enumerate(schema.fields):
+        if name in values:
+            mask |= 1 << index
+    _write_varint(out, mask)
+    for name, kind in schema.fields:
+        if name not in values:
+            continue
+        value = values[name]
+        if kind == INT:
+            _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+        elif kind == STR:
+            raw = value.encode()
+            _write_varint(out, len(raw))
+            out += raw
+        elif kind == BOOL:
+            out.append(1 if value else 0)
+        else:
+            out.append(kind.index(value))
+    return bytes(out)
+
+
+def _unpack(schema: EventSchema, data: bytes) -> tuple[dict, bool]:
+    mask, pos = _read_varint(data, 1)
+    values = {}
+    for index, (name, kind) in enumerate(schema.fields):
+        if not mask & (1 << index):
+            continue
+        if kind == INT:
+            raw, pos = _read_varint(data, pos)
+            values[name] = raw >> 1 if not raw & 1 else -((raw + 1) >> 1)
+        elif kind == STR:
+            length, pos = _read_varint(data, pos)
+            values[name] = data[pos : pos + length].decode()
+            pos += length
+        elif kind == BOOL:
+            values[name] = bool(data[pos])
+            pos += 1
+        else:
+            values[name] = kind[data[pos]]
+            pos += 1
+    return values, bool(mask >> len(schema.fields) & 1)
+
+
+_registry: dict[str, dict[int, EventSchema]] = {}
+
+
+def register(schema: EventSchema) -> EventSchema:
+    """
+    @brief Регистрирует схему типа события.
+
+    @details Последняя зарегистрированная версия используется для записи,
+    все версии — для чтения.
+
+    @param schema: Схема
+    @return Та же схема.
+    """
+    versions = _registry.setdefault(schema.event_type, {})
+    if schema.version in versions or not 0 < schema.version < 256:
+        raise ValueError(f"bad schema version for {schema.event_type}")
+    versions[schema.version] = schema
+    return schema
+
+
+def current_schema(event_type: str) -> EventSchema | None:
+    """
+    @brief Схема, которой кодируются новые события типа.
+
+    @param event_type: Тип события
+    @return Схема либо None, если тип не объявлен.
+    """
+    versions = _registry.get(event_type)
+    return versions[max(versions)] if versions else None
+
+
+PROMO_RESULTS = ("issued", "exists", "not_completed")
+
+register(EventSchema("session_started", constants={"event": "session_started"}))
+register(EventSchema("viewed_asset", [("asset_slug", STR)], session_field="session_id"))
+register(
+    EventSchema("first_view_awarded", [("asset_slug", STR), ("awarded_points", INT)])
+)
+register(
+    EventSchema(
+        "progress_viewed",
+        [
+            ("total_assets", INT),
+            ("viewed_assets", INT),
+            ("remaining_assets", INT),
+            ("total_score", INT),
+        ],
+    )
+)
+register(EventSchema("promo_checked", [("result", PROMO_RESULTS)], code_field="code"))
+register(EventSchema("promo_issued", [("existing", BOOL)], code_field="code"))
+register(EventSchema("promo_sent", [("email", STR)], code_field="code"))
+register(EventSchema("email_submitted", [("email", STR)]))
+
+
+def payload_size(data, code, raw_payload) -> int:
+    """
+    @brief Объём, занимаемый нагрузкой события в колонках строки.
+
+    @details JSON учитывается по длине компактной сериализации.
+
+    @param data: Значение колонки `data`
+    @param code: Значение колонки `code`
+    @param raw_payload: Значение колонки `raw_payload`
+    @return Байты.
+    """
+    size = len(data or b"") + len((code or "").encode())
+    if raw_payload is not None:
+        size += len(
+            json.dumps(raw_payload, cls=DjangoJSONEncoder, separators=(",", ":"))
+        )
+    return size
+
+
+def _cap(extra):
+    size = len(json.dumps(extra, cls=DjangoJSONEncoder, separators=(",", ":")))
+    if size <= settings.EVENT_PAYLOAD_MAX_BYTES:
+        return extra
+    logger.warning("event payload of %d bytes truncated", size)
+    return {TRUNCATED_KEY: size}
+
+
+def encode_payload(event_type: str, session_id, payload, *, cap: bool = True) -> dict:
+    """
+    @brief Раскладывает полезную нагрузку по колонкам `ViewEvent`.
+
+    @param event_type: Тип события
+    @param session_id: Идентификатор сессии события
+    @param payload: Полезная нагрузка (JSON-совместимая)
+    @param cap: Обрезать ли поля вне схемы по `EVENT_PAYLOAD_MAX_BYTES`
+    @return Словарь значений полей `data`, `code` и `raw_payload`.
+    """
+    schema = current_schema(event_type)
+    if schema is None or not isinstance(payload, dict):
+        extra = _cap(payload) if cap and payload else payload
+        return {"data": None, "code": None, "raw_payload": extra}
+    extra = dict(payload)
+    for name, value in schema.constants.items():
+        if extra.get(name) == value:
+            del extra[name]
+    has_session = bool(schema.session_field) and extra.get(schema.session_field) == str(
+        session_id
+    )
+    if has_session:
+        del extra[schema.session_field]
+    code = None
+    if schema.code_field and isinstance(extra.get(schema.code_field), str):
+        code = extra.pop(schema.code_field)
+    known = {}
+    for name, kind in schema.fields:
+        if name in extra and _accepts(kind, extra[name]):
+            known[name] = extra.pop(name)
+    if extra and cap:
+        extra = _cap(extra)
+    return {
+        "data": _pack(schema, known, has_session),
+        "code": code,
+        "raw_payload": extra or None,
+    }
+
+
+def decode_payload(event_type: str, session_id, data, code, raw_payload):
+    """
+    @brief Восстанавливает полезную нагрузку события из колонок.
+
+    @param event_type: Тип события
+    @param session_id: Идентификатор сессии события
+    @param data: Значение колонки `data` (None — строка без схемы)
+    @param code: Значение колонки `code`
+    @param raw_payload: Значение колонки `raw_payload`
+    @return Полезная нагрузка в исходном виде.
+    @throws ValueError Если версия схемы в `data` неизвестна.
+    """
+    if data is None:
+        return raw_payload
+    data = bytes(data)
+    schema = _registry.get(event_type, {}).get(data[0])
+    if schema is None:
+        raise ValueError(f"unknown schema {event_type} v{data[0]}")
+    values, has_session = _unpack(schema, data)
+    payload = dict(schema.constants)
+    if has_session:
+        payload[schema.session_field] = str(session_id)
+    payload.update(values)
+    if code is not None:
+        payload[schema.code_field] = code
+    if raw_payload:
+        payload.update(raw_payload)
+    return payload
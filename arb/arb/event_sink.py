@@ -0,0 +1,283 @@
+"""
+@file event_sink.py
+@brief Приёмник событий `ViewEvent` с отложенной записью через Redis.
+
+Все обработчики пишут события через `log_event`/`log_events`. Типы из
+`EVENT_BUFFER_TYPES` не вставляются в БД на пути запроса, а добавляются
+в список Redis; периодическая задача Celery `drain_event_buffer` выгружает
+их в БД крупными `bulk_create`, откладывая негодные элементы в отдельный
+список. Остальные типы (и все события, если Redis недоступен) пишутся
+сразу. Время события фиксируется в момент вызова, а не в момент выгрузки.
+Нагрузка раскладывается по колонкам схемой типа события (`event_schema`)
+уже при создании объекта.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from redis import RedisError
+
+from . import catalog, etags, event_schema
+from .models import Session, ViewEvent
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = "arb:events:buffer"
+DEAD_KEY = "arb:events:dead"
+LOCK_KEY = "arb:events:drain-lock"
+
+# delete the lock only if this drain still holds it
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def build_event(
+    session_id, event_type: str, payload, asset_id: int | None = None
+) -> ViewEvent:
+    """
+    @brief Создаёт несохранённый объект события.
+
+    @param session_id: Идентификатор сессии
+    @param event_type: Тип события
+    @param payload: Полезная нагрузка (JSON-совместимая)
+    @param asset_id: Идентификатор актива (необязательно)
+    @return Объект `ViewEvent` без первичного ключа.
+    """
+    return ViewEvent(
+        session_id=session_id,
+        asset_id=asset_id,
+        event_type=event_type,
+        timestamp=timezone.now(),
+        **event_schema.encode_payload(event_type, session_id, payload),
+    )
+
+
+def encode_event(event: ViewEvent) -> str:
+    """
+    @brief Сериализует событие для буфера.
+
+    @param event: Объект `ViewEvent`
+    @return JSON-строка.
+    """
+    return json.dumps(
+        {
+            "s": str(event.session_id),
+            "a": event.asset_id,
+            "t": event.event_type,
+            "ts": event.timestamp.isoformat(),
+            "d": base64.b64encode(event.data).decode() if event.data else None,
+            "c": event.code,
+            "p": event.raw_payload,
+        },
+        cls=DjangoJSONEncoder,
+        separators=(",", ":"),
+    )
+
+
+def decode_event(raw: bytes | str) -> ViewEvent:
+    """
+    @brief Восстанавливает событие из элемента буфера.
+
+    @param raw: Элемент списка Redis
+    @return Несохранённый объект `ViewEvent`.
+    """
+    data = json.loads(raw)
+    session_id = uuid.UUID(data["s"])
+    if "d" in data:
+        columns = {
+            "data": base64.b64decode(data["d"]) if data["d"] else None,
+            "code": data["c"],
+            "raw_payload": data["p"],
+        }
+    else:
+        # buffered before payload schemas were introduced
+        columns = event_schema.encode_payload(data["t"], session_id, data["p"])
+    return ViewEvent(
+        session_id=session_id,
+        asset_id=data["a"],
+        event_type=data["t"],
+        timestamp=parse_datetime(data["ts"]),
+        **columns,
+    )
+
+
+def _bump_stats(events: list[ViewEvent]) -> None:
+    # /api/stats/ counts asset views, see rollups.VIEWED_FILTER
+    if any(e.event_type == "viewed_asset" and e.asset_id for e in events):
+        etags.bump(stats=True)
+
+
+def log_events(events: list[ViewEvent]) -> None:
+    """
+    @brief Записывает события: буферизуемые — в Redis, остальные — в БД.
+
+    @param events: Список несохранённых объектов `ViewEvent`
+    """
+    buffered = [e for e in events if e.event_type in settings.EVENT_BUFFER_TYPES]
+    inline = [e for e in events if e.event_type not in settings.EVENT_BUFFER_TYPES]
+    client = get_redis() if buffered else None
+    if buffered:
+        if client is None:
+            inline.extend(buffered)
+        else:
+            try:
+                client.rpush(BUFFER_KEY, *(encode_event(e) for e in buffered))
+            except RedisError:
+                logger.warning(
+                    "event buffer unavailable, writing %d events inline",
+                    len(buffered),
+                )
+                inline.extend(buffered)
+    if inline:
+        ViewEvent.objects.bulk_create(inline)
+        _bump_stats(inline)
+
+
+def log_event(session_id, event_type: str, payload, asset_id: int | None = None):
+    """
+    @brief Записывает одно событие через приёмник.
+
+    @param session_id: Идентификатор сессии
+    @param event_type: Тип события
+    @param payload: Полезная нагрузка (JSON-совместимая)
+    @param asset_id: Идентификатор актива (необязательно)
+    """
+    log_events([build_event(session_id, event_type, payload, asset_id)])
+
+
+def _dead_letter(client, items: list) -> None:
+    logger.error("moving %d undeliverable events to %s", len(items), DEAD_KEY)
+    client.rpush(DEAD_KEY, *items)
+
+
+def _insert(events: list[ViewEvent]) -> None:
+    known = set(
+        Session.objects.filter(id__in={e.session_id for e in events}).values_list(
+            "id", flat=True
+        )
+    )
+    events[:] = [e for e in events if e.session_id in known]
+    assets = catalog.get_catalog().by_id
+    for event in events:
+        if event.asset_id is not None and event.asset_id not in assets:
+            event.asset_id = None
+    ViewEvent.objects.bulk_create(events)
+
+
+def _write_batch(client, raw: list) -> int:
+    """
+    @brief Записывает снятую с буфера пачку, откладывая негодные элементы.
+
+    @param client: Клиент Redis
+    @param raw: Элементы списка Redis
+    @return Число записанных событий.
+    """
+    decoded, dead = [], []
+    for item in raw:
+        try:
+            decoded.append((item, decode_event(item)))
+        except (ValueError, KeyError, TypeError):
+            dead.append(item)
+    events = [event for _, event in decoded]
+    try:
+        with transaction.atomic():
+            _insert(events)
+    except (IntegrityError, DataError):
+        # some row is bad: find it one by one instead of retrying forever
+        events = []
+        for item, event in decoded:
+            try:
+                with transaction.atomic():
+                    _insert(one := [event])
+            except (IntegrityError, DataError):
+                dead.append(item)
+            else:
+                events.extend(one)
+    if dead:
+        _dead_letter(client, dead)
+    _check_latency(events)
+    _bump_stats(events)
+    return len(events)
+
+
+def _check_latency(events: list[ViewEvent]) -> None:
+    # compaction's lag guard only holds for rows inserted within the lag
+    oldest = min((e.timestamp for e in events), default=None)
+    if oldest and timezone.now() - oldest > timedelta(
+        seconds=settings.STATS_COMPACTION_LAG
+    ):
+        logger.warning(
+            "event buffer drained %s after the oldest event, longer than "
+            "STATS_COMPACTION_LAG; /stats/ may miss views",
+            timezone.now() - oldest,
+        )
+
+
+def drain(max_batches: int | None = None) -> int:
+    """
+    @brief Выгружает буфер событий в БД пачками `bulk_create`.
+
+    @details Выгрузка идёт под блокировкой Redis (`SET NX PX`), поэтому
+    перекрывающиеся запуски не конкурируют: второй сразу возвращает 0.
+    Пачка атомарно снимается с головы списка (LRANGE + LTRIM в MULTI).
+    Нераскодируемые элементы и строки, которые БД отвергает, по одной
+    переносятся в `DEAD_KEY` и не блокируют буфер; при прочих ошибках
+    (например, недоступна БД) пачка возвращается в голову списка в
+    исходном порядке. События удалённых сессий отбрасываются, ссылки на
+    удалённые активы обнуляются.
+
+    События сохраняют время вызова, а id получают при выгрузке. Компактизация
+    статистики продвигает отметку по id, пропуская лишь события моложе
+    `STATS_COMPACTION_LAG`, поэтому задержка выгрузки должна оставаться
+    меньше этого порога (`EVENT_BUFFER_FLUSH_INTERVAL` много меньше
+    `STATS_COMPACTION_LAG`); иначе незакоммиченные строки с меньшими id
+    могут не попасть в агрегаты. Превышение пишется в лог.
+
+    @param max_batches: Ограничение числа пачек (None — до опустошения)
+    @return Число записанных событий.
+    """
+    client = get_redis()
+    if client is None:
+        return 0
+    token = uuid.uuid4().hex
+    lock_ms = settings.EVENT_BUFFER_LOCK_TIMEOUT * 1000
+    if not client.set(LOCK_KEY, token, nx=True, px=lock_ms):
+        return 0
+    batch_size = settings.EVENT_BUFFER_BATCH_SIZE
+    written = 0
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            pipe = client.pipeline(transaction=True)
+            pipe.lrange(BUFFER_KEY, 0, batch_size - 1)
+            pipe.ltrim(BUFFER_KEY, batch_size, -1)
+            pipe.pexpire(LOCK_KEY, lock_ms)
+            raw, _, _ = pipe.execute()
+            if not raw:
+                break
+            batches += 1
+            try:
+                written += _write_batch(client, raw)
+            except Exception:
+                client.lpush(BUFFER_KEY, *reversed(raw))
+                raise
+            if len(raw) < batch_size:
+                break
+    finally:
+        client.eval(RELEASE_LOCK_LUA, 1, LOCK_KEY, token)
+    return written
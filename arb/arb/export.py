@@ -0,0 +1,284 @@
+"""
+@file export.py
+@brief Потоковая выгрузка `ViewEvent` и `SessionItemProgress` для аналитики.
+
+Строки читаются страницами по `EXPORT_PAGE_SIZE` с ключевой пагинацией:
+события — по `(session, timestamp, id)` (порядок индекса
+`ve_session_ts_idx`, события сессии идут подряд), прогресс — по `id`.
+Каждая страница — отдельный ограниченный запрос, поэтому память не растёт
+с объёмом выгрузки даже с драйвером MySQL, который буферизует весь
+результат запроса на клиенте. Строки сразу сериализуются в NDJSON или CSV,
+собираются в блоки и при необходимости сжимаются gzip на лету.
+
+Фильтры: полуинтервал дат `[since, until)` (по `timestamp` события или
+`viewed_at` прогресса), `event_type` (только для событий, через запятую)
+и `campaign` (кампания актива). Выгрузку отдают эндпоинт
+`/api/export/<kind>/` (только для администраторов) и команда
+`manage.py export_data`.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import catalog, event_schema
+from .models import SessionItemProgress, ViewEvent
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+BLOCK_SIZE = 64 * 1024
+
+EVENT_FIELDS = (
+    "id",
+    "session_id",
+    "asset",
+    "campaign",
+    "event_type",
+    "timestamp",
+    "payload",
+)
+PROGRESS_FIELDS = (
+    "id",
+    "session_id",
+    "asset",
+    "campaign",
+    "viewed_at",
+    "times_viewed",
+)
+
+
+def _parse_moment(value: str | None, name: str) -> datetime | None:
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        moment = day = None
+    if moment is None and day is None:
+        raise ValueError(f"{name} must be an ISO date or datetime")
+    if moment is None:
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_filters(params) -> dict:
+    """
+    @brief Разбирает фильтры выгрузки.
+
+    @param params: Отображение с ключами `since`, `until`, `event_type`,
+    `campaign` (строки запроса или опции команды)
+    @return Словарь `since`, `until`, `event_types`, `campaign`.
+    @throws ValueError Если дата или кампания некорректны.
+    """
+    campaign = params.get("campaign") or None
+    if campaign is not None and campaign not in catalog.get_catalog().campaign_counts:
+        raise ValueError(f"unknown campaign {campaign}")
+    event_types = [t for t in (params.get("event_type") or "").split(",") if t]
+    return {
+        "since": _parse_moment(params.get("since"), "since"),
+        "until": _parse_moment(params.get("until"), "until"),
+        "event_types": event_types,
+        "campaign": campaign,
+    }
+
+
+def _campaign_asset_ids(campaign: str) -> list[int]:
+    return [
+        a.id for a in catalog.get_catalog().by_id.values() if a.campaign == campaign
+    ]
+
+
+def event_rows(filters: dict, using: str | None = None):
+    """
+    @brief Строки событий по фильтрам, страницами по ключу.
+
+    @param filters: Результат `parse_filters`
+    @param using: Псевдоним БД для чтения (None — маршрутизатор по умолчанию)
+    @return Итератор словарей с полями `EVENT_FIELDS`.
+    """
+    events = ViewEvent.objects.using(using)
+    if filters["since"]:
+        events = events.filter(timestamp__gte=filters["since"])
+    if filters["until"]:
+        events = events.filter(timestamp__lt=filters["until"])
+    if filters["event_types"]:
+        events = events.filter(event_type__in=filters["event_types"])
+    if filters["campaign"]:
+        events = events.filter(asset_id__in=_campaign_asset_ids(filters["campaign"]))
+    events = events.order_by("session_id", "timestamp", "id").values_list(
+        "id",
+        "session_id",
+        "asset_id",
+        "event_type",
+        "timestamp",
+        "data",
+        "code",
+        "raw_payload",
+    )
+    page_size = settings.EXPORT_PAGE_SIZE
+    by_id = catalog.get_catalog().by_id
+    page = events
+    while True:
+        count = 0
+        for event_id, session_id, asset_id, event_type, ts, data, code, raw in page[
+            :page_size
+        ].iterator(chunk_size=page_size):
+            count += 1
+            asset = by_id.get(asset_id)
+            yield {
+                "id": event_id,
+                "session_id": str(session_id),
+                "asset": asset.slug if asset else None,
+                "campaign": asset.campaign if asset else None,
+                "event_type": event_type,
+                "timestamp": ts.isoformat(),
+                "payload": event_schema.decode_payload(
+                    event_type, session_id, data, code, raw
+                ),
+            }
+        if count < page_size:
+            return
+        page = events.filter(
+            Q(session_id__gt=session_id)
+            | Q(session_id=session_id, timestamp__gt=ts)
+            | Q(session_id=session_id, timestamp=ts, id__gt=event_id)
+        )
+
+
+def progress_rows(filters: dict, using: str | None = None):
+    """
+    @brief Строки прогресса по фильтрам, страницами по `id`.
+
+    @param filters: Результат `parse_filters` (`event_types` не применяется)
+    @param using: Псевдоним БД для чтения (None — маршрутизатор по умолчанию)
+    @return Итератор словарей с полями `PROGRESS_FIELDS`.
+    """
+    progress = SessionItemProgress.objects.using(using)
+    if filters["since"]:
+        progress = progress.filter(viewed_at__gte=filters["since"])
+    if filters["until"]:
+        progress = progress.filter(viewed_at__lt=filters["until"])
+    if filters["campaign"]:
+        progress = progress.filter(
+            asset_id__in=_campaign_asset_ids(filters["campaign"])
+        )
+    progress = progress.order_by("id").values_list(
+        "id", "session_id", "asset_id", "viewed_at", "times_viewed"
+    )
+    page_size = settings.EXPORT_PAGE_SIZE
+    by_id = catalog.get_catalog().by_id
+    last_id = 0
+    while True:
+        count = 0
+        for row_id, session_id, asset_id, viewed_at, times_viewed in progress.filter(
+            id__gt=last_id
+        )[:page_size].iterator(chunk_size=page_size):
+            count += 1
+            last_id = row_id
+            asset = by_id.get(asset_id)
+            yield {
+                "id": row_id,
+                "session_id": str(session_id),
+                "asset": asset.slug if asset else None,
+                "campaign": asset.campaign if asset else None,
+                "viewed_at": viewed_at.isoformat() if viewed_at else None,
+                "times_viewed": times_viewed,
+            }
+        if count < page_size:
+            return
+
+
+KINDS = {
+    "events": (EVENT_FIELDS, event_rows),
+    "progress": (PROGRESS_FIELDS, progress_rows),
+}
+
+
+def _encode(value):
+    if isinstance(value, dict | list):
+        return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False)
+    return value
+
+
+def render(kind: str, fmt: str, filters: dict, using: str | None = None):
+    """
+    @brief Сериализует выгрузку блоками байтов.
+
+    @param kind: `events` или `progress`
+    @param fmt: `ndjson` или `csv`
+    @param filters: Результат `parse_filters`
+    @param using: Псевдоним БД для чтения
+    @return Итератор блоков (около `BLOCK_SIZE` байт).
+    @throws ValueError Если формат или вид выгрузки неизвестны.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of: {', '.join(KINDS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    if kind != "events" and filters["event_types"]:
+        raise ValueError("event_type applies to events only")
+    fields, rows = KINDS[kind]
+    return _blocks(fields, rows(filters, using), fmt)
+
+
+def _blocks(fields, rows, fmt: str):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(fields)
+    for row in rows:
+        if writer is not None:
+            writer.writerow([_encode(row[field]) for field in fields])
+        else:
+            buffer.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+            buffer.write("\n")
+        if buffer.tell() >= BLOCK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_blocks(blocks):
+    """
+    @brief Сжимает поток блоков в формат gzip на лету.
+
+    @param blocks: Итератор байтовых блоков
+    @return Итератор сжатых блоков.
+    """
+    compressor = zlib.compressobj(settings.EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def aiterate(blocks):
+    """
+    @brief Отдаёт синхронный поток блоков асинхронному серверу.
+
+    @details Под ASGI Django читает синхронный итератор ответа целиком в
+    память; здесь каждый блок берётся отдельным `sync_to_async`, так что
+    в памяти остаётся только текущая страница.
+
+    @param blocks: Итератор байтовых блоков
+    @return Асинхронный итератор тех же блоков.
+    """
+    done = object()
+    while (block := await sync_to_async(next)(blocks, done)) is not done:
+        yield block
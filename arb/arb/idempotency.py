@@ -0,0 +1,221 @@
+"""
+@file idempotency.py
+@brief Повторяемые запросы по заголовку `Idempotency-Key`.
+
+Клиенты повторяют пишущие запросы после таймаутов. Если запрос пришёл
+с заголовком `Idempotency-Key`, первый из них занимает ключ в кэше
+(`cache.add`) и выполняется, а его завершённый ответ сохраняется на
+`IDEMPOTENCY_TTL` секунд; повторы получают сохранённый ответ с заголовком
+`Idempotent-Replayed: true`. Повтор, пришедший, пока первый запрос ещё
+выполняется, ждёт его ответа до `IDEMPOTENCY_WAIT` секунд, затем получает
+409; ключ выполняющегося запроса живёт не дольше `IDEMPOTENCY_LOCK_TTL`
+секунд. Повтор с тем же ключом, но другим телом отклоняется с 422. Ключи
+разделены по клиенту — `session_id` запроса, а без него адрес клиента, как
+у ограничителя частоты, — чтобы чужой клиент с тем же ключом не получил,
+например, идентификатор чужой сессии из `session_start`. Ответы 5xx
+не сохраняются, чтобы клиент мог повторить запрос. Исходы считаются
+в метрике `arb_idempotency_requests_total`. Если кэш недоступен, запросы
+выполняются как обычно.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from redis import RedisError
+
+from . import metrics, ratelimit
+
+logger = logging.getLogger(__name__)
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+PENDING = "pending"
+
+
+def _cache_key(route: str, client: str, key: str) -> str:
+    digest = hashlib.sha256(f"{client}\n{key}".encode()).hexdigest()
+    return f"idem:{route}:{digest}"
+
+
+def _client(request) -> str:
+    """
+    @brief Область ключей клиента: сессия из запроса, иначе адрес.
+    """
+    session_id = ratelimit.request_session_id(request)
+    return (
+        f"session:{session_id}" if session_id else f"ip:{ratelimit.client_ip(request)}"
+    )
+
+
+def _fingerprint(request) -> str:
+    return hashlib.sha256(
+        request.method.encode() + b" " + request.path.encode() + b"\n" + request.body
+    ).hexdigest()
+
+
+def _stored(response) -> dict | None:
+    """
+    @brief Снимок завершённого ответа для повтора (None — не сохранять).
+    """
+    if response.status_code >= 500 or response.streaming:
+        return None
+    if hasattr(response, "render") and not response.is_rendered:
+        response.render()
+    return {
+        "status": response.status_code,
+        "content_type": response.get("Content-Type"),
+        "content": response.content,
+    }
+
+
+def _replay(entry: dict) -> HttpResponse:
+    response = HttpResponse(
+        entry["content"], status=entry["status"], content_type=entry["content_type"]
+    )
+    response[REPLAYED_HEADER] = "true"
+    return response
+
+
+def _resolve(route: str, entry, fingerprint: str):
+    """
+    @brief Ответ на повтор по записи кэша.
+
+    @return Ответ либо None, если первый запрос ещё выполняется.
+    """
+    if entry["fingerprint"] != fingerprint:
+        metrics.increment(metrics.IDEMPOTENCY_TOTAL, route, "mismatch")
+        return JsonResponse(
+            {"detail": f"{HEADER} was already used for a different request"},
+            status=422,
+        )
+    if entry["state"] == PENDING:
+        return None
+    metrics.increment(metrics.IDEMPOTENCY_TOTAL, route, "replayed")
+    return _replay(entry)
+
+
+def _conflict(route: str) -> JsonResponse:
+    metrics.increment(metrics.IDEMPOTENCY_TOTAL, route, "conflict")
+    response = JsonResponse(
+        {"detail": f"a request with this {HEADER} is still in progress"},
+        status=409,
+    )
+    response["Retry-After"] = "1"
+    return response
+
+
+def idempotent(route: str):
+    """
+    @brief Декоратор обработчика, поддерживающий `Idempotency-Key`.
+
+    @details Подходит и для синхронных (DRF), и для асинхронных обработчиков;
+    ставится над `@api_view`/`@async_api_view`.
+
+    @param route: Имя маршрута (область ключей и метка метрики)
+    @return Декоратор.
+    """
+
+    def decorator(view):
+        def prepare(request):
+            key = request.headers.get(HEADER)
+            if not key:
+                return None
+            if len(key) > MAX_KEY_LENGTH:
+                return JsonResponse({"detail": f"{HEADER} is too long"}, status=400)
+            pending = {"state": PENDING, "fingerprint": _fingerprint(request)}
+            return _cache_key(route, _client(request), key), pending
+
+        if iscoroutinefunction(view):
+
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                prepared = prepare(request)
+                if not isinstance(prepared, tuple):
+                    return prepared or await view(request, *args, **kwargs)
+                cache_key, pending = prepared
+                try:
+                    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+                    while not await cache.aadd(
+                        cache_key, pending, settings.IDEMPOTENCY_LOCK_TTL
+                    ):
+                        entry = await cache.aget(cache_key)
+                        if entry is not None:
+                            done = _resolve(route, entry, pending["fingerprint"])
+                            if done is not None:
+                                return done
+                        if time.monotonic() >= deadline:
+                            return _conflict(route)
+                        await asyncio.sleep(POLL_INTERVAL)
+                except RedisError:
+                    logger.warning("idempotency cache unavailable", exc_info=True)
+                    return await view(request, *args, **kwargs)
+                metrics.increment(metrics.IDEMPOTENCY_TOTAL, route, "stored")
+                try:
+                    response = await view(request, *args, **kwargs)
+                except BaseException:
+                    await cache.adelete(cache_key)
+                    raise
+                entry = _stored(response)
+                if entry is None:
+                    await cache.adelete(cache_key)
+                else:
+                    await cache.aset(
+                        cache_key,
+                        {**pending, **entry, "state": "done"},
+                        settings.IDEMPOTENCY_TTL,
+                    )
+                return response
+
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            prepared = prepare(request)
+            if not isinstance(prepared, tuple):
+                return prepared or view(request, *args, **kwargs)
+            cache_key, pending = prepared
+            try:
+                deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+                while not cache.add(cache_key, pending, settings.IDEMPOTENCY_LOCK_TTL):
+                    entry = cache.get(cache_key)
+                    if entry is not None:
+                        done = _resolve(route, entry, pending["fingerprint"])
+                        if done is not None:
+                            return done
+                    if time.monotonic() >= deadline:
+                        return _conflict(route)
+                    time.sleep(POLL_INTERVAL)
+            except RedisError:
+                logger.warning("idempotency cache unavailable", exc_info=True)
+                return view(request, *args, **kwargs)
+            metrics.increment(metrics.IDEMPOTENCY_TOTAL, route, "stored")
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                cache.delete(cache_key)
+                raise
+            entry = _stored(response)
+            if entry is None:
+                cache.delete(cache_key)
+            else:
+                cache.set(
+                    cache_key,
+                    {**pending, **entry, "state": "done"},
+                    settings.IDEMPOTENCY_TTL,
+                )
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,194 @@
+"""
+@file live.py
+@brief Рассылка обновлений сессии открытым WebSocket-соединениям.
+
+Изменения сессии (`score`, `progress`, `promo_issued`) публикуются в канал
+Redis `arb:live:session:<id>` после фиксации транзакции, в которой они
+произошли, поэтому клиент не увидит балл из откатившейся транзакции.
+Публикует общая логика начисления (`scoring`, пакетный `view_batch`), то
+есть обновления приходят независимо от того, пришёл просмотр по HTTP или
+через сокет.
+
+Каждый процесс держит одну подписку Redis (`Hub`) на каналы тех сессий, у
+которых в нём открыт сокет, и раскладывает сообщения по очередям
+соединений; так просмотр, зарегистрированный любым воркером, доходит до
+клиента, подключённого к другому. Без Redis или при его ошибке сообщения
+раздаются только соединениям текущего процесса.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import weakref
+from collections import defaultdict
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.db import transaction
+from redis import RedisError
+
+from . import metrics
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "arb:live:session:"
+
+
+def channel(session_id) -> str:
+    """
+    @brief Канал Redis сессии.
+
+    @param session_id: Идентификатор сессии
+    @return Имя канала.
+    """
+    return f"{CHANNEL_PREFIX}{session_id}"
+
+
+class Hub:
+    """
+    @brief Подписки соединений одного цикла событий.
+
+    @ivar loop: Цикл событий, в котором живут соединения
+    @ivar queues: Очереди соединений по идентификатору сессии
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.queues: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+
+    async def subscribe(self, session_id: str) -> asyncio.Queue:
+        """
+        @brief Подписывает соединение на обновления сессии.
+
+        @param session_id: Идентификатор сессии
+        @return Очередь, в которую будут приходить сообщения (JSON-строки).
+        """
+        queue = asyncio.Queue(maxsize=settings.WS_QUEUE_SIZE)
+        first = not self.queues[session_id]
+        self.queues[session_id].add(queue)
+        if first and settings.REDIS_URL:
+            await self._redis_subscribe(session_id)
+        return queue
+
+    async def unsubscribe(self, session_id: str, queue: asyncio.Queue) -> None:
+        """
+        @brief Отписывает соединение.
+
+        @param session_id: Идентификатор сессии
+        @param queue: Очередь из `subscribe`
+        """
+        queues = self.queues.get(session_id)
+        if queues is not None:
+            queues.discard(queue)
+            if queues:
+                return
+            del self.queues[session_id]
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.unsubscribe(channel(session_id))
+            except RedisError:
+                logger.warning("live: unsubscribe from %s failed", session_id)
+
+    def deliver(self, session_id: str, data: str) -> None:
+        """
+        @brief Кладёт сообщение в очереди соединений сессии.
+
+        @details Вызывается в цикле событий хаба. Если клиент не успевает
+        читать и очередь полна, сообщение отбрасывается: следующее
+        `progress` всё равно несёт полное состояние.
+
+        @param session_id: Идентификатор сессии
+        @param data: Сообщение (JSON-строка)
+        """
+        for queue in self.queues.get(session_id, ()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                metrics.increment(metrics.WS_MESSAGES_TOTAL, "push", "dropped")
+
+    async def _redis_subscribe(self, session_id: str) -> None:
+        try:
+            if self._pubsub is None:
+                client = aioredis.Redis.from_url(
+                    settings.REDIS_URL,
+                    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    health_check_interval=30,
+                )
+                self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(channel(session_id))
+        except RedisError:
+            logger.warning("live: subscribe to %s failed", session_id)
+            return
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        while self.queues and self._pubsub.subscribed:
+            try:
+                async for message in self._pubsub.listen():
+                    session_id = message["channel"].decode()[len(CHANNEL_PREFIX) :]
+                    self.deliver(session_id, message["data"].decode())
+            except RedisError:
+                # the connection resubscribes its channels on reconnect
+                logger.warning("live: subscription lost, reconnecting")
+                await asyncio.sleep(1)
+
+
+_hubs: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Hub] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_hub() -> Hub:
+    """
+    @brief Хаб текущего цикла событий (создаётся при первом обращении).
+
+    @return Объект `Hub`.
+    """
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = Hub(loop)
+    return hub
+
+
+def _deliver_local(session_id: str, data: str) -> None:
+    for hub in list(_hubs.values()):
+        if session_id in hub.queues and not hub.loop.is_closed():
+            hub.loop.call_soon_threadsafe(hub.deliver, session_id, data)
+
+
+def publish(session_id, *messages: dict) -> None:
+    """
+    @brief Публикует сообщения подписчикам сессии во всех процессах.
+
+    @param session_id: Идентификатор сессии
+    @param messages: Сообщения (словари с полем `type`)
+    """
+    session_id = str(session_id)
+    client = get_redis()
+    for message in messages:
+        data = json.dumps(message)
+        metrics.increment(metrics.WS_MESSAGES_TOTAL, "push", message["type"])
+        if client is not None:
+            try:
+                client.publish(channel(session_id), data)
+                continue
+            except RedisError:
+                logger.warning("live: publish to %s failed", session_id)
+        _deliver_local(session_id, data)
+
+
+def publish_on_commit(session_id, *messages: dict) -> None:
+    """
+    @brief Публикует сообщения после фиксации текущей транзакции.
+
+    @param session_id: Идентификатор сессии
+    @param messages: Сообщения (словари с полем `type`)
+    """
+    transaction.on_commit(lambda: publish(session_id, *messages))
@@ -0,0 +1,335 @@
+"""
+@file loadgen.py
+@brief Генератор нагрузки, воспроизводящий клиентский сценарий посетителя.
+
+Каждый виртуальный посетитель проходит реальный путь клиента: `session/start`,
+просмотры активов каталога, `user/email`, `progress` и `promo`. Запросы
+выполняются либо по HTTP к развёрнутому серверу, либо внутри процесса через
+тестовый клиент Django (тогда дополнительно считаются SQL-запросы на каждый
+вызов). Посетители прибывают пуассоновским потоком с заданной интенсивностью
+и делают паузы «на раздумье» между шагами.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+ENDPOINTS = ("session/start", "view", "user/email", "progress", "promo")
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+# .invalid never resolves (RFC 2606) and is never mailed, see tasks.is_mailable
+EMAIL_DOMAIN = "loadtest.invalid"
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """
+    @brief Перцентиль методом ближайшего ранга.
+
+    @param values: Отсортированный список значений
+    @param pct: Перцентиль от 0 до 100
+    @return Значение перцентиля (0 для пустого списка).
+    """
+    if not values:
+        return 0.0
+    rank = max(int(-(-pct * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+class HttpTransport:
+    """
+    @brief Выполняет запросы к развёрнутому серверу по HTTP.
+
+    @ivar base_url: Базовый URL без завершающего слэша
+    @ivar timeout: Таймаут запроса в секундах
+    """
+
+    counts_queries = False
+
+    def __init__(self, base_url: str, timeout: float = 10.0) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: dict | None = None):
+        """
+        @brief Отправляет запрос.
+
+        @param method: HTTP-метод
+        @param path: Путь относительно `/api/`
+        @param body: Тело JSON (для POST)
+        @return Кортеж `(status, json, queries)`; `queries` берётся из
+        заголовка `Server-Timing` (None, если его нет).
+        """
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(  # noqa: S310
+            f"{self.base_url}/api/{path}",
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:  # noqa: S310
+                status, raw, headers = resp.status, resp.read(), resp.headers
+        except urllib.error.HTTPError as exc:
+            status, raw, headers = exc.code, exc.read(), exc.headers
+        try:
+            payload = json.loads(raw) if raw else {}
+        except ValueError:
+            payload = {}
+        match = SERVER_TIMING_QUERIES.search(headers.get("Server-Timing") or "")
+        return status, payload, int(match.group(1)) if match else None
+
+
+class InProcessTransport:
+    """
+    @brief Выполняет запросы в текущем процессе через `django.test.Client`.
+
+    @details Для каждого запроса считается число SQL-выражений на
+    соединении текущего потока.
+    """
+
+    counts_queries = True
+
+    def __init__(self) -> None:
+        host = next(
+            (h.lstrip(".") for h in settings.ALLOWED_HOSTS if h != "*"), "localhost"
+        )
+        self._host = host
+        self._local = threading.local()
+
+    def _client(self) -> Client:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = Client(SERVER_NAME=self._host)
+            self._local.client = client
+        return client
+
+    def request(self, method: str, path: str, body: dict | None = None):
+        """
+        @brief Отправляет запрос.
+
+        @param method: HTTP-метод
+        @param path: Путь относительно `/api/`
+        @param body: Тело JSON (для POST)
+        @return Кортеж `(status, json, queries)`.
+        """
+        client = self._client()
+        with CaptureQueriesContext(connection) as ctx:
+            if method == "POST":
+                resp = client.post(
+                    f"/api/{path}", body or {}, content_type="application/json"
+                )
+            else:
+                resp = client.get(f"/api/{path}")
+        try:
+            payload = json.loads(resp.content) if resp.content else {}
+        except ValueError:
+            payload = {}
+        return resp.status_code, payload, len(ctx.captured_queries)
+
+
+class LoadStats:
+    """
+    @brief Потокобезопасный сборщик замеров по эндпоинтам.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.visitors = 0
+
+    def record(self, endpoint: str, elapsed: float, status: int | None, queries):
+        """
+        @brief Сохраняет замер одного запроса.
+
+        @param endpoint: Имя эндпоинта из `ENDPOINTS`
+        @param elapsed: Длительность в секундах
+        @param status: HTTP-статус (None — ошибка транспорта)
+        @param queries: Число SQL-запросов или None
+        """
+        with self._lock:
+            self.latencies[endpoint].append(elapsed * 1000)
+            self.statuses[endpoint][status] += 1
+            if status is None or status >= 500:  # noqa: PLR2004
+                self.errors[endpoint] += 1
+            if queries is not None:
+                self.queries[endpoint].append(queries)
+
+    def visitor_done(self) -> None:
+        """Отмечает завершение сценария одного посетителя."""
+        with self._lock:
+            self.visitors += 1
+
+    def summary(self, elapsed: float) -> list[dict]:
+        """
+        @brief Сводка по эндпоинтам.
+
+        @param elapsed: Общее время прогона в секундах
+        @return Список строк отчёта в порядке `ENDPOINTS`.
+        """
+        rows = []
+        for endpoint in ENDPOINTS:
+            latencies = sorted(self.latencies.get(endpoint, []))
+            if not latencies:
+                continue
+            queries = self.queries.get(endpoint, [])
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "requests": len(latencies),
+                    "errors": self.errors.get(endpoint, 0),
+                    "rps": len(latencies) / elapsed if elapsed else 0.0,
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                    "queries_avg": sum(queries) / len(queries) if queries else None,
+                    "queries_max": max(queries) if queries else None,
+                    "statuses": dict(self.statuses[endpoint]),
+                }
+            )
+        return rows
+
+
+class Visitor:
+    """
+    @brief Сценарий одного посетителя выставки.
+
+    @ivar transport: Транспорт запросов
+    @ivar stats: Сборщик замеров
+    @ivar slugs: Slug активов, которые посетитель просмотрит
+    @ivar think_time: Средняя пауза между шагами в секундах
+    """
+
+    def __init__(self, transport, stats: LoadStats, slugs, think_time, rng) -> None:
+        self.transport = transport
+        self.stats = stats
+        self.slugs = slugs
+        self.think_time = think_time
+        self.rng = rng
+
+    def _call(self, endpoint: str, method: str, path: str, body=None):
+        started = time.perf_counter()
+        try:
+            status, payload, queries = self.transport.request(method, path, body)
+        except (OSError, urllib.error.URLError):
+            self.stats.record(endpoint, time.perf_counter() - started, None, None)
+            return None, {}
+        self.stats.record(endpoint, time.perf_counter() - started, status, queries)
+        return status, payload
+
+    def _think(self) -> None:
+        if self.think_time > 0:
+            time.sleep(self.rng.expovariate(1 / self.think_time))
+
+    def run(self) -> None:
+        """Проходит сценарий; при неудачном старте сессии прерывается."""
+        status, payload = self._call("session/start", "POST", "session/start/", {})
+        session_id = payload.get("session_id")
+        if status != 201 or not session_id:  # noqa: PLR2004
+            return
+        for slug in self.slugs:
+            self._think()
+            self._call(
+                "view",
+                "POST",
+                "view/",
+                {"session_id": session_id, "asset_slug": slug, "source": "loadtest"},
+            )
+        self._think()
+        self._call(
+            "user/email",
+            "POST",
+            "user/email/",
+            {
+                "session_id": session_id,
+                "email": f"loadtest+{uuid.uuid4().hex[:12]}@{EMAIL_DOMAIN}",
+            },
+        )
+        self._call("progress", "GET", f"progress/?session_id={session_id}")
+        self._call("promo", "GET", f"promo/?session_id={session_id}")
+
+
+def run_load(  # noqa: PLR0913
+    transport,
+    slugs: list[str],
+    visitors: int,
+    concurrency: int,
+    arrival_rate: float,
+    think_time: float,
+    views_per_visitor: int | None = None,
+    seed: int | None = None,
+) -> tuple[LoadStats, float]:
+    """
+    @brief Прогоняет нагрузку и собирает замеры.
+
+    @details При `concurrency == 1` посетители обслуживаются в текущем
+    потоке. Иначе используется пул потоков; для внутрипроцессного
+    транспорта рабочие потоки закрывают свои соединения с БД по завершении.
+
+    @param transport: `HttpTransport` или `InProcessTransport`
+    @param slugs: Slug активов каталога
+    @param visitors: Число посетителей
+    @param concurrency: Максимум одновременно активных посетителей
+    @param arrival_rate: Интенсивность прибытия (посетителей в секунду,
+    0 — все сразу)
+    @param think_time: Средняя пауза между шагами в секундах
+    @param views_per_visitor: Сколько активов просматривает посетитель
+    (по умолчанию — все)
+    @param seed: Зерно генератора случайных чисел
+    @return Кортеж `(stats, elapsed_seconds)`.
+    """
+    stats = LoadStats()
+    rng = random.Random(seed)  # noqa: S311
+    count = len(slugs) if views_per_visitor is None else views_per_visitor
+
+    def make_visitor() -> Visitor:
+        order = rng.sample(slugs, min(count, len(slugs)))
+        visitor_rng = random.Random(rng.random())  # noqa: S311
+        return Visitor(transport, stats, order, think_time, visitor_rng)
+
+    def arrivals():
+        next_arrival = time.perf_counter()
+        for _ in range(visitors):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield make_visitor()
+            if arrival_rate > 0:
+                next_arrival += rng.expovariate(arrival_rate)
+
+    def serve(visitor: Visitor, close_connection: bool) -> None:
+        try:
+            visitor.run()
+        finally:
+            stats.visitor_done()
+            if close_connection:
+                connection.close()
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for visitor in arrivals():
+            serve(visitor, close_connection=False)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(serve, visitor, transport.counts_queries)
+                for visitor in arrivals()
+            ]
+            for future in futures:
+                future.result()
+    return stats, time.perf_counter() - started
@@ -0,0 +1,53 @@
+"""
+@file archive_events.py
+@brief Команда `manage.py archive_events`: перенос старых событий в архив.
+
+Переносит закрытые дни `ViewEvent` старше заданного возраста в сжатые
+поколоночные сегменты `EVENT_ARCHIVE_DIR` и удаляет их строки из БД.
+Дни, ещё не свёрнутые в агрегаты статистики, пропускаются.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from arb import archive
+
+
+class Command(BaseCommand):
+    """Архивирует закрытые дни лога событий."""
+
+    help = "Move closed ViewEvent days into compressed archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.EVENT_ARCHIVE_OLDER_THAN_DAYS,
+            help="Archive days older than this many days.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=None,
+            help="Rows per DELETE (defaults to EVENT_ARCHIVE_CHUNK_SIZE).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the days that would be archived.",
+        )
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        if options["dry_run"]:
+            for row in archive.closed_days(options["older_than"]):
+                state = "archive" if row["compacted"] else "skip (not compacted)"
+                self.stdout.write(f"{row['day']}: {row['events']} events, {state}")
+            return
+        result = archive.archive_events(options["older_than"], options["chunk_size"])
+        for day, deleted in result.items():
+            self.stdout.write(f"{day}: archived {deleted} events")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"done: {sum(result.values())} events from {len(result)} days archived"
+            )
+        )
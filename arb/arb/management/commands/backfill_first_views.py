@@ -0,0 +1,56 @@
+"""
+@file backfill_first_views.py
+@brief Команда `manage.py backfill_first_views`: первый актив старых сессий.
+
+Заполняет `Session.first_asset`/`first_viewed_at` у сессий, начатых до
+появления этих полей, по самому раннему `SessionItemProgress` сессии
+(лог событий мог быть уже архивирован). Идёт порциями по id сессии и не
+трогает сессии, у которых поля уже заполнены, поэтому безопасна для
+повторного запуска на работающем сервисе.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from arb.models import Session, SessionItemProgress
+
+
+class Command(BaseCommand):
+    """Заполняет первый просмотренный актив у сессий без него."""
+
+    help = "Backfill Session.first_asset and first_viewed_at from view progress."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        pending = Session.objects.filter(first_asset__isnull=True).order_by("id")
+        last_id = None
+        filled = 0
+        while True:
+            batch = pending.filter(id__gt=last_id) if last_id else pending
+            session_ids = list(
+                batch.values_list("id", flat=True)[: options["batch_size"]]
+            )
+            if not session_ids:
+                break
+            last_id = session_ids[-1]
+            firsts = {}
+            for session_id, asset_id, viewed_at in (
+                SessionItemProgress.objects.filter(
+                    session_id__in=session_ids,
+                    viewed_at__isnull=False,
+                    times_viewed__gt=0,
+                )
+                .order_by("session_id", "viewed_at", "id")
+                .values_list("session_id", "asset_id", "viewed_at")
+            ):
+                firsts.setdefault(session_id, (asset_id, viewed_at))
+            with transaction.atomic():
+                for session_id, (asset_id, viewed_at) in firsts.items():
+                    # a view landing meanwhile has already set the real first
+                    filled += Session.objects.filter(
+                        id=session_id, first_asset__isnull=True
+                    ).update(first_asset_id=asset_id, first_viewed_at=viewed_at)
+            self.stdout.write(f"filled {filled} sessions")
+        self.stdout.write(self.style.SUCCESS(f"done: {filled} sessions backfilled"))
@@ -0,0 +1,132 @@
+"""
+@file bench_db_pool.py
+@brief Команда `manage.py bench_db_pool`: пул соединений против соединения на запрос.
+
+Имитирует запросы API: каждый «запрос» берёт соединение, выполняет
+`--queries` коротких SELECT и закрывает соединение, как это делает Django
+в конце запроса при `CONN_MAX_AGE=0`. Прогоняет сценарий через
+стандартный бэкенд `django.db.backends.mysql` (новое соединение на запрос)
+и через `arb.mysql_pool` на тех же параметрах подключения `default` и
+печатает пропускную способность, задержки, число соединений, открытых
+сервером (`Connections`), и состояние пула.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.utils import load_backend
+
+from arb import loadgen
+from arb.mysql_pool.base import pools
+
+ENGINES = {
+    "connect": "django.db.backends.mysql",
+    "pooled": "arb.mysql_pool",
+}
+
+
+def _server_connections() -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Connections'")
+        return int(cursor.fetchone()[1])
+
+
+class Command(BaseCommand):
+    help = "Benchmark pooled MySQL connections against connect-per-request."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--modes",
+            default="connect,pooled",
+            help="Comma-separated modes to run: connect, pooled.",
+        )
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--queries", type=int, default=3, help="SELECTs per simulated request."
+        )
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            default=None,
+            help="Pool MAX_SIZE (defaults to --concurrency).",
+        )
+
+    def _run(self, mode: str, options) -> tuple[list[float], int, float]:
+        settings_dict = {
+            **connection.settings_dict,
+            "ENGINE": ENGINES[mode],
+            "CONN_MAX_AGE": 0,
+            "POOL": {
+                **(connection.settings_dict.get("POOL") or {}),
+                "MAX_SIZE": options["pool_size"] or options["concurrency"],
+            },
+        }
+        backend = load_backend(ENGINES[mode])
+        alias = f"bench_{mode}"
+        remaining = [options["requests"]]
+        lock = threading.Lock()
+        latencies: list[float] = []
+        errors = [0]
+
+        def worker():
+            wrapper = backend.DatabaseWrapper(dict(settings_dict), alias)
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                started = time.perf_counter()
+                try:
+                    with wrapper.cursor() as cursor:
+                        for _ in range(options["queries"]):
+                            cursor.execute("SELECT 1")
+                            cursor.fetchone()
+                except Exception:  # noqa: BLE001
+                    with lock:
+                        errors[0] += 1
+                finally:
+                    wrapper.close()
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+
+        threads = [
+            threading.Thread(target=worker) for _ in range(options["concurrency"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(latencies), errors[0], time.perf_counter() - started
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        if connection.vendor != "mysql":
+            raise CommandError("the benchmark needs the default database on MySQL")
+        modes = [m for m in options["modes"].split(",") if m]
+        if set(modes) - set(ENGINES):
+            raise CommandError("--modes accepts only connect and pooled")
+
+        self.stdout.write(
+            f"{'mode':<8}{'reqs':>8}{'err':>6}{'rps':>9}{'p50ms':>9}{'p99ms':>9}"
+            f"{'opened':>8}"
+        )
+        for mode in modes:
+            before = _server_connections()
+            latencies, errors, elapsed = self._run(mode, options)
+            opened = _server_connections() - before
+            rps = len(latencies) / elapsed if elapsed else 0.0
+            self.stdout.write(
+                f"{mode:<8}{len(latencies):>8}{errors:>6}{rps:>9.1f}"
+                f"{loadgen.percentile(latencies, 50):>9.2f}"
+                f"{loadgen.percentile(latencies, 99):>9.2f}{opened:>8}"
+            )
+        pool = pools().get("bench_pooled")
+        if pool is not None:
+            self.stdout.write(f"pool: {pool.stats()}")
+            pool.close_all()
@@ -0,0 +1,238 @@
+"""
+@file bench_servers.py
+@brief Команда `manage.py bench_servers`: сравнение WSGI- и ASGI-развёртывания.
+
+По очереди поднимает текущее WSGI-развёртывание (`runserver`, поток на
+запрос, синхронные DRF-обработчики) и ASGI-развёртывание (`uvicorn`
+с `ASYNC_VIEWS=1`), прогоняет через каждое сценарий `loadtest` на нескольких
+уровнях конкурентности и печатает пропускную способность, задержки, ошибки
+и пиковую память (RSS) серверных процессов. Сравнение «конкурентность на
+мегабайт» показывает, сколько одновременных посетителей выдерживает каждая
+схема при одинаковом бюджете памяти. Работает только в Linux (RSS читается
+из `/proc`); сервер использует ту же БД и Redis, что и команда.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from arb import catalog, loadgen
+
+MANAGE_DIR = Path(settings.BASE_DIR) / "arb"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree(root_pid: int) -> list[int]:
+    """
+    @brief Идентификаторы процесса и всех его потомков.
+
+    @param root_pid: Корневой процесс
+    @return Список pid.
+    """
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def _rss_bytes(root_pid: int) -> int:
+    """
+    @brief Суммарный RSS дерева процессов.
+
+    @param root_pid: Корневой процесс сервера
+    @return Байты.
+    """
+    total = 0
+    for pid in _process_tree(root_pid):
+        try:
+            status = Path(f"/proc/{pid}/status").read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith("VmRSS:"):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+class _RssSampler(threading.Thread):
+    """Фоновый замер пикового RSS сервера."""
+
+    def __init__(self, pid: int, interval: float = 0.2) -> None:
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, _rss_bytes(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+class Command(BaseCommand):
+    """Сравнение WSGI (runserver) и ASGI (uvicorn) под нагрузкой."""
+
+    help = "Benchmark the WSGI and ASGI deployments with the loadtest flow."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--modes",
+            default="wsgi,asgi",
+            help="Comma-separated deployments to run: wsgi, asgi.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            default="10,50,200",
+            help="Comma-separated concurrency levels.",
+        )
+        parser.add_argument("--visitors", type=int, default=200)
+        parser.add_argument(
+            "--think-time",
+            type=float,
+            default=0.1,
+            help="Mean pause between visitor steps, seconds.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="uvicorn worker processes (runserver always runs one).",
+        )
+        parser.add_argument("--timeout", type=float, default=30.0)
+        parser.add_argument("--seed", type=int, default=None)
+
+    def _start_server(self, mode: str, port: int, workers: int) -> subprocess.Popen:
+        env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+        if mode == "wsgi":
+            env["ASYNC_VIEWS"] = "0"
+            cmd = [
+                sys.executable,
+                "manage.py",
+                "runserver",
+                "--noreload",
+                f"127.0.0.1:{port}",
+            ]
+        else:
+            env["ASYNC_VIEWS"] = "1"
+            cmd = [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "arb.asgi:application",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(port),
+                "--workers",
+                str(workers),
+                "--no-access-log",
+            ]
+        server = subprocess.Popen(  # noqa: S603
+            cmd,
+            cwd=MANAGE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                break
+            try:
+                with urllib.request.urlopen(  # noqa: S310
+                    f"http://127.0.0.1:{port}/api/health/", timeout=1
+                ):
+                    return server
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.2)
+        server.kill()
+        raise CommandError(f"{mode} server did not start on port {port}")
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        if not Path("/proc/self/status").exists():
+            raise CommandError("RSS sampling requires Linux /proc")
+        slugs = sorted(catalog.get_catalog().by_slug)
+        if not slugs:
+            raise CommandError("no assets to view; create Asset rows first")
+        modes = [m for m in options["modes"].split(",") if m]
+        if set(modes) - {"wsgi", "asgi"}:
+            raise CommandError("--modes accepts only wsgi and asgi")
+        levels = [int(c) for c in options["concurrency"].split(",") if c]
+
+        self.stdout.write(
+            f"{'mode':<6}{'conc':>6}{'reqs':>8}{'err':>6}{'rps':>9}"
+            f"{'p50ms':>9}{'p99ms':>9}{'idleMB':>8}{'peakMB':>8}{'rps/100MB':>11}"
+        )
+        for mode in modes:
+            port = _free_port()
+            server = self._start_server(mode, port, options["workers"])
+            try:
+                idle = _rss_bytes(server.pid)
+                for level in levels:
+                    sampler = _RssSampler(server.pid)
+                    sampler.start()
+                    stats, elapsed = loadgen.run_load(
+                        loadgen.HttpTransport(
+                            f"http://127.0.0.1:{port}", options["timeout"]
+                        ),
+                        slugs,
+                        visitors=options["visitors"],
+                        concurrency=level,
+                        arrival_rate=0,
+                        think_time=options["think_time"],
+                        seed=options["seed"],
+                    )
+                    peak = sampler.stop()
+                    latencies = sorted(
+                        value for values in stats.latencies.values() for value in values
+                    )
+                    errors = sum(stats.errors.values())
+                    rps = len(latencies) / elapsed if elapsed else 0.0
+                    mb = 1024 * 1024
+                    self.stdout.write(
+                        f"{mode:<6}{level:>6}{len(latencies):>8}{errors:>6}"
+                        f"{rps:>9.1f}{loadgen.percentile(latencies, 50):>9.1f}"
+                        f"{loadgen.percentile(latencies, 99):>9.1f}"
+                        f"{idle / mb:>8.1f}{peak / mb:>8.1f}"
+                        f"{rps / (peak / mb) * 100 if peak else 0:>11.1f}"
+                    )
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
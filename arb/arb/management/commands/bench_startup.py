@@ -0,0 +1,134 @@
+"""
+@file bench_startup.py
+@brief Команда `manage.py bench_startup`: холодный и прогретый старт gunicorn.
+
+Запускает продакшен-конфигурацию (`gunicorn.conf.py`) с выключенным
+(`SERVER_WARMUP=0`, cold) и включённым (warm) прогревом и для каждого
+режима измеряет время от запуска процесса до первого ответа health-check
+(так сервер опрашивает балансировщик) и задержку
+первого запроса к каждому эндпоинту посещения (`session/start`, `view`,
+`progress`) в сравнении с медианой последующих запросов. Разница между
+первым и установившимся запросом — цена ленивой инициализации, которую
+снимает прогрев. Сервер использует ту же БД и Redis, что и команда.
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from arb import catalog, loadgen
+from arb.management.commands.bench_servers import MANAGE_DIR, _free_port
+
+MODES = {"cold": "0", "warm": "1"}
+
+
+class Command(BaseCommand):
+    help = "Measure gunicorn cold start against warm start."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--modes",
+            default="cold,warm",
+            help="Comma-separated modes to run: cold, warm.",
+        )
+        parser.add_argument(
+            "--repeats",
+            type=int,
+            default=20,
+            help="Requests per endpoint after the first one.",
+        )
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--boot-timeout", type=float, default=60.0)
+
+    def _start(self, mode: str, port: int, workers: int) -> subprocess.Popen:
+        env = {
+            **os.environ,
+            "PYTHONUNBUFFERED": "1",
+            "SERVER_WARMUP": MODES[mode],
+            "GUNICORN_BIND": f"127.0.0.1:{port}",
+            "WEB_CONCURRENCY": str(workers),
+        }
+        return subprocess.Popen(  # noqa: S603
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+            cwd=MANAGE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def _measure(self, mode: str, slug: str, options) -> dict:
+        port = _free_port()
+        client = loadgen.HttpTransport(f"http://127.0.0.1:{port}", timeout=30)
+        started = time.perf_counter()
+        server = self._start(mode, port, options["workers"])
+        try:
+            deadline = time.monotonic() + options["boot_timeout"]
+            while True:
+                if server.poll() is not None:
+                    raise CommandError(f"{mode} server exited on start")
+                if time.monotonic() > deadline:
+                    raise CommandError(f"{mode} server did not answer in time")
+                try:
+                    status, _, _ = client.request("GET", "health/")
+                except OSError:
+                    status = None
+                if status == 200:
+                    break
+                time.sleep(0.05)
+            first_response = time.perf_counter() - started
+            sent = time.perf_counter()
+            _, body, _ = client.request("POST", "session/start/", {})
+            timings = {"session/start/": [time.perf_counter() - sent]}
+            session_id = body["session_id"]
+            flow = (
+                (
+                    "view/",
+                    "POST",
+                    "view/",
+                    {"session_id": session_id, "asset_slug": slug},
+                ),
+                ("progress/", "GET", f"progress/?session_id={session_id}", None),
+            )
+            for name, method, path, payload in flow:
+                timings[name] = []
+                for _ in range(options["repeats"] + 1):
+                    sent = time.perf_counter()
+                    client.request(method, path, payload)
+                    timings[name].append(time.perf_counter() - sent)
+            for _ in range(options["repeats"]):
+                sent = time.perf_counter()
+                client.request("POST", "session/start/", {})
+                timings["session/start/"].append(time.perf_counter() - sent)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        return {"first_response": first_response, "timings": timings}
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        slugs = sorted(catalog.get_catalog().by_slug)
+        if not slugs:
+            raise CommandError("no assets to view; create Asset rows first")
+        modes = [m for m in options["modes"].split(",") if m]
+        if set(modes) - set(MODES):
+            raise CommandError("--modes accepts only cold and warm")
+
+        self.stdout.write(
+            f"{'mode':<6}{'endpoint':<16}{'firstms':>9}{'p50ms':>9}{'bootms':>9}"
+        )
+        for mode in modes:
+            result = self._measure(mode, slugs[0], options)
+            boot = result["first_response"] * 1000
+            for name, values in result["timings"].items():
+                rest = sorted(v * 1000 for v in values[1:])
+                self.stdout.write(
+                    f"{mode:<6}{name:<16}{values[0] * 1000:>9.1f}"
+                    f"{loadgen.percentile(rest, 50):>9.1f}{boot:>9.0f}"
+                )
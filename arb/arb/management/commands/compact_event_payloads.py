@@ -0,0 +1,82 @@
+"""
+@file compact_event_payloads.py
+@brief Команда `manage.py compact_event_payloads`: перевод старых событий на схемы.
+
+Перекодирует `ViewEvent`, записанные до появления схем нагрузки (вся
+нагрузка в `raw_payload`), в колонки `data`/`code`, порциями по id, и
+печатает средний объём нагрузки на событие до и после по типам событий.
+С `--dry-run` только измеряет. Поля вне схемы переносятся без обрезки.
+"""
+
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from arb import event_schema
+from arb.models import ViewEvent
+
+
+class Command(BaseCommand):
+    """Перекодирует нагрузку старых событий по схемам типов."""
+
+    help = "Re-encode legacy ViewEvent payloads into the compact schema columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only measure bytes per event, do not rewrite rows.",
+        )
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        sizes = defaultdict(lambda: [0, 0, 0])
+        legacy = ViewEvent.objects.filter(data__isnull=True, raw_payload__isnull=False)
+        last_id = 0
+        converted = 0
+        while True:
+            batch = list(
+                legacy.filter(id__gt=last_id)
+                .order_by("id")
+                .only("id", "event_type", "session_id", "raw_payload")[
+                    : options["batch_size"]
+                ]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            changed = []
+            for event in batch:
+                columns = event_schema.encode_payload(
+                    event.event_type, event.session_id, event.raw_payload, cap=False
+                )
+                row = sizes[event.event_type]
+                row[0] += 1
+                row[1] += event_schema.payload_size(None, None, event.raw_payload)
+                row[2] += event_schema.payload_size(**columns)
+                if columns["data"] is not None:
+                    for name, value in columns.items():
+                        setattr(event, name, value)
+                    changed.append(event)
+            if not options["dry_run"] and changed:
+                with transaction.atomic():
+                    ViewEvent.objects.bulk_update(
+                        changed, ["data", "code", "raw_payload"]
+                    )
+                converted += len(changed)
+
+        self.stdout.write(
+            f"{'event_type':<20}{'events':>10}{'json B/ev':>11}{'new B/ev':>10}"
+        )
+        for event_type, (count, before, after) in sorted(sizes.items()):
+            self.stdout.write(
+                f"{event_type:<20}{count:>10}{before / count:>11.1f}{after / count:>10.1f}"
+            )
+        verb = "would convert" if options["dry_run"] else "converted"
+        total = sum(row[0] for row in sizes.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"done: {verb} {converted if not options['dry_run'] else total} of {total} legacy events"
+            )
+        )
@@ -0,0 +1,35 @@
+"""
+@file compact_stats.py
+@brief Команда `manage.py compact_stats`: догоняющая компактизация статистики.
+
+Сворачивает весь накопленный лог `ViewEvent` в агрегаты порциями. Удобна
+для первичного заполнения агрегатов после развёртывания.
+"""
+
+from django.core.management.base import BaseCommand
+
+from arb import rollups
+
+
+class Command(BaseCommand):
+    """Сворачивает лог событий в агрегаты `AssetDailyStats`/`AssetTotalStats`."""
+
+    help = "Compact ViewEvent rows into per-asset statistics rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Events per batch (defaults to STATS_COMPACTION_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        total = 0
+        while True:
+            processed = rollups.compact_view_events(options["batch_size"])
+            if not processed:
+                break
+            total += processed
+            self.stdout.write(f"compacted {total} events")
+        self.stdout.write(self.style.SUCCESS(f"done: {total} events compacted"))
@@ -0,0 +1,64 @@
+"""
+@file export_data.py
+@brief Команда `manage.py export_data`: потоковая выгрузка для аналитики.
+
+Пишет `ViewEvent` (`events`) или `SessionItemProgress` (`progress`) в файл
+или stdout в NDJSON или CSV, при `--gzip` сжимая на лету. Строки читаются
+страницами по ключу (см. `export.py`), поэтому расход памяти не зависит от
+объёма выгрузки. Фильтры те же, что у `/api/export/<kind>/`.
+"""
+
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from arb import db_router, export
+
+
+class Command(BaseCommand):
+    """Выгружает события или прогресс сессий потоком."""
+
+    help = "Stream ViewEvent or SessionItemProgress rows as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(export.KINDS))
+        parser.add_argument("--since", help="ISO date or datetime, inclusive.")
+        parser.add_argument("--until", help="ISO date or datetime, exclusive.")
+        parser.add_argument(
+            "--event-type", help="Comma-separated event types (events only)."
+        )
+        parser.add_argument("--campaign", help="Asset campaign.")
+        parser.add_argument(
+            "--format", choices=sorted(export.FORMATS), default="ndjson"
+        )
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument(
+            "-o", "--output", default="-", help="File path, or - for stdout."
+        )
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        try:
+            filters = export.parse_filters(options)
+            blocks = export.render(
+                options["kind"],
+                options["format"],
+                filters,
+                using=db_router.choose_replica(),
+            )
+        except ValueError as exc:
+            raise CommandError(exc) from exc
+        if options["gzip"]:
+            blocks = export.gzip_blocks(blocks)
+        if options["output"] == "-":
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+        written = 0
+        with Path(options["output"]).open("wb") as out:
+            for block in blocks:
+                written += out.write(block)
+        self.stdout.write(
+            self.style.SUCCESS(f"done: {written} bytes written to {options['output']}")
+        )
@@ -0,0 +1,124 @@
+"""
+@file loadtest.py
+@brief Команда `manage.py loadtest`: имитация пикового потока посетителей.
+
+Запускает N виртуальных посетителей, проходящих клиентский сценарий
+(`session/start` → просмотры активов → `user/email` → `progress` → `promo`),
+и печатает пропускную способность, перцентили задержки и число SQL-запросов
+по эндпоинтам. С `--url` нагрузка идёт по HTTP на развёрнутый сервер, без
+него — внутри процесса через тестовый клиент Django против текущей БД;
+такой прогон создаёт сессии и забирает коды из пула, поэтому требует явного
+`--allow-writes`. Посетители указывают адреса в зоне `.invalid`, и
+промокоды им не отправляются.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from arb import catalog, loadgen
+
+
+class Command(BaseCommand):
+    """Нагрузочный прогон клиентского сценария."""
+
+    help = "Simulate concurrent visitors following the client flow."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default=None,
+            help="Base URL of a running server; in-process when omitted.",
+        )
+        parser.add_argument("--visitors", type=int, default=50)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="Maximum number of visitors active at once.",
+        )
+        parser.add_argument(
+            "--arrival-rate",
+            type=float,
+            default=0.0,
+            help="Visitors per second (Poisson arrivals); 0 starts all at once.",
+        )
+        parser.add_argument(
+            "--think-time",
+            type=float,
+            default=0.0,
+            help="Mean pause between visitor steps, seconds.",
+        )
+        parser.add_argument(
+            "--views-per-visitor",
+            type=int,
+            default=None,
+            help="Assets viewed per visitor (defaults to the whole catalog).",
+        )
+        parser.add_argument(
+            "--assets",
+            default=None,
+            help="Comma-separated asset slugs (defaults to the Asset catalog).",
+        )
+        parser.add_argument(
+            "--allow-writes",
+            action="store_true",
+            help="Confirm the in-process run may write to the configured database.",
+        )
+        parser.add_argument("--timeout", type=float, default=10.0)
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        if options["assets"]:
+            slugs = [s for s in options["assets"].split(",") if s]
+        else:
+            slugs = sorted(catalog.get_catalog().by_slug)
+        if not slugs:
+            msg = "no assets to view; create Asset rows or pass --assets"
+            raise CommandError(msg)
+        if options["url"]:
+            transport = loadgen.HttpTransport(options["url"], options["timeout"])
+        elif options["allow_writes"]:
+            transport = loadgen.InProcessTransport()
+        else:
+            msg = (
+                "the in-process run creates sessions and claims promo pool codes "
+                "in the configured database; pass --allow-writes to proceed"
+            )
+            raise CommandError(msg)
+
+        stats, elapsed = loadgen.run_load(
+            transport,
+            slugs,
+            visitors=options["visitors"],
+            concurrency=options["concurrency"],
+            arrival_rate=options["arrival_rate"],
+            think_time=options["think_time"],
+            views_per_visitor=options["views_per_visitor"],
+            seed=options["seed"],
+        )
+        rows = stats.summary(elapsed)
+        self.stdout.write(
+            f"{'endpoint':<14}{'reqs':>7}{'err':>6}{'rps':>9}"
+            f"{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'q_avg':>7}{'q_max':>7}  statuses"
+        )
+        for row in rows:
+            q_avg = "-" if row["queries_avg"] is None else f"{row['queries_avg']:.1f}"
+            q_max = "-" if row["queries_max"] is None else str(row["queries_max"])
+            statuses = " ".join(
+                f"{code or 'fail'}:{n}"
+                for code, n in sorted(
+                    row["statuses"].items(), key=lambda kv: kv[0] or 0
+                )
+            )
+            self.stdout.write(
+                f"{row['endpoint']:<14}{row['requests']:>7}{row['errors']:>6}"
+                f"{row['rps']:>9.1f}{row['p50']:>9.1f}{row['p95']:>9.1f}"
+                f"{row['p99']:>9.1f}{q_avg:>7}{q_max:>7}  {statuses}"
+            )
+        total = sum(row["requests"] for row in rows)
+        errors = sum(row["errors"] for row in rows)
+        summary = (
+            f"{stats.visitors} visitors, {total} requests in {elapsed:.2f}s: "
+            f"{total / elapsed if elapsed else 0:.1f} req/s, {errors} errors"
+        )
+        style = self.style.SUCCESS if not errors else self.style.WARNING
+        self.stdout.write(style(summary))
@@ -0,0 +1,37 @@
+"""
+@file mint_promo_codes.py
+@brief Команда `manage.py mint_promo_codes`: выпуск промокодов в пул.
+
+Выпускает заданное число кодов в пул кампании и печатает их по одному
+в строке, чтобы список можно было заранее передать партнёру.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from arb import promo_pool
+
+
+class Command(BaseCommand):
+    """Выпускает промокоды в пул кампании."""
+
+    help = "Mint promo codes into a campaign pool and print them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--campaign", default=settings.PROMO_CAMPAIGN)
+        parser.add_argument("--count", type=int, required=True)
+        parser.add_argument(
+            "--prefix",
+            default=None,
+            help="Code prefix (defaults to PROMO_CODE_PREFIX).",
+        )
+
+    def handle(self, *args, **options):  # noqa: ARG002
+        codes = promo_pool.mint(
+            options["campaign"], options["count"], options["prefix"]
+        )
+        for code in codes:
+            self.stdout.write(code)
+        self.stderr.write(
+            self.style.SUCCESS(f"minted {len(codes)} codes for {options['campaign']}")
+        )
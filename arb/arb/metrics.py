@@ -0,0 +1,317 @@
+"""
+@file metrics.py
+@brief Метрики производительности обработчиков в формате Prometheus.
+
+Для каждого запроса `PerformanceMiddleware` фиксирует полное время, число
+и суммарное время SQL-запросов и размер ответа. Замеры копятся в гистограммах
+процесса и не чаще раза в `METRICS_FLUSH_INTERVAL` секунд сбрасываются
+приращениями в общий хеш Redis, поэтому `/api/metrics/` в любом из
+воркеров gunicorn/uvicorn отдаёт сумму по всем процессам. Без Redis
+отдаются данные текущего процесса.
+
+SQL-запросы считаются обёрткой в `connection.execute_wrappers`: она ставится
+на каждое новое соединение (сигнал `connection_created`, см. `signals.py`)
+и пишет в замер текущего запроса через `contextvars`, поэтому учитываются
+и запросы из `sync_to_async` в async-обработчиках.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from redis import RedisError
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY = "arb:metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    "arb_request_duration_seconds": ("Request wall time by route.", SECONDS_BUCKETS),
+    "arb_request_db_seconds": ("Time spent in SQL by route.", SECONDS_BUCKETS),
+    "arb_request_db_queries": ("SQL statements per request by route.", QUERY_BUCKETS),
+    "arb_response_size_bytes": ("Response body size by route.", BYTES_BUCKETS),
+    "arb_db_pool_wait_seconds": (
+        "Time to get a pooled DB connection by database alias.",
+        SECONDS_BUCKETS,
+    ),
+}
+REQUESTS_TOTAL = "arb_http_requests_total"
+IDEMPOTENCY_TOTAL = "arb_idempotency_requests_total"
+RATE_LIMIT_TOTAL = "arb_rate_limit_requests_total"
+DB_POOL_EVENTS_TOTAL = "arb_db_pool_connections_total"
+WS_MESSAGES_TOTAL = "arb_ws_messages_total"
+# name -> (help, label of the per-route value)
+COUNTERS = {
+    REQUESTS_TOTAL: ("Responses by route and status.", "status"),
+    IDEMPOTENCY_TOTAL: (
+        "Requests with an Idempotency-Key by route and outcome.",
+        "result",
+    ),
+    RATE_LIMIT_TOTAL: ("Rate limiter decisions by route and outcome.", "result"),
+    DB_POOL_EVENTS_TOTAL: (
+        "Pooled DB connections opened, reused, recycled or broken, and "
+        "checkouts that found the pool exhausted, by database alias.",
+        "event",
+    ),
+    WS_MESSAGES_TOTAL: (
+        "WebSocket messages by type (route) and outcome; route push counts "
+        "published updates.",
+        "result",
+    ),
+}
+
+_current = contextvars.ContextVar("arb_request_sample", default=None)
+_lock = threading.Lock()
+_pending: dict[str, float] = defaultdict(float)
+_flushed_at = time.monotonic()
+
+
+class RequestSample:
+    """
+    @brief Замер одного запроса.
+
+    @ivar started: Момент начала (`time.perf_counter`)
+    @ivar db_queries: Число SQL-выражений
+    @ivar db_time: Суммарное время SQL в секундах
+    @ivar duration: Полное время в секундах (после `finish_sample`)
+    """
+
+    __slots__ = ("db_queries", "db_time", "duration", "started")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.duration = 0.0
+
+
+def _observe_query(execute, sql, params, many, context):
+    """Обёртка `execute_wrapper`: учитывает SQL в замере текущего запроса."""
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.db_time += time.perf_counter() - started
+        sample.db_queries += 1
+
+
+def install_query_observer(connection) -> None:
+    """
+    @brief Ставит обёртку учёта SQL на соединение (идемпотентно).
+
+    @param connection: Объект соединения Django
+    """
+    if _observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_observe_query)
+
+
+def start_sample() -> tuple[RequestSample, contextvars.Token]:
+    """
+    @brief Начинает замер запроса в текущем контексте.
+
+    @return Кортеж `(sample, token)` для `finish_sample`.
+    """
+    sample = RequestSample()
+    return sample, _current.set(sample)
+
+
+def finish_sample(sample: RequestSample, token: contextvars.Token) -> None:
+    """
+    @brief Завершает замер и отключает его от контекста.
+
+    @param sample: Замер из `start_sample`
+    @param token: Токен из `start_sample`
+    """
+    sample.duration = time.perf_counter() - sample.started
+    _current.reset(token)
+
+
+def _field(name: str, route: str, suffix: str) -> str:
+    return f"{name}\t{route}\t{suffix}"
+
+
+def _bucket_for(value: float, buckets) -> str:
+    for bound in buckets:
+        if value <= bound:
+            return str(bound)
+    return "+Inf"
+
+
+def observe(route: str, status: int, sample: RequestSample, size: int | None):
+    """
+    @brief Добавляет замер запроса в гистограммы процесса.
+
+    @param route: Имя маршрута из `urls.py`
+    @param status: HTTP-статус ответа
+    @param sample: Завершённый замер
+    @param size: Размер тела ответа в байтах (None для потоковых ответов)
+    """
+    values = {
+        "arb_request_duration_seconds": sample.duration,
+        "arb_request_db_seconds": sample.db_time,
+        "arb_request_db_queries": sample.db_queries,
+    }
+    if size is not None:
+        values["arb_response_size_bytes"] = size
+    with _lock:
+        for name, value in values.items():
+            buckets = HISTOGRAMS[name][1]
+            _pending[_field(name, route, _bucket_for(value, buckets))] += 1
+            _pending[_field(name, route, "sum")] += value
+            _pending[_field(name, route, "count")] += 1
+        _pending[_field(REQUESTS_TOTAL, route, str(status))] += 1
+
+
+def observe_value(name: str, route: str, value: float) -> None:
+    """
+    @brief Добавляет значение в гистограмму из `HISTOGRAMS`.
+
+    @param name: Имя гистограммы
+    @param route: Значение метки `route` (маршрут или другой источник)
+    @param value: Значение
+    """
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        _pending[_field(name, route, _bucket_for(value, buckets))] += 1
+        _pending[_field(name, route, "sum")] += value
+        _pending[_field(name, route, "count")] += 1
+
+
+def increment(name: str, route: str, label: str, amount: int = 1) -> None:
+    """
+    @brief Увеличивает счётчик из `COUNTERS`.
+
+    @param name: Имя счётчика
+    @param route: Имя маршрута
+    @param label: Значение метки счётчика (например, статус)
+    @param amount: Приращение
+    """
+    with _lock:
+        _pending[_field(name, route, label)] += amount
+
+
+def flush(force: bool = False) -> None:
+    """
+    @brief Сбрасывает накопленные приращения в общий хеш Redis.
+
+    @details При ошибке Redis приращения возвращаются в буфер процесса.
+
+    @param force: Сбросить независимо от `METRICS_FLUSH_INTERVAL`
+    """
+    global _flushed_at  # noqa: PLW0603
+    client = get_redis()
+    if client is None:
+        return
+    now = time.monotonic()
+    with _lock:
+        if not _pending or (
+            not force and now - _flushed_at < settings.METRICS_FLUSH_INTERVAL
+        ):
+            return
+        deltas = dict(_pending)
+        _pending.clear()
+        _flushed_at = now
+    try:
+        pipe = client.pipeline(transaction=False)
+        for field, delta in deltas.items():
+            if field.endswith("\tsum"):
+                pipe.hincrbyfloat(REDIS_KEY, field, delta)
+            else:
+                pipe.hincrby(REDIS_KEY, field, int(delta))
+        pipe.execute()
+    except RedisError:
+        logger.warning("metrics flush failed, keeping %d fields", len(deltas))
+        with _lock:
+            for field, delta in deltas.items():
+                _pending[field] += delta
+
+
+def _snapshot() -> dict[str, float]:
+    """
+    @brief Текущие значения всех рядов.
+
+    @return Словарь `field -> value`: сумма по процессам из Redis либо данные
+    текущего процесса, если Redis недоступен.
+    """
+    client = get_redis()
+    if client is not None:
+        flush(force=True)
+        try:
+            raw = client.hgetall(REDIS_KEY)
+        except RedisError:
+            logger.warning("metrics read failed, serving local values")
+        else:
+            return {k.decode(): float(v) for k, v in raw.items()}
+    with _lock:
+        return dict(_pending)
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render() -> str:
+    """
+    @brief Формирует ответ в текстовом формате Prometheus.
+
+    @return Текст экспозиции.
+    """
+    series = defaultdict(dict)
+    for field, value in _snapshot().items():
+        name, route, suffix = field.split("\t")
+        series[(name, route)][suffix] = value
+    routes = defaultdict(list)
+    for name, route in sorted(series):
+        routes[name].append(route)
+
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for route in routes.get(name, []):
+            values = series[(name, route)]
+            cumulative = 0.0
+            for bound in (*map(str, buckets), "+Inf"):
+                cumulative += values.get(bound, 0)
+                lines.append(
+                    f'{name}_bucket{{route="{route}",le="{bound}"}} '
+                    f"{_format(cumulative)}"
+                )
+            lines.append(
+                f'{name}_sum{{route="{route}"}} {_format(values.get("sum", 0))}'
+            )
+            lines.append(
+                f'{name}_count{{route="{route}"}} {_format(values.get("count", 0))}'
+            )
+    for name, (help_text, label) in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for route in routes.get(name, []):
+            for value_label, value in sorted(series[(name, route)].items()):
+                lines.append(
+                    f'{name}{{route="{route}",{label}="{value_label}"}} '
+                    f"{_format(value)}"
+                )
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """
+    @brief Очищает буфер процесса (для тестов и ручного сброса).
+    """
+    with _lock:
+        _pending.clear()
@@ -0,0 +1,66 @@
+"""
+@file middleware.py
+@brief Middleware замеров производительности запросов.
+
+`PerformanceMiddleware` измеряет полное время обработки, число и время
+SQL-запросов и размер ответа, добавляет их в заголовок `Server-Timing`
+и передаёт в гистограммы `metrics`. Работает как в WSGI, так и в ASGI.
+"""
+
+from __future__ import annotations
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class PerformanceMiddleware:
+    """
+    @brief Замер времени, SQL и размера ответа для каждого маршрута.
+
+    @details Маршрут определяется по `url_name` из `urls.py`; запросы
+    без совпадения попадают в ряд `unmatched`. Должен стоять первым
+    в `MIDDLEWARE`, чтобы учитывать время остальных middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        sample, token = metrics.start_sample()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_sample(sample, token)
+        return self._finish(request, response, sample)
+
+    async def __acall__(self, request):
+        sample, token = metrics.start_sample()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_sample(sample, token)
+        return self._finish(request, response, sample)
+
+    def _finish(self, request, response, sample):
+        match = getattr(request, "resolver_match", None)
+        route = (match.url_name if match else None) or UNMATCHED_ROUTE
+        size = None if response.streaming else len(response.content)
+        metrics.observe(route, response.status_code, sample, size)
+        total_ms = sample.duration * 1000
+        response["Server-Timing"] = (
+            f"app;dur={total_ms:.1f}, "
+            f'db;dur={sample.db_time * 1000:.1f};desc="{sample.db_queries} queries"'
+        )
+        metrics.flush()
+        return response
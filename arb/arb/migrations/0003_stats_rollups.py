@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0002_delete_emailverificationtoken"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AssetTotalStats",
+            fields=[
+                (
+                    "asset",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="total_stats",
+                        serialize=False,
+                        to="arb.asset",
+                    ),
+                ),
+                ("views", models.IntegerField(default=0)),
+                ("first_views", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="StatsCheckpoint",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("last_event_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="AssetDailyStats",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("day", models.DateField()),
+                ("views", models.IntegerField(default=0)),
+                ("first_views", models.IntegerField(default=0)),
+                (
+                    "asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="arb.asset",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["day"], name="ads_day_idx")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("asset", "day"), name="u_asset_daily_stats"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:39
+
+from django.db import migrations, models
+
+
+def detach_duplicate_promocodes(apps, schema_editor):  # noqa: ARG001
+    """Keep the earliest code per session; detach the rest before the constraint."""
+    PromoCode = apps.get_model("arb", "PromoCode")
+    seen = set()
+    for promo in (
+        PromoCode.objects.filter(session__isnull=False)
+        .order_by("session_id", "id")
+        .only("id", "session_id", "meta")
+        .iterator()
+    ):
+        if promo.session_id not in seen:
+            seen.add(promo.session_id)
+            continue
+        promo.meta = {**promo.meta, "detached_session": str(promo.session_id)}
+        promo.session_id = None
+        promo.save(update_fields=["session", "meta"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0003_stats_rollups"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            detach_duplicate_promocodes, migrations.RunPython.noop, elidable=True
+        ),
+        migrations.AddConstraint(
+            model_name="promocode",
+            constraint=models.UniqueConstraint(
+                fields=("session",), name="u_promocode_session"
+            ),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# scoring.FIRST_VIEW_POINTS at the time of this migration
+FIRST_VIEW_POINTS = 10
+BATCH_SIZE = 1000
+
+
+def backfill_user_assets_seen(apps, schema_editor):  # noqa: ARG001
+    """Fill seen assets from linked sessions and reset total_score to match."""
+    SessionItemProgress = apps.get_model("arb", "SessionItemProgress")
+    UserAssetSeen = apps.get_model("arb", "UserAssetSeen")
+    User = apps.get_model("arb", "User")
+    pairs = (
+        SessionItemProgress.objects.filter(
+            session__user__isnull=False, times_viewed__gt=0
+        )
+        .values_list("session__user_id", "asset_id")
+        .distinct()
+        .iterator()
+    )
+    batch = []
+    for user_id, asset_id in pairs:
+        batch.append(UserAssetSeen(user_id=user_id, asset_id=asset_id))
+        if len(batch) >= BATCH_SIZE:
+            UserAssetSeen.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        UserAssetSeen.objects.bulk_create(batch, ignore_conflicts=True)
+    User.objects.update(total_score=0)
+    counts = (
+        UserAssetSeen.objects.values("user_id")
+        .annotate(cnt=models.Count("id"))
+        .values_list("user_id", "cnt")
+    )
+    for user_id, cnt in counts.iterator():
+        User.objects.filter(pk=user_id).update(total_score=cnt * FIRST_VIEW_POINTS)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0004_promocode_once_per_session"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserAssetSeen",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "first_seen_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="seen_by_users",
+                        to="arb.asset",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="seen_assets",
+                        to="arb.user",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "asset"), name="u_user_asset_seen"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(
+            backfill_user_assets_seen, migrations.RunPython.noop, elidable=True
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0005_user_asset_seen"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="viewevent",
+            name="code",
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name="viewevent",
+            name="data",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="viewevent",
+            name="raw_payload",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="viewevent",
+            index=models.Index(fields=["code"], name="ve_code_idx"),
+        ),
+    ]
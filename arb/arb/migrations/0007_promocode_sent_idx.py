@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0006_view_event_payload_schema"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="promocode",
+            index=models.Index(
+                fields=["sent_at", "issued_at"], name="promocode_sent_idx"
+            ),
+        ),
+    ]
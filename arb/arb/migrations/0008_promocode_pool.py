@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0007_promocode_sent_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="promocode",
+            name="campaign",
+            field=models.CharField(default="default", max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name="promocode",
+            index=models.Index(
+                fields=["campaign", "issued_at", "session"], name="promocode_pool_idx"
+            ),
+        ),
+    ]
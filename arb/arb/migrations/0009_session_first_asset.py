@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0008_promocode_pool"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="session",
+            name="first_asset",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="arb.asset",
+            ),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="first_viewed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(fields=["first_asset"], name="session_first_asset_idx"),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:31
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def number_assets(apps, schema_editor):  # noqa: ARG001
+    """Number assets per campaign in id order and seed the sequences."""
+    Asset = apps.get_model("arb", "Asset")
+    AssetOrdinalSequence = apps.get_model("arb", "AssetOrdinalSequence")
+    last = {}
+    for asset in Asset.objects.order_by("campaign", "id").only("id", "campaign"):
+        asset.ordinal = last[asset.campaign] = last.get(asset.campaign, -1) + 1
+        asset.save(update_fields=["ordinal"])
+    AssetOrdinalSequence.objects.bulk_create(
+        AssetOrdinalSequence(campaign=campaign, last_ordinal=ordinal)
+        for campaign, ordinal in last.items()
+    )
+
+
+def fill_viewed_bits(apps, schema_editor):  # noqa: ARG001
+    """Build each session's bitmaps from its SessionItemProgress rows."""
+    Asset = apps.get_model("arb", "Asset")
+    Session = apps.get_model("arb", "Session")
+    SessionItemProgress = apps.get_model("arb", "SessionItemProgress")
+    bit_of = {
+        asset_id: (campaign, 1 << ordinal)
+        for asset_id, campaign, ordinal in Asset.objects.values_list(
+            "id", "campaign", "ordinal"
+        )
+    }
+    bits = defaultdict(lambda: defaultdict(int))
+    for session_id, asset_id in (
+        SessionItemProgress.objects.filter(times_viewed__gt=0)
+        .values_list("session_id", "asset_id")
+        .iterator()
+    ):
+        campaign, bit = bit_of[asset_id]
+        bits[session_id][campaign] |= bit
+    batch = []
+    for session_id, masks in bits.items():
+        viewed_bits = {campaign: format(mask, "x") for campaign, mask in masks.items()}
+        batch.append(Session(id=session_id, viewed_bits=viewed_bits))
+    Session.objects.bulk_update(batch, ["viewed_bits"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0009_session_first_asset"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AssetOrdinalSequence",
+            fields=[
+                (
+                    "campaign",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("last_ordinal", models.IntegerField(default=-1)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="asset",
+            name="ordinal",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="session",
+            name="viewed_bits",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(number_assets, migrations.RunPython.noop, elidable=True),
+        migrations.RunPython(
+            fill_viewed_bits, migrations.RunPython.noop, elidable=True
+        ),
+        migrations.AddConstraint(
+            model_name="asset",
+            constraint=models.UniqueConstraint(
+                fields=("campaign", "ordinal"), name="u_asset_campaign_ordinal"
+            ),
+        ),
+    ]
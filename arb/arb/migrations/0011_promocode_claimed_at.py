@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0010_asset_ordinal_viewed_bits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="promocode",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("arb", "0011_promocode_claimed_at"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="assetdailystats",
+            name="first_views",
+        ),
+        migrations.RemoveField(
+            model_name="assettotalstats",
+            name="first_views",
+        ),
+    ]
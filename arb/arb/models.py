@@ -3,8 +3,9 @@
 @brief Модели данных для бэкенда MVP.
 
 Описывает основные сущности: пользователя, сессию, актив (контент),
-прогресс просмотра, событийный лог и промокод. Для ключевых полей заданы
-индексы для эффективных выборок в основных сценариях.
+прогресс просмотра, событийный лог, промокод и агрегаты статистики.
+Для ключевых полей заданы индексы для эффективных выборок в основных
+сценариях.
 """
 
 import uuid
@@ -12,6 +13,8 @@ import uuid
 from django.db import models
 from django.utils import timezone
 
+from . import event_schema
+
 
 class User(models.Model):
     """
@@ -61,6 +64,10 @@ class Session(models.Model):
     @ivar pending_email: Почта, привязанная позже, до связывания с пользователем
     @ivar is_active: Признак активности сессии
     @ivar metadata: Произвольные метаданные в формате JSON
+    @ivar first_asset: Актив, просмотренный в сессии первым
+    @ivar first_viewed_at: Время первого просмотра в сессии
+    @ivar viewed_bits: Просмотренные активы: кампания -> битовая маска
+    порядковых номеров (`Asset.ordinal`) в шестнадцатеричной записи
     """
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -73,6 +80,11 @@ class Session(models.Model):
     pending_email = models.EmailField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     metadata = models.JSONField(default=dict)
+    first_asset = models.ForeignKey(
+        "Asset", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    first_viewed_at = models.DateTimeField(null=True, blank=True)
+    viewed_bits = models.JSONField(default=dict)
 
     class Meta:
         indexes = [
@@ -81,6 +93,7 @@ class Session(models.Model):
                 fields=["is_active", "last_seen"], name="session_active_lastseen_idx"
             ),
             models.Index(fields=["created_at"], name="session_created_idx"),
+            models.Index(fields=["first_asset"], name="session_first_asset_idx"),
         ]
 
 
@@ -94,6 +107,8 @@ class Asset(models.Model):
     @ivar type: Тип актива (категория)
     @ivar campaign: Кампания/пул, к которому относится актив
     @ivar meta: Произвольные метаданные в формате JSON
+    @ivar ordinal: Порядковый номер в кампании (бит в `Session.viewed_bits`),
+    назначается при сохранении и не переиспользуется
     """
 
     id = models.AutoField(primary_key=True)
@@ -102,14 +117,36 @@ class Asset(models.Model):
     type = models.CharField(max_length=50)
     campaign = models.CharField(max_length=100, default="default")
     meta = models.JSONField(default=dict)
+    ordinal = models.PositiveIntegerField(null=True, blank=True, editable=False)
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["campaign", "ordinal"], name="u_asset_campaign_ordinal"
+            ),
+        ]
         indexes = [
             models.Index(fields=["slug"], name="asset_slug_idx"),
             models.Index(fields=["campaign", "type"], name="asset_campaign_type_idx"),
         ]
 
 
+class AssetOrdinalSequence(models.Model):
+    """
+    @brief Счётчик порядковых номеров активов кампании.
+
+    @details Номер удалённого или перенесённого в другую кампанию актива не
+    выдаётся повторно, иначе его бит в `Session.viewed_bits` засчитался бы
+    новому активу.
+
+    @ivar campaign: Кампания
+    @ivar last_ordinal: Последний выданный номер
+    """
+
+    campaign = models.CharField(max_length=100, primary_key=True)
+    last_ordinal = models.IntegerField(default=-1)
+
+
 class SessionItemProgress(models.Model):
     """
     @brief Прогресс просмотра конкретного актива в рамках сессии.
@@ -143,19 +180,50 @@ class SessionItemProgress(models.Model):
         ]
 
 
+class UserAssetSeen(models.Model):
+    """
+    @brief Актив, хотя бы раз просмотренный в любой сессии пользователя.
+
+    @details Строка вставляется один раз на пару (пользователь, актив);
+    `User.total_score` увеличивается только при фактической вставке.
+
+    @ivar id: Целочисленный первичный ключ
+    @ivar user: Ссылка на `User`
+    @ivar asset: Ссылка на `Asset`
+    @ivar first_seen_at: Время первого учтённого просмотра
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="seen_assets")
+    asset = models.ForeignKey(
+        Asset, on_delete=models.CASCADE, related_name="seen_by_users"
+    )
+    first_seen_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "asset"], name="u_user_asset_seen"),
+        ]
+
+
 class ViewEvent(models.Model):
     """
     @brief Событие взаимодействия пользователя с системой.
 
-    @details Хранит тип события, временную метку и «сырой» полезный груз
-    (payload) для последующей аналитики.
+    @details Хранит тип события, временную метку и полезную нагрузку
+    (payload) для последующей аналитики. Известные поля нагрузки кодируются
+    по схеме типа события в `data` и `code`, остальные — в `raw_payload`
+    (см. `event_schema`); целиком нагрузку возвращает свойство `payload`.
 
     @ivar id: Целочисленный первичный ключ
     @ivar session: Ссылка на `Session`
     @ivar asset: Ссылка на `Asset` (может отсутствовать для общих событий)
     @ivar event_type: Тип события (например, viewed_asset)
     @ivar timestamp: Время возникновения события
-    @ivar raw_payload: Оригинальные данные события (JSON)
+    @ivar data: Известные поля нагрузки в компактном двоичном виде
+    @ivar code: Промокод из нагрузки промо-событий
+    @ivar raw_payload: Поля нагрузки вне схемы (JSON) либо вся нагрузка
+    событий, записанных до появления схем
     @ivar processed: Флаг обработки события downstream-процессом
     """
 
@@ -168,7 +236,9 @@ class ViewEvent(models.Model):
     )
     event_type = models.CharField(max_length=50, default="viewed_asset")
     timestamp = models.DateTimeField(default=timezone.now)
-    raw_payload = models.JSONField()
+    data = models.BinaryField(null=True, blank=True)
+    code = models.CharField(max_length=128, null=True, blank=True)
+    raw_payload = models.JSONField(null=True, blank=True)
     processed = models.BooleanField(default=True)
 
     class Meta:
@@ -176,15 +246,25 @@ class ViewEvent(models.Model):
             models.Index(fields=["session", "timestamp"], name="ve_session_ts_idx"),
             models.Index(fields=["asset"], name="ve_asset_idx"),
             models.Index(fields=["event_type"], name="ve_event_type_idx"),
+            models.Index(fields=["code"], name="ve_code_idx"),
         ]
 
+    @property
+    def payload(self):
+        """Полезная нагрузка события в исходном виде."""
+        return event_schema.decode_payload(
+            self.event_type, self.session_id, self.data, self.code, self.raw_payload
+        )
+
 
 class PromoCode(models.Model):
     """
     @brief Промокод, выдаваемый за завершение сценария.
 
     @details Может быть привязан к сессии и/или пользователю; хранит
-    статус выдачи, отправки и использования.
+    статус выдачи, отправки и использования. Сессии выдаётся не более
+    одного промокода (ограничение `u_promocode_session`). Коды без сессии
+    и `issued_at` составляют пул кампании (см. `promo_pool`).
 
     @ivar id: Целочисленный первичный ключ
     @ivar code: Уникальный код промо
@@ -193,8 +273,10 @@ class PromoCode(models.Model):
     @ivar email: Электронная почта получателя
     @ivar issued_at: Время генерации промокода
     @ivar sent_at: Время отправки промокода по email
+    @ivar claimed_at: Время захвата кода пакетной рассылкой (аренда)
     @ivar used_at: Время использования промокода
     @ivar meta: Дополнительные данные в формате JSON
+    @ivar campaign: Кампания, в пул которой выпущен код
     """
 
     id = models.AutoField(primary_key=True)
@@ -216,13 +298,80 @@ class PromoCode(models.Model):
     email = models.EmailField(null=True, blank=True)
     issued_at = models.DateTimeField(null=True, blank=True)
     sent_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
     used_at = models.DateTimeField(null=True, blank=True)
     meta = models.JSONField(default=dict)
+    campaign = models.CharField(max_length=100, default="default")
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["session"], name="u_promocode_session"),
+        ]
         indexes = [
             models.Index(fields=["code"], name="promocode_code_idx"),
             models.Index(fields=["email"], name="promocode_email_idx"),
             models.Index(fields=["issued_at"], name="promocode_issued_idx"),
             models.Index(fields=["used_at"], name="promocode_used_idx"),
+            models.Index(fields=["sent_at", "issued_at"], name="promocode_sent_idx"),
+            models.Index(
+                fields=["campaign", "issued_at", "session"], name="promocode_pool_idx"
+            ),
         ]
+
+
+class AssetDailyStats(models.Model):
+    """
+    @brief Дневной агрегат просмотров актива.
+
+    @details Заполняется компактизацией `ViewEvent` (см. `rollups`).
+
+    @ivar id: Целочисленный первичный ключ
+    @ivar asset: Ссылка на `Asset`
+    @ivar day: Календарный день (в часовом поясе проекта)
+    @ivar views: Число событий `viewed_asset` за день
+    """
+
+    id = models.AutoField(primary_key=True)
+    asset = models.ForeignKey(
+        Asset, on_delete=models.CASCADE, related_name="daily_stats"
+    )
+    day = models.DateField()
+    views = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["asset", "day"], name="u_asset_daily_stats"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["day"], name="ads_day_idx"),
+        ]
+
+
+class AssetTotalStats(models.Model):
+    """
+    @brief Накопительный агрегат просмотров актива за всё время.
+
+    @ivar asset: Ссылка на `Asset` (первичный ключ)
+    @ivar views: Число событий `viewed_asset`
+    """
+
+    asset = models.OneToOneField(
+        Asset, primary_key=True, on_delete=models.CASCADE, related_name="total_stats"
+    )
+    views = models.IntegerField(default=0)
+
+
+class StatsCheckpoint(models.Model):
+    """
+    @brief Отметка о том, до какого события лог уже свёрнут в агрегаты.
+
+    @ivar name: Имя потока компактизации
+    @ivar last_event_id: Id последнего учтённого `ViewEvent`
+    @ivar updated_at: Время последнего продвижения отметки
+    """
+
+    name = models.CharField(max_length=50, primary_key=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
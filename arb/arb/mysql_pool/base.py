@@ -0,0 +1,118 @@
+"""
+@file base.py
+@brief Бэкенд Django `arb.mysql_pool`: MySQL с пулом соединений процесса.
+
+Расширяет `django.db.backends.mysql`: вместо открытия соединения на каждый
+запрос (`CONN_MAX_AGE=0`) соединение берётся из пула процесса (`arb.pool`),
+а при закрытии в конце запроса возвращается в него. Настройка сессии
+(`init_connection_state`) выполняется один раз для нового соединения,
+`autocommit` переключается, только если он отличается от нужного.
+Соединение, закрытое внутри транзакции или после ошибки без ответа на
+ping, в пул не возвращается.
+
+Параметры пула задаются ключом `POOL` в `DATABASES` (см. `settings.py`):
+`MAX_SIZE`, `MAX_IDLE`, `MAX_LIFETIME`, `CHECK_AFTER`, `TIMEOUT`.
+"""
+
+from __future__ import annotations
+
+import threading
+
+from django.db.backends.mysql import base as mysql
+
+from arb.pool import Pool, PoolTimeout
+
+_pools: dict[str, Pool] = {}
+_pools_lock = threading.Lock()
+
+
+def _connect(conn_params: dict):
+    connection = mysql.Database.connect(**conn_params)
+    # same workaround as django.db.backends.mysql.base.get_new_connection
+    if connection.encoders.get(bytes) is bytes:
+        connection.encoders.pop(bytes)
+    return connection
+
+
+def _alive(connection) -> bool:
+    try:
+        connection.ping()
+    except mysql.Database.Error:
+        return False
+    return True
+
+
+def _dispose(connection) -> None:
+    connection.close()
+
+
+def get_pool(alias: str, settings_dict: dict, conn_params: dict) -> Pool:
+    """
+    @brief Пул соединений псевдонима БД в текущем процессе.
+
+    @param alias: Псевдоним в `DATABASES`
+    @param settings_dict: Настройки псевдонима
+    @param conn_params: Параметры `MySQLdb.connect`
+    @return Объект `Pool`.
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            options = settings_dict.get("POOL") or {}
+            pool = Pool(
+                alias,
+                lambda: _connect(conn_params),
+                dispose=_dispose,
+                check=_alive,
+                max_size=options.get("MAX_SIZE", 10),
+                max_idle=options.get("MAX_IDLE", 300.0),
+                max_lifetime=options.get("MAX_LIFETIME", 3600.0),
+                check_after=options.get("CHECK_AFTER", 5.0),
+                timeout=options.get("TIMEOUT", 5.0),
+            )
+            _pools[alias] = pool
+        return pool
+
+
+def pools() -> dict[str, Pool]:
+    """
+    @brief Созданные в процессе пулы по псевдонимам БД.
+
+    @return Словарь `alias -> Pool`.
+    """
+    with _pools_lock:
+        return dict(_pools)
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+    """
+    @brief Обёртка соединения MySQL, берущая соединения из пула.
+    """
+
+    _pool_fresh = True
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict, conn_params)
+        try:
+            connection, self._pool_fresh = pool.acquire()
+        except PoolTimeout as exc:
+            raise mysql.Database.OperationalError(str(exc)) from exc
+        return connection
+
+    def init_connection_state(self):
+        if self._pool_fresh:
+            super().init_connection_state()
+
+    def _set_autocommit(self, autocommit):
+        if self.connection.get_autocommit() != autocommit:
+            super()._set_autocommit(autocommit)
+
+    def _close(self):
+        if self.connection is None:
+            return
+        discard = (
+            self.in_atomic_block
+            or not self.connection.get_autocommit()
+            or (self.errors_occurred and not _alive(self.connection))
+        )
+        _pools[self.alias].release(self.connection, discard=discard)
@@ -0,0 +1,247 @@
+"""
+@file pool.py
+@brief Потокобезопасный пул соединений общего назначения.
+
+Пул хранит не больше `max_size` соединений на процесс. Свободные
+соединения лежат стеком: выдаётся последнее возвращённое, поэтому
+в работе остаются «горячие» соединения, а лишние уходят вниз стека
+и закрываются, простояв дольше `max_idle` секунд. Соединение старше
+`max_lifetime` секунд закрывается при возврате или выдаче. Проверка
+живости (`check`) выполняется только для соединений, простоявших дольше
+`check_after` секунд. Если все соединения заняты, запрос ждёт свободное
+до `timeout` секунд, затем получает `PoolTimeout`.
+
+Пул ничего не знает о БД: соединения создаёт `factory`, закрывает
+`dispose`. В дочернем процессе после fork унаследованные соединения
+забываются без закрытия: их сокеты принадлежат родителю. Время ожидания
+и события пула (`opened`, `reused`, `recycled`, `broken`, `exhausted`)
+отдаются в метрики под именем пула.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(TimeoutError):
+    """Свободное соединение не появилось за время ожидания."""
+
+
+class _Entry:
+    __slots__ = ("conn", "created", "released")
+
+    def __init__(self, conn, now: float) -> None:
+        self.conn = conn
+        self.created = now
+        self.released = now
+
+
+class Pool:
+    """
+    @brief Ограниченный пул с переиспользованием и отсевом соединений.
+
+    @ivar name: Имя пула (метка `route` в метриках)
+    @ivar max_size: Максимум соединений (занятых и свободных)
+    @ivar max_idle: Сколько секунд свободное соединение живёт без дела
+    @ivar max_lifetime: Максимальный возраст соединения в секундах
+    @ivar check_after: Простой, после которого соединение проверяется
+    @ivar timeout: Сколько секунд ждать свободного соединения
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        factory,
+        *,
+        dispose,
+        check=None,
+        max_size: int = 10,
+        max_idle: float = 300.0,
+        max_lifetime: float = 3600.0,
+        check_after: float = 5.0,
+        timeout: float = 5.0,
+    ) -> None:
+        self.name = name
+        self.factory = factory
+        self.dispose = dispose
+        self.check = check
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.timeout = timeout
+        self._idle: deque[_Entry] = deque()
+        self._busy: dict[int, _Entry] = {}
+        self._opening = 0
+        self._cond = threading.Condition()
+        _instances.add(self)
+
+    def _event(self, event: str, amount: int = 1) -> None:
+        metrics.increment(metrics.DB_POOL_EVENTS_TOTAL, self.name, event, amount)
+
+    def _close(self, entry: _Entry, event: str) -> None:
+        self._event(event)
+        try:
+            self.dispose(entry.conn)
+        except Exception:  # noqa: BLE001
+            logger.debug("pool %s: closing a connection failed", self.name)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.created > self.max_lifetime
+
+    def _reap(self, now: float) -> list[_Entry]:
+        """Снимает со дна стека простоявшие соединения (под блокировкой)."""
+        stale = []
+        while self._idle and now - self._idle[0].released > self.max_idle:
+            stale.append(self._idle.popleft())
+        return stale
+
+    def acquire(self) -> tuple[object, bool]:
+        """
+        @brief Выдаёт соединение.
+
+        @return Кортеж `(conn, fresh)`; `fresh` — соединение только что
+        открыто и ещё не настраивалось.
+        @throws PoolTimeout Если свободное соединение не появилось за `timeout`.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        exhausted = False
+        while True:
+            with self._cond:
+                stale = self._reap(time.monotonic())
+                entry = None
+                while entry is None:
+                    if self._idle:
+                        entry = self._idle.pop()
+                    elif len(self._busy) + self._opening < self.max_size:
+                        self._opening += 1
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if not exhausted:
+                            exhausted = True
+                            self._event("exhausted")
+                        if remaining <= 0:
+                            metrics.observe_value(
+                                "arb_db_pool_wait_seconds",
+                                self.name,
+                                time.monotonic() - started,
+                            )
+                            raise PoolTimeout(
+                                f"pool {self.name}: no connection in {self.timeout}s"
+                            )
+                        self._cond.wait(remaining)
+                if entry is not None:
+                    self._busy[id(entry.conn)] = entry
+            for item in stale:
+                self._close(item, "recycled")
+            if entry is None:
+                return self._open(started)
+            now = time.monotonic()
+            if self._expired(entry, now):
+                self._forget(entry)
+                self._close(entry, "recycled")
+                continue
+            if (
+                self.check is not None
+                and now - entry.released > self.check_after
+                and not self.check(entry.conn)
+            ):
+                self._forget(entry)
+                self._close(entry, "broken")
+                continue
+            self._event("reused")
+            metrics.observe_value("arb_db_pool_wait_seconds", self.name, now - started)
+            return entry.conn, False
+
+    def _open(self, started: float) -> tuple[object, bool]:
+        try:
+            conn = self.factory()
+        except BaseException:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        now = time.monotonic()
+        with self._cond:
+            self._opening -= 1
+            self._busy[id(conn)] = _Entry(conn, now)
+        self._event("opened")
+        metrics.observe_value("arb_db_pool_wait_seconds", self.name, now - started)
+        return conn, True
+
+    def _forget(self, entry: _Entry) -> None:
+        with self._cond:
+            self._busy.pop(id(entry.conn), None)
+            self._cond.notify()
+
+    def release(self, conn, *, discard: bool = False) -> None:
+        """
+        @brief Возвращает соединение в пул.
+
+        @param conn: Соединение из `acquire`
+        @param discard: Закрыть соединение вместо возврата (например, после
+        ошибки или в незавершённой транзакции)
+        """
+        now = time.monotonic()
+        with self._cond:
+            entry = self._busy.pop(id(conn), None)
+            if entry is None:
+                return
+            keep = not discard and not self._expired(entry, now)
+            if keep:
+                entry.released = now
+                self._idle.append(entry)
+            self._cond.notify()
+        if not keep:
+            self._close(entry, "broken" if discard else "recycled")
+
+    def close_all(self) -> None:
+        """
+        @brief Закрывает свободные соединения (занятые закроются при возврате).
+        """
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for entry in idle:
+            self._close(entry, "recycled")
+
+    def stats(self) -> dict:
+        """
+        @brief Текущее состояние пула.
+
+        @return Словарь `size`, `idle`, `busy`, `max_size`.
+        """
+        with self._cond:
+            idle = len(self._idle)
+            busy = len(self._busy) + self._opening
+        return {
+            "size": idle + busy,
+            "idle": idle,
+            "busy": busy,
+            "max_size": self.max_size,
+        }
+
+
+_instances: weakref.WeakSet[Pool] = weakref.WeakSet()
+
+
+def _forget_after_fork() -> None:
+    for pool in list(_instances):
+        pool._idle.clear()  # noqa: SLF001
+        pool._busy.clear()  # noqa: SLF001
+        pool._opening = 0  # noqa: SLF001
+        pool._cond = threading.Condition()  # noqa: SLF001
+
+
+os.register_at_fork(after_in_child=_forget_after_fork)
@@ -0,0 +1,232 @@
+"""
+@file progress_cache.py
+@brief Прогресс сессий в виде битовых масок и его кэш в Redis.
+
+Просмотренные активы сессии хранятся в `Session.viewed_bits`: для каждой
+кампании — маска, в которой бит с номером `Asset.ordinal` означает, что
+актив просмотрен. Маска меняется в той же записи строки сессии, что и
+балл, а `SessionItemProgress` остаётся подробной историей. Число
+просмотренных активов и признак завершения кампании считаются по маске и
+маскам каталога (`catalog`) без запросов к БД; удалённые активы в масках
+каталога не участвуют.
+
+Запись прогресса (`{"bits", "score"}`) для обработчика `progress` кэшируется
+в Redis; при отсутствии записи (TTL, вытеснение, недоступность Redis) она
+строится из строки сессии.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from redis import RedisError
+
+from . import catalog, etags
+from .models import Session, SessionItemProgress
+
+if TYPE_CHECKING:
+    from .models import Asset
+
+logger = logging.getLogger(__name__)
+
+KEY_TEMPLATE = "progress:session-bits:{}"
+MOVE_BATCH_SIZE = 1000
+
+
+def _key(session_id) -> str:
+    """
+    @brief Ключ записи прогресса в кэше.
+
+    @param session_id: Идентификатор сессии (UUID или строка)
+    @return Строковый ключ.
+    """
+    return KEY_TEMPLATE.format(session_id)
+
+
+def _store(session_id, record: dict) -> None:
+    """
+    @brief Сохраняет запись прогресса; ошибки Redis только логируются.
+
+    @param session_id: Идентификатор сессии
+    @param record: Запись прогресса
+    """
+    try:
+        cache.set(_key(session_id), record, settings.PROGRESS_CACHE_TTL)
+    except RedisError:
+        logger.warning("progress cache write failed for session %s", session_id)
+
+
+def get_session_progress(session_id) -> dict | None:
+    """
+    @brief Возвращает запись прогресса из кэша без обращения к БД.
+
+    @param session_id: Идентификатор сессии
+    @return Запись `{"bits", "score"}` либо None при промахе.
+    """
+    try:
+        return cache.get(_key(session_id))
+    except RedisError:
+        logger.warning("progress cache read failed for session %s", session_id)
+        return None
+
+
+def mark_viewed(session: Session, asset: Asset) -> None:
+    """
+    @brief Ставит бит актива в `viewed_bits` сессии (без сохранения).
+
+    @param session: Объект `Session`, строка которого заблокирована
+    @param asset: Просмотренный актив
+    """
+    bits = int(session.viewed_bits.get(asset.campaign, "0"), 16)
+    session.viewed_bits = {
+        **session.viewed_bits,
+        asset.campaign: format(bits | 1 << asset.ordinal, "x"),
+    }
+
+
+def carry_moved_asset(asset: Asset) -> int:
+    """
+    @brief Ставит бит перенесённого в другую кампанию актива сессиям, уже
+    просмотревшим его.
+
+    @details Повторный просмотр бит не ставит, поэтому без переноса такие
+    сессии не смогли бы завершить новую кампанию. Прежний бит остаётся под
+    старой кампанией, но в её маску каталога больше не входит. Сессии
+    обновляются порциями под блокировкой строк, их записи в кэше
+    сбрасываются после коммита.
+
+    @param asset: `Asset` с уже назначенными новыми кампанией и номером
+    @return Число обновлённых сессий.
+    """
+    session_ids = list(
+        SessionItemProgress.objects.filter(
+            asset_id=asset.pk, times_viewed__gt=0
+        ).values_list("session_id", flat=True)
+    )
+    for start in range(0, len(session_ids), MOVE_BATCH_SIZE):
+        chunk = session_ids[start : start + MOVE_BATCH_SIZE]
+        with transaction.atomic():
+            sessions = list(Session.objects.select_for_update().filter(id__in=chunk))
+            for session in sessions:
+                mark_viewed(session, asset)
+            Session.objects.bulk_update(sessions, ["viewed_bits"])
+            transaction.on_commit(lambda chunk=chunk: _forget(chunk))
+    etags.bump(session_ids=session_ids)
+    return len(session_ids)
+
+
+def _forget(session_ids) -> None:
+    try:
+        cache.delete_many([_key(session_id) for session_id in session_ids])
+    except RedisError:
+        logger.warning("progress cache purge failed for %d sessions", len(session_ids))
+
+
+def build_session_progress(session: Session) -> dict:
+    """
+    @brief Строит запись прогресса из строки сессии без запросов к БД.
+
+    @param session: Объект `Session`
+    @return Запись прогресса.
+    """
+    bits = {campaign: int(mask, 16) for campaign, mask in session.viewed_bits.items()}
+    return {"bits": bits, "score": session.score}
+
+
+def init_session_progress(session: Session) -> dict:
+    """
+    @brief Кладёт в кэш пустую запись для только что созданной сессии.
+
+    @param session: Новый объект `Session`
+    @return Запись прогресса.
+    """
+    record = {"bits": {}, "score": session.score}
+    _store(session.id, record)
+    return record
+
+
+def refresh_session_progress(session: Session) -> dict:
+    """
+    @brief Перестраивает запись прогресса из строки сессии и кладёт её в кэш.
+
+    @details Внутри транзакции запись попадает в кэш только после коммита,
+    чтобы откат не оставил в кэше незафиксированные прогресс и балл.
+
+    @param session: Объект `Session`
+    @return Актуальная запись прогресса.
+    """
+    record = build_session_progress(session)
+    session_id = session.id
+    transaction.on_commit(lambda: _store(session_id, record))
+    return record
+
+
+def _viewed_masks(record: dict, campaign: str | None) -> list[tuple[int, int]]:
+    """Пары `(биты сессии, маска каталога)` кампании; None — всех кампаний."""
+    masks = catalog.get_catalog().masks
+    campaigns = masks if campaign is None else [campaign]
+    return [(record["bits"].get(c, 0), masks.get(c, 0)) for c in campaigns]
+
+
+def viewed_count(record: dict, campaign: str | None = None) -> int:
+    """
+    @brief Число просмотренных активов каталога.
+
+    @param record: Запись прогресса
+    @param campaign: Кампания или None (все кампании)
+    @return Число установленных битов, существующих в каталоге.
+    """
+    return sum(
+        (bits & mask).bit_count() for bits, mask in _viewed_masks(record, campaign)
+    )
+
+
+def is_completed(record: dict, campaign: str | None = None) -> bool:
+    """
+    @brief Просмотрены ли все активы кампании.
+
+    @param record: Запись прогресса
+    @param campaign: Кампания или None (все кампании каталога)
+    @return True, если маски покрыты целиком; кампании без активов не
+    учитываются.
+    """
+    pairs = [(bits, mask) for bits, mask in _viewed_masks(record, campaign) if mask]
+    return bool(pairs) and all(bits & mask == mask for bits, mask in pairs)
+
+
+def viewed_asset_ids(record: dict) -> list[int]:
+    """
+    @brief Идентификаторы просмотренных активов каталога.
+
+    @param record: Запись прогресса
+    @return Отсортированный список id активов.
+    """
+    bits = record["bits"]
+    return sorted(
+        asset.id
+        for (campaign, ordinal), asset in catalog.get_catalog().by_ordinal.items()
+        if bits.get(campaign, 0) >> ordinal & 1
+    )
+
+
+def progress_payload(record: dict, campaign: str | None = None) -> dict:
+    """
+    @brief Прогресс сессии в форме ответа `/api/progress/`.
+
+    @param record: Запись прогресса
+    @param campaign: Кампания или None (все кампании)
+    @return Словарь `total_assets`, `viewed_assets`, `remaining_assets`,
+    `total_score`.
+    """
+    total_assets = catalog.get_catalog().campaign_total(campaign)
+    viewed_assets = viewed_count(record, campaign)
+    return {
+        "total_assets": total_assets,
+        "viewed_assets": viewed_assets,
+        "remaining_assets": max(total_assets - viewed_assets, 0),
+        "total_score": record["score"],
+    }
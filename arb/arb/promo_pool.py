@@ -0,0 +1,122 @@
+"""
+@file promo_pool.py
+@brief Пул заранее выпущенных промокодов.
+
+Промокоды выпускаются пачками заранее (по кампаниям) и лежат в `PromoCode`
+невыданными: без сессии и без `issued_at`. Выдача блокирует первый
+свободный код с `SKIP LOCKED` и забирает его одним UPDATE, поэтому не
+зависит ни от стоимости генерации, ни от повторов при коллизиях кодов.
+Периодическая задача `refill_promo_pool` пополняет пул, когда число
+свободных кодов опускается ниже `PROMO_POOL_LOW_WATERMARK`. Выпущенные
+коды можно заранее выгрузить партнёрам (`manage.py mint_promo_codes`).
+"""
+
+from __future__ import annotations
+
+import logging
+import secrets
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PromoCode
+
+logger = logging.getLogger(__name__)
+
+# no 0/O and 1/I/L to keep codes readable when dictated at the cash desk
+CODE_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+CODE_LENGTH = 10
+
+
+def generate_code(prefix: str | None = None) -> str:
+    """
+    @brief Случайный промокод.
+
+    @param prefix: Префикс кода (по умолчанию `PROMO_CODE_PREFIX`)
+    @return Код вида `PROMO-XXXXXXXXXX`.
+    """
+    prefix = prefix or settings.PROMO_CODE_PREFIX
+    body = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+    return f"{prefix}-{body}"
+
+
+def available(campaign: str):
+    """
+    @brief Невыданные коды кампании.
+
+    @param campaign: Кампания
+    @return QuerySet `PromoCode`.
+    """
+    return PromoCode.objects.filter(
+        campaign=campaign, issued_at__isnull=True, session__isnull=True
+    )
+
+
+def mint(campaign: str, count: int, prefix: str | None = None) -> list[str]:
+    """
+    @brief Выпускает коды в пул кампании.
+
+    @details Коды вставляются `bulk_create` с пропуском конфликтов;
+    совпавшие с существующими догенерируются.
+
+    @param campaign: Кампания
+    @param count: Сколько кодов выпустить
+    @param prefix: Префикс кодов
+    @return Список выпущенных кодов.
+    """
+    minted = []
+    while len(minted) < count:
+        codes = {generate_code(prefix) for _ in range(count - len(minted))}
+        existing = set(
+            PromoCode.objects.filter(code__in=codes).values_list("code", flat=True)
+        )
+        fresh = sorted(codes - existing)
+        PromoCode.objects.bulk_create(
+            [PromoCode(code=code, campaign=campaign) for code in fresh],
+            ignore_conflicts=True,
+        )
+        minted.extend(fresh)
+    return minted
+
+
+def refill(campaign: str) -> int:
+    """
+    @brief Пополняет пул кампании до `PROMO_POOL_TARGET`, если он ниже порога.
+
+    @param campaign: Кампания
+    @return Число выпущенных кодов.
+    """
+    free = available(campaign).count()
+    if free >= settings.PROMO_POOL_LOW_WATERMARK:
+        return 0
+    minted = mint(campaign, settings.PROMO_POOL_TARGET - free)
+    logger.info("promo pool %s refilled with %d codes", campaign, len(minted))
+    return len(minted)
+
+
+def claim(campaign: str, **fields) -> str | None:
+    """
+    @brief Забирает свободный код кампании.
+
+    @details Первый свободный код блокируется `SELECT ... FOR UPDATE SKIP
+    LOCKED LIMIT 1`, поэтому параллельные выдачи берут разные строки не
+    ожидая друг друга, и забирается одним UPDATE по первичному ключу.
+    Вызывается внутри транзакции выдачи. Нарушение `u_promocode_session`
+    пробрасывается вызывающему.
+
+    @param campaign: Кампания
+    @param fields: Значения полей выдачи (`session`, `user`, `email`)
+    @return Код либо None, если пул пуст.
+    """
+    free = (
+        available(campaign)
+        .select_for_update(skip_locked=True)
+        .order_by("id")
+        .values_list("id", "code")
+        .first()
+    )
+    if free is None:
+        return None
+    promo_id, code = free
+    PromoCode.objects.filter(id=promo_id).update(issued_at=timezone.now(), **fields)
+    return code
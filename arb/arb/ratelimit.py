@@ -0,0 +1,246 @@
+"""
+@file ratelimit.py
+@brief Ограничение частоты запросов корзинами токенов в Redis.
+
+Для маршрутов из `RATE_LIMITS` каждый запрос списывает токен из корзин
+клиента: по IP и, если в запросе есть `session_id`, по сессии. Корзина
+наполняется со скоростью `rate` токенов в секунду до `burst`. Все корзины
+запроса проверяются и списываются одним Lua-скриптом, то есть за один
+обход Redis и атомарно: токен списывается, только если его хватает во всех
+корзинах. При отказе клиент получает 429 с `Retry-After`. Решения
+считаются в метрике `arb_rate_limit_requests_total`. Без Redis или при его
+ошибке запросы пропускаются.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from redis import RedisError
+
+from . import metrics
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "arb:rl"
+SCOPES = ("ip", "session")
+
+# KEYS: bucket hashes; ARGV: rate, burst per key. Returns {allowed, retry
+# after in ms, 1-based index of the first empty bucket}. Clock is the Redis
+# server's, so workers with skewed clocks share one timeline.
+TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local tokens = {}
+local wait, denied = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 't', 'ts')
+    local t = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    t = math.min(burst, t + math.max(0, now - ts) * rate)
+    tokens[i] = t
+    if t < 1 then
+        local need = (1 - t) / rate
+        if need > wait then
+            wait, denied = need, i
+        end
+    end
+end
+if denied > 0 then
+    return {0, math.ceil(wait * 1000), denied}
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    redis.call('HSET', key, 't', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000))
+end
+return {1, 0, 0}
+"""
+
+_script = None
+_limits: dict | None = None
+
+
+def parse_limits(spec: str) -> dict[str, tuple[float, int]]:
+    """
+    @brief Разбирает описание лимитов маршрута.
+
+    @param spec: Строка вида `ip=20/100,session=2/20` (`rate/burst`:
+    токенов в секунду и ёмкость корзины)
+    @return Словарь `scope -> (rate, burst)`.
+    @throws ValueError Если описание некорректно.
+    """
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        scope, _, value = part.partition("=")
+        rate, _, burst = value.partition("/")
+        scope = scope.strip()
+        if scope not in SCOPES or float(rate) <= 0 or int(burst) < 1:
+            raise ValueError(f"bad rate limit {part!r}")
+        limits[scope] = (float(rate), int(burst))
+    return limits
+
+
+def limits_for(route: str) -> dict[str, tuple[float, int]]:
+    """
+    @brief Лимиты маршрута из `RATE_LIMITS`.
+
+    @param route: Имя маршрута из `urls.py`
+    @return Словарь `scope -> (rate, burst)`; пустой, если лимитов нет.
+    """
+    global _limits  # noqa: PLW0603
+    if _limits is None:
+        _limits = {
+            name: parse_limits(spec) for name, spec in settings.RATE_LIMITS.items()
+        }
+    return _limits.get(route, {})
+
+
+def reset() -> None:
+    """
+    @brief Сбрасывает разобранные лимиты и скрипт (после смены настроек).
+    """
+    global _limits, _script  # noqa: PLW0603
+    _limits = None
+    _script = None
+
+
+def client_ip(request) -> str:
+    """
+    @brief Адрес клиента для корзины по IP.
+
+    @details Берётся из заголовка `RATE_LIMIT_IP_HEADER`, который ставит
+    прокси, иначе из `REMOTE_ADDR`.
+
+    @param request: Объект запроса Django
+    @return Адрес.
+    """
+    header = settings.RATE_LIMIT_IP_HEADER
+    forwarded = request.headers.get(header) if header else None
+    return (forwarded or request.META.get("REMOTE_ADDR") or "-").strip()
+
+
+def request_session_id(request) -> str | None:
+    """
+    @brief `session_id` из строки запроса или JSON-тела.
+
+    @param request: Объект запроса Django
+    @return Идентификатор сессии либо None.
+    """
+    session_id = request.GET.get("session_id")
+    if session_id is None and request.content_type == "application/json":
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+        session_id = body.get("session_id") if isinstance(body, dict) else None
+    return str(session_id)[:64] if session_id else None
+
+
+def check(route: str, request) -> tuple[bool, float, str | None]:
+    """
+    @brief Списывает токен из корзин клиента HTTP-запроса.
+
+    @param route: Имя маршрута
+    @param request: Объект запроса Django
+    @return Кортеж `(allowed, retry_after, scope)`: разрешён ли запрос,
+    через сколько секунд повторить и какая корзина пуста.
+    """
+    limits = limits_for(route)
+    if not limits or not settings.RATE_LIMIT_ENABLED:
+        return True, 0.0, None
+    identities = {"ip": client_ip(request), "session": None}
+    if "session" in limits:
+        identities["session"] = request_session_id(request)
+    return consume(route, identities)
+
+
+def consume(route: str, identities: dict) -> tuple[bool, float, str | None]:
+    """
+    @brief Списывает токен из корзин клиента с известными идентификаторами.
+
+    @details Используется и вне HTTP-запросов (сообщения WebSocket, см.
+    `ws.py`), поэтому корзины у них общие с одноимёнными маршрутами.
+
+    @param route: Имя маршрута
+    @param identities: Словарь `scope -> идентификатор` (`ip`, `session`)
+    @return Кортеж `(allowed, retry_after, scope)`, как у `check`.
+    """
+    global _script  # noqa: PLW0603
+    limits = limits_for(route)
+    client = get_redis() if limits and settings.RATE_LIMIT_ENABLED else None
+    if client is None:
+        return True, 0.0, None
+    scopes = [s for s in SCOPES if s in limits and identities.get(s)]
+    if not scopes:
+        return True, 0.0, None
+    keys = [f"{KEY_PREFIX}:{route}:{s}:{identities[s]}" for s in scopes]
+    args = [value for s in scopes for value in limits[s]]
+    try:
+        if _script is None:
+            _script = client.register_script(TOKEN_BUCKET_LUA)
+        allowed, retry_ms, denied = _script(keys=keys, args=args, client=client)
+    except RedisError:
+        logger.warning("rate limiter unavailable, letting request through")
+        metrics.increment(metrics.RATE_LIMIT_TOTAL, route, "unavailable")
+        return True, 0.0, None
+    if allowed:
+        metrics.increment(metrics.RATE_LIMIT_TOTAL, route, "allowed")
+        return True, 0.0, None
+    scope = scopes[denied - 1]
+    metrics.increment(metrics.RATE_LIMIT_TOTAL, route, f"limited_{scope}")
+    return False, retry_ms / 1000, scope
+
+
+def too_many_requests(retry_after: float, scope: str) -> JsonResponse:
+    """
+    @brief Ответ 429 на запрос сверх лимита.
+
+    @param retry_after: Через сколько секунд наполнится токен
+    @param scope: Пустая корзина (`ip` или `session`)
+    @return Ответ.
+    """
+    response = JsonResponse(
+        {"detail": f"Too many requests ({scope} limit)."}, status=429
+    )
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class RateLimitMiddleware:
+    """
+    @brief Применяет `RATE_LIMITS` к маршрутам до вызова обработчика.
+
+    @details Проверка идёт в `process_view`, когда маршрут уже разрешён;
+    в ASGI Django выполняет её в потоке, так как клиент Redis синхронный.
+    Ставится после `PerformanceMiddleware`, чтобы отказы попадали в метрики.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):  # noqa: ARG002
+        match = request.resolver_match
+        if match is None or not match.url_name:
+            return None
+        allowed, retry_after, scope = check(match.url_name, request)
+        if allowed:
+            return None
+        return too_many_requests(retry_after, scope)
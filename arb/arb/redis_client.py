@@ -0,0 +1,34 @@
+"""
+@file redis_client.py
+@brief Общий клиент Redis для структур данных вне Django cache.
+
+Используется там, где нужны списки, скрипты и другие примитивы Redis,
+которых нет в API `django.core.cache`. Клиент создаётся лениво, один на
+процесс; при пустом `REDIS_URL` (например, в тестах) возвращается None,
+и вызывающий код переходит на запасной путь.
+"""
+
+from __future__ import annotations
+
+import redis
+from django.conf import settings
+
+_client: redis.Redis | None = None
+
+
+def get_redis() -> redis.Redis | None:
+    """
+    @brief Возвращает клиент Redis текущего процесса.
+
+    @return Объект `redis.Redis` либо None, если Redis не настроен.
+    """
+    global _client  # noqa: PLW0603
+    if not settings.REDIS_URL:
+        return None
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
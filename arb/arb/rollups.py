@@ -0,0 +1,149 @@
+"""
+@file rollups.py
+@brief Инкрементальные агрегаты статистики просмотров.
+
+Лог `ViewEvent` периодически сворачивается в таблицы `AssetDailyStats`
+(актив × день) и `AssetTotalStats` (актив за всё время). Отметка
+`StatsCheckpoint` хранит id последнего учтённого события, поэтому каждая
+компактизация обрабатывает только новые строки. Эндпоинт `stats` читает
+агрегаты и досчитывает «хвост» лога после отметки, так что результат
+не зависит от того, как давно прошла компактизация, а стоимость запроса
+пропорциональна числу активов и размеру хвоста. Число сессий, начатых с
+актива, берётся одним группирующим запросом по `Session.first_asset`.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    AssetDailyStats,
+    AssetTotalStats,
+    Session,
+    StatsCheckpoint,
+    ViewEvent,
+)
+
+CHECKPOINT_NAME = "view_events"
+VIEWED_FILTER = {"event_type": "viewed_asset", "asset__isnull": False}
+
+
+def _aggregate_events(events) -> dict:
+    """
+    @brief Сворачивает выборку событий в счётчики по (актив, день).
+
+    @param events: QuerySet `ViewEvent`
+    @return Словарь `(asset_id, day) -> views`.
+    """
+    viewed = events.filter(**VIEWED_FILTER).annotate(day=TruncDate("timestamp"))
+    counts = defaultdict(int)
+    for row in viewed.values("asset_id", "day").annotate(cnt=Count("id")):
+        counts[(row["asset_id"], row["day"])] += row["cnt"]
+    return counts
+
+
+def _apply(counts: dict) -> None:
+    """
+    @brief Прибавляет счётчики к дневным и накопительным агрегатам.
+
+    @param counts: Результат `_aggregate_events`
+    """
+    totals = defaultdict(int)
+    for (asset_id, day), views in counts.items():
+        totals[asset_id] += views
+        updated = AssetDailyStats.objects.filter(asset_id=asset_id, day=day).update(
+            views=F("views") + views
+        )
+        if not updated:
+            AssetDailyStats.objects.create(asset_id=asset_id, day=day, views=views)
+    for asset_id, views in totals.items():
+        updated = AssetTotalStats.objects.filter(asset_id=asset_id).update(
+            views=F("views") + views
+        )
+        if not updated:
+            AssetTotalStats.objects.create(asset_id=asset_id, views=views)
+
+
+def compact_view_events(batch_size: int | None = None) -> int:
+    """
+    @brief Сворачивает очередную порцию `ViewEvent` в агрегаты.
+
+    @details Обрабатывается непрерывный диапазон id после отметки. События
+    моложе `STATS_COMPACTION_LAG` секунд не трогаются, чтобы не пропустить
+    строки из ещё не закоммиченных транзакций с меньшими id.
+
+    @param batch_size: Максимум событий за вызов (по умолчанию из настроек)
+    @return Число событий, перенесённых за отметку.
+    """
+    batch_size = batch_size or settings.STATS_COMPACTION_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=settings.STATS_COMPACTION_LAG)
+    with transaction.atomic():
+        checkpoint, _ = StatsCheckpoint.objects.select_for_update().get_or_create(
+            name=CHECKPOINT_NAME
+        )
+        candidates = (
+            ViewEvent.objects.filter(id__gt=checkpoint.last_event_id)
+            .order_by("id")
+            .values_list("id", "timestamp")[:batch_size]
+        )
+        upper = checkpoint.last_event_id
+        processed = 0
+        for event_id, timestamp in candidates:
+            if timestamp > cutoff:
+                break
+            upper = event_id
+            processed += 1
+        if not processed:
+            return 0
+        _apply(
+            _aggregate_events(
+                ViewEvent.objects.filter(id__gt=checkpoint.last_event_id, id__lte=upper)
+            )
+        )
+        checkpoint.last_event_id = upper
+        checkpoint.updated_at = timezone.now()
+        checkpoint.save(update_fields=["last_event_id", "updated_at"])
+    return processed
+
+
+def collect_asset_counts(today) -> tuple[dict, dict, dict]:
+    """
+    @brief Счётчики просмотров по активам для расчёта «лучшего» актива.
+
+    @param today: Текущий день
+    @return Кортеж словарей `asset_id -> count`: просмотры за сегодня,
+    «первым в сессии» и за всё время.
+    """
+    today_counts = dict(
+        AssetDailyStats.objects.filter(day=today).values_list("asset_id", "views")
+    )
+    all_counts = dict(AssetTotalStats.objects.values_list("asset_id", "views"))
+    first_counts = dict(
+        Session.objects.filter(first_asset__isnull=False)
+        .values("first_asset")
+        .annotate(cnt=Count("pk"))
+        .values_list("first_asset", "cnt")
+    )
+
+    last_event_id = (
+        StatsCheckpoint.objects.filter(name=CHECKPOINT_NAME)
+        .values_list("last_event_id", flat=True)
+        .first()
+    ) or 0
+    tail = _aggregate_events(ViewEvent.objects.filter(id__gt=last_event_id))
+    for (asset_id, day), views in tail.items():
+        if day == today:
+            today_counts[asset_id] = today_counts.get(asset_id, 0) + views
+        all_counts[asset_id] = all_counts.get(asset_id, 0) + views
+
+    def nonzero(counts):
+        return {asset_id: cnt for asset_id, cnt in counts.items() if cnt}
+
+    return nonzero(today_counts), nonzero(first_counts), nonzero(all_counts)
@@ -0,0 +1,290 @@
+"""
+@file scoring.py
+@brief Начисление очков за просмотры и выдача промокодов.
+
+Общая бизнес-логика синхронных (DRF) и асинхронных (ASGI) обработчиков:
+регистрация просмотра под блокировкой сессии, учёт уникальных активов
+пользователя и выдача промокода после просмотра всех активов кампании.
+"""
+
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from . import (
+    db_router,
+    etags,
+    event_sink,
+    live,
+    progress_cache,
+    promo_pool,
+    session_activity,
+)
+from .models import (
+    Asset,
+    PromoCode,
+    Session,
+    SessionItemProgress,
+    User,
+    UserAssetSeen,
+)
+
+logger = logging.getLogger(__name__)
+
+FIRST_VIEW_POINTS = 10
+# inline codes drawn before giving up on u_promocode_code collisions
+INLINE_CODE_ATTEMPTS = 5
+
+# SQL statements per /api/view/ call, excluding transaction control. Enforced by
+# tests; a change here must come with a reason in the commit message.
+#   repeat     - lock session, bump progress, insert event, touch session
+#                (skipped while last_seen is fresh), existing promo check once
+#                the tour is completed
+#   first      - lock session, progress update miss + upsert, insert events,
+#                touch session
+#   first_linked - first view in a session linked to a user, plus insert into
+#                the user's seen assets and total_score bump
+#   completing - first view plus promo lookup, user load, pool candidates,
+#                claim update (or fallback insert), promo_issued event
+VIEW_EVENT_QUERY_BUDGET = {
+    "repeat": 5,
+    "first": 5,
+    "first_linked": 7,
+    "completing": 10,
+}
+
+
+def mark_assets_seen(user_id, asset_ids) -> int:
+    """
+    @brief Отмечает активы просмотренными пользователем и начисляет баллы.
+
+    @details Каждая пара (пользователь, актив) вставляется в `UserAssetSeen`
+    отдельно в точке сохранения; `User.total_score` увеличивается через `F()`
+    только на число фактически вставленных строк, поэтому параллельные
+    вызовы не начисляют баллы дважды. Для одного актива (первый просмотр в
+    сессии) предварительная выборка пропускается.
+
+    @param user_id: Идентификатор пользователя
+    @param asset_ids: Идентификаторы просмотренных активов
+    @return Число впервые отмеченных активов.
+    """
+    candidates = set(asset_ids)
+    if len(candidates) > 1:
+        candidates -= set(
+            UserAssetSeen.objects.filter(
+                user_id=user_id, asset_id__in=candidates
+            ).values_list("asset_id", flat=True)
+        )
+    inserted = 0
+    for asset_id in sorted(candidates):
+        try:
+            with transaction.atomic():
+                UserAssetSeen.objects.create(user_id=user_id, asset_id=asset_id)
+        except IntegrityError:
+            # u_user_asset_seen: already seen in another session of the user
+            continue
+        inserted += 1
+    if inserted:
+        User.objects.filter(pk=user_id).update(
+            total_score=F("total_score") + inserted * FIRST_VIEW_POINTS
+        )
+    return inserted
+
+
+def _mint_inline(campaign: str, fields: dict) -> str:
+    """
+    @brief Создаёт код на месте, когда пул кампании пуст.
+
+    @details Если случайный код совпал с существующим (`u_promocode_code`),
+    генерируется новый, всего до `INLINE_CODE_ATTEMPTS` попыток; нарушение
+    `u_promocode_session` пробрасывается вызывающему.
+
+    @param campaign: Кампания пула
+    @param fields: Значения полей выдачи (`session`, `user`, `email`)
+    @return Код.
+    """
+    attempts = 0
+    while True:
+        attempts += 1
+        code = promo_pool.generate_code()
+        try:
+            with transaction.atomic():
+                PromoCode.objects.create(
+                    code=code, campaign=campaign, issued_at=timezone.now(), **fields
+                )
+        except IntegrityError:
+            # u_promocode_code: the random code is taken, draw another one
+            taken = PromoCode.objects.filter(code=code).exists()
+            if taken and attempts < INLINE_CODE_ATTEMPTS:
+                continue
+            raise
+        return code
+
+
+def issue_promocode_if_completed(
+    session: Session,
+    return_existing: bool = True,
+    record: dict | None = None,
+    campaign: str | None = None,
+):
+    """
+    @brief Выдаёт промокод, если сессия просмотрела все активы кампании
+    (при `campaign=None` — всех кампаний).
+
+    @details Завершение проверяется по битовой маске просмотров сессии
+    (`progress_cache.is_completed`) без запросов к БД. При
+    `return_existing` неиспользованный код сессии возвращается до проверки
+    завершения: он мог быть получен за другую кампанию. Сессии
+    выдаётся не более одного промокода: это гарантирует ограничение
+    `u_promocode_session`, поэтому параллельная выдача безопасна. Код
+    забирается из пула `PROMO_CAMPAIGN` (см. `promo_pool`) независимо от
+    того, какая кампания активов завершена; если пул пуст, код
+    генерируется на месте.
+
+    @param session: Объект `Session`
+    @param return_existing: Возвращать ли ранее неиспользованный промокод
+    @param record: Уже построенная запись прогресса (необязательно)
+    @param campaign: Кампания активов; None — все кампании
+    @return Код промо или None.
+    """
+    if record is None:
+        record = progress_cache.build_session_progress(session)
+    if not return_existing and not progress_cache.is_completed(record, campaign):
+        return None
+    existing = session.promo_codes.first()
+    if existing:
+        code = existing.code if return_existing and existing.used_at is None else None
+        if code:
+            event_sink.log_event(
+                session.id, "promo_issued", {"code": code, "existing": True}
+            )
+        return code
+    if not progress_cache.is_completed(record, campaign):
+        return None
+    user = session.user if session.user_id else None
+    fields = {
+        "session": session,
+        "user": user,
+        "email": user.email if user else session.pending_email,
+    }
+    pool_campaign = settings.PROMO_CAMPAIGN
+    try:
+        with transaction.atomic():
+            code = promo_pool.claim(pool_campaign, **fields)
+            if code is None:
+                logger.warning("promo pool %s is empty, minting inline", pool_campaign)
+                code = _mint_inline(pool_campaign, fields)
+    except IntegrityError:
+        # u_promocode_session: a concurrent request has already issued the code
+        existing = session.promo_codes.first()
+        if existing is None:
+            raise
+        if return_existing and existing.used_at is None:
+            return existing.code
+        return None
+    event_sink.log_event(session.id, "promo_issued", {"code": code, "existing": False})
+    db_router.stick(session.id)
+    etags.bump(session_ids=[session.id], user_ids=[session.user_id])
+    live.publish_on_commit(session.id, {"type": "promo_issued", "promo_code": code})
+    return code
+
+
+def register_view(session_id, asset: Asset, data) -> dict:
+    """
+    @brief Регистрирует просмотр актива и начисляет очки за первый просмотр.
+
+    @details Выполняется в одной транзакции под блокировкой строки сессии:
+    счётчики меняются через `F()`, прогресс по активу — условным upsert.
+    Бюджет запросов зафиксирован в `VIEW_EVENT_QUERY_BUDGET`. Используется
+    синхронным и асинхронным обработчиками `/api/view/` и WebSocket сессии;
+    после фиксации новый балл и прогресс рассылаются через `live`.
+
+    @param session_id: Идентификатор сессии
+    @param asset: Объект `Asset` из каталога
+    @param data: Полезная нагрузка события просмотра
+    @return Тело ответа: начисленные очки, счёт сессии и промокод, если выдан.
+    @throws Http404 Если сессия не найдена.
+    """
+    with transaction.atomic():
+        session = get_object_or_404(Session.objects.select_for_update(), id=session_id)
+        now = timezone.now()
+        events = [event_sink.build_event(session.id, "viewed_asset", data, asset.id)]
+        repeat_view = SessionItemProgress.objects.filter(
+            session=session, asset=asset, times_viewed__gt=0
+        ).update(times_viewed=F("times_viewed") + 1)
+        awarded_points = 0
+        if not repeat_view:
+            SessionItemProgress.objects.bulk_create(
+                [
+                    SessionItemProgress(
+                        session=session, asset=asset, viewed_at=now, times_viewed=1
+                    )
+                ],
+                update_conflicts=True,
+                # MySQL infers the conflict target (ON DUPLICATE KEY UPDATE)
+                unique_fields=(
+                    ["session", "asset"]
+                    if connection.features.supports_update_conflicts_with_target
+                    else None
+                ),
+                update_fields=["viewed_at", "times_viewed"],
+            )
+            awarded_points = FIRST_VIEW_POINTS
+            events.append(
+                event_sink.build_event(
+                    session.id,
+                    "first_view_awarded",
+                    {"asset_slug": asset.slug, "awarded_points": FIRST_VIEW_POINTS},
+                    asset.id,
+                )
+            )
+        event_sink.log_events(events)
+        updates = {
+            field: getattr(session, field)
+            for field in session_activity.touch(session, now)
+        }
+        if awarded_points:
+            updates["score"] = F("score") + awarded_points
+            progress_cache.mark_viewed(session, asset)
+            updates["viewed_bits"] = session.viewed_bits
+            if session.first_asset_id is None:
+                session.first_asset_id = asset.id
+                session.first_viewed_at = now
+                updates.update(first_asset_id=asset.id, first_viewed_at=now)
+        if updates:
+            Session.objects.filter(pk=session.pk).update(**updates)
+        session.score = session.score + awarded_points
+        if awarded_points:
+            db_router.stick(session.id)
+            etags.bump(session_ids=[session.id], user_ids=[session.user_id])
+            if session.user_id:
+                mark_assets_seen(session.user_id, [asset.id])
+            record = progress_cache.refresh_session_progress(session)
+            live.publish_on_commit(
+                session.id,
+                {
+                    "type": "score",
+                    "asset_slug": asset.slug,
+                    "awarded_points": awarded_points,
+                    "session_score": session.score,
+                },
+                {"type": "progress", **progress_cache.progress_payload(record)},
+            )
+        else:
+            record = progress_cache.build_session_progress(session)
+        promo_code = issue_promocode_if_completed(
+            session, return_existing=False, record=record, campaign=asset.campaign
+        )
+    payload = {
+        "session_id": str(session.id),
+        "asset_slug": asset.slug,
+        "awarded_points": awarded_points,
+        "session_score": session.score,
+    }
+    if promo_code:
+        payload["promo_code"] = promo_code
+    return payload
@@ -0,0 +1,66 @@
+"""
+@file session_activity.py
+@brief Учёт активности сессий: редкая запись `last_seen` и деактивация.
+
+Обработчики отмечают активность через `touch`: `last_seen` записывается,
+только если сохранённое значение старше `SESSION_LAST_SEEN_RESOLUTION`
+секунд (или сессия была деактивирована), так что частые запросы одной
+сессии не обновляют её строку каждый раз. Периодическая задача
+`reap_idle_sessions` снимает `is_active` с сессий, простаивающих дольше
+`SESSION_IDLE_TIMEOUT`, ограниченными порциями по индексу
+`(is_active, last_seen)`. Новая активность возвращает сессию в активные.
+"""
+
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Session
+
+
+def touch(session: Session, now) -> list[str]:
+    """
+    @brief Обновляет в объекте поля активности, если их пора записать.
+
+    @param session: Объект `Session` (изменяется на месте)
+    @param now: Текущее время
+    @return Имена изменённых полей (пусто — записывать нечего).
+    """
+    resolution = timedelta(seconds=settings.SESSION_LAST_SEEN_RESOLUTION)
+    if session.is_active and now - session.last_seen < resolution:
+        return []
+    session.last_seen = now
+    session.is_active = True
+    return ["last_seen", "is_active"]
+
+
+def reap_idle_sessions(
+    chunk_size: int | None = None, max_chunks: int | None = None
+) -> int:
+    """
+    @brief Деактивирует простаивающие сессии порциями.
+
+    @details Каждая порция — выборка id по индексу `(is_active, last_seen)`
+    и отдельный UPDATE с повторной проверкой `last_seen`, чтобы не
+    деактивировать сессию, активность которой записали между запросами.
+
+    @param chunk_size: Сессий за UPDATE (по умолчанию `SESSION_REAPER_CHUNK_SIZE`)
+    @param max_chunks: Порций за вызов (по умолчанию `SESSION_REAPER_MAX_CHUNKS`)
+    @return Число деактивированных сессий.
+    """
+    chunk_size = chunk_size or settings.SESSION_REAPER_CHUNK_SIZE
+    max_chunks = max_chunks or settings.SESSION_REAPER_MAX_CHUNKS
+    cutoff = timezone.now() - timedelta(seconds=settings.SESSION_IDLE_TIMEOUT)
+    idle = Session.objects.filter(is_active=True, last_seen__lt=cutoff)
+    reaped = 0
+    for _ in range(max_chunks):
+        ids = list(idle.order_by("last_seen").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        reaped += idle.filter(id__in=ids).update(is_active=False)
+        if len(ids) < chunk_size:
+            break
+    return reaped
@@ -0,0 +1,66 @@
+"""
+@file signals.py
+@brief Обработчики сигналов моделей.
+
+Назначает новому (или перенесённому в другую кампанию) `Asset` порядковый
+номер, переносит биты просмотра перенесённого актива и сбрасывает кэш
+каталога активов во всех процессах при изменении `Asset` (в том числе из
+`AssetAdmin`). Сброс выполняется после коммита транзакции, чтобы другие
+процессы не перестроили каталог по незафиксированным данным. Изменение
+`PromoCode` меняет версии ответов `promo` (см. `etags`).
+Каждое новое соединение с БД получает обёртку учёта SQL для метрик.
+"""
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import catalog, etags, metrics, progress_cache
+from .models import Asset, PromoCode
+
+
+@receiver(pre_save, sender=Asset)
+def number_asset(instance, raw=False, **_kwargs):
+    """
+    @brief Назначает порядковый номер в кампании, если его нет или кампания
+    сменилась; при переносе ставит новый бит просмотревшим актив сессиям.
+    """
+    if raw:
+        return
+    moved = False
+    if instance.ordinal is not None and instance.pk is not None:
+        stored = Asset.objects.filter(pk=instance.pk).values_list("campaign", flat=True)
+        if stored.first() in (None, instance.campaign):
+            return
+        moved = True
+    catalog.assign_ordinal(instance)
+    if moved:
+        # the new ordinal is never reused, so a failed save leaves a dead bit
+        progress_cache.carry_moved_asset(instance)
+
+
+@receiver(post_save, sender=Asset)
+@receiver(post_delete, sender=Asset)
+def invalidate_asset_catalog(**_kwargs):
+    """
+    @brief Планирует сброс каталога активов после коммита.
+    """
+    transaction.on_commit(catalog.invalidate)
+
+
+@receiver(post_save, sender=PromoCode)
+@receiver(post_delete, sender=PromoCode)
+def bump_promo_versions(instance, **_kwargs):
+    """
+    @brief Меняет версии сессии и пользователя промокода (в т.ч. из админки).
+    """
+    etags.bump(session_ids=[instance.session_id], user_ids=[instance.user_id])
+
+
+@receiver(connection_created)
+def observe_connection_queries(connection, **_kwargs):
+    """
+    @brief Подключает учёт SQL-запросов к новому соединению.
+    """
+    metrics.install_query_observer(connection)
@@ -2,18 +2,58 @@
 @file tasks.py
 @brief Асинхронные задачи Celery для уведомлений и событий.
 
-Содержит задачу отправки промокода на email. При успешной отправке
-дополнительно логируется событие `promo_sent` в `ViewEvent`.
+Содержит задачу отправки промокода на email и пакетную рассылку
+неотправленных промокодов через одно SMTP-соединение (режим
+`PROMO_EMAIL_MODE=batch`), а также пополнение пула промокодов и
+деактивацию простаивающих сессий. При успешной отправке дополнительно логируется
+событие `promo_sent` в `ViewEvent`. Периодические
+задачи сворачивают лог событий в агрегаты статистики и выгружают буфер
+отложенной записи событий в БД, а старые дни лога переносят в архив;
+при остановке воркера буфер выгружается.
 """
 
 from __future__ import annotations
 
+import logging
+import time
+from datetime import timedelta
+
 from celery import shared_task
+from celery.signals import worker_shutting_down
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from .models import PromoCode, Session, ViewEvent
+from . import archive, event_sink, promo_pool, rollups, session_activity
+from .models import PromoCode
+
+logger = logging.getLogger(__name__)
+
+PROMO_EMAIL_SUBJECT = "Ваш промокод"
+UNDELIVERABLE_SUFFIX = ".invalid"
+
+
+def is_mailable(email: str | None) -> bool:
+    """
+    @brief Можно ли отправлять письма на адрес.
+
+    @details Адреса в зоне `.invalid` (RFC 2606) никогда не доставляются;
+    их использует `loadgen`, чтобы нагрузочный прогон не рассылал письма.
+
+    @param email: Адрес получателя
+    @return True, если адрес задан и не в зоне `.invalid`.
+    """
+    return bool(email) and not email.lower().endswith(UNDELIVERABLE_SUFFIX)
+
+
+def _promo_email_body(promo: PromoCode) -> str:
+    return (
+        "Поздравляем! Вы просмотрели все экспонаты в нашем виртуальном музее и получили промокод.\n\n"
+        f"Ваш промокод: {promo.code}\n\n"
+        "Покажите в кассе и получите скидку на билеты или мерч."
+    )
 
 
 @shared_task(
@@ -30,19 +70,12 @@ def send_promocode_email(promo_code: str) -> bool:
     @return True, если письмо отправлено; иначе False.
     """
     promo = PromoCode.objects.filter(code=promo_code).first()
-    if not promo or not promo.email:
+    if not promo or not is_mailable(promo.email):
         return False
 
-    subject = "Ваш промокод"
-    body = (
-        "Поздравляем! Вы просмотрели все экспонаты в нашем виртуальном музее и получили промокод.\n\n"
-        f"Ваш промокод: {promo.code}\n\n"
-        "Покажите в кассе и получите скидку на билеты или мерч."
-    )
-
     send_mail(
-        subject,
-        body,
+        PROMO_EMAIL_SUBJECT,
+        _promo_email_body(promo),
         settings.DEFAULT_FROM_EMAIL,
         [promo.email],
         fail_silently=False,
@@ -51,11 +84,228 @@ def send_promocode_email(promo_code: str) -> bool:
     promo.sent_at = timezone.now()
     promo.save(update_fields=["sent_at"])
     if promo.session_id:
-        session = Session.objects.get(id=promo.session_id)
-        ViewEvent.objects.create(
-            session=session,
-            asset=None,
-            event_type="promo_sent",
-            raw_payload={"code": promo.code, "email": promo.email},
+        event_sink.log_event(
+            promo.session_id,
+            "promo_sent",
+            {"code": promo.code, "email": promo.email},
         )
     return True
+
+
+def _send_batch(connection, promos: list[PromoCode]) -> list[PromoCode]:
+    """
+    @brief Отправляет пачку писем через открытое соединение.
+
+    @details Пачка уходит одним `send_messages`; при ошибке соединение
+    переоткрывается и попытка повторяется с экспоненциальной паузой до
+    `PROMO_EMAIL_RETRIES` раз. Если пачка так и не ушла, письма
+    отправляются по одному, чтобы отказ одного адреса не блокировал
+    остальные. Доставка «хотя бы один раз»: при обрыве посреди пачки
+    часть писем может уйти повторно.
+
+    @param connection: Открытое почтовое соединение
+    @param promos: Промокоды пачки
+    @return Промокоды, письма которых отправлены.
+    """
+    messages = [
+        EmailMessage(
+            PROMO_EMAIL_SUBJECT,
+            _promo_email_body(promo),
+            settings.DEFAULT_FROM_EMAIL,
+            [promo.email],
+            connection=connection,
+        )
+        for promo in promos
+    ]
+    for attempt in range(settings.PROMO_EMAIL_RETRIES + 1):
+        if attempt:
+            time.sleep(2 ** (attempt - 1))
+        try:
+            connection.open()
+            connection.send_messages(messages)
+        except Exception:
+            logger.warning(
+                "promo email batch of %d failed (attempt %d)",
+                len(messages),
+                attempt + 1,
+                exc_info=True,
+            )
+            connection.close()
+        else:
+            return promos
+    sent = []
+    for promo, message in zip(promos, messages, strict=True):
+        try:
+            connection.open()
+            connection.send_messages([message])
+        except Exception:
+            logger.exception("promo email to %s failed", promo.email)
+            connection.close()
+        else:
+            sent.append(promo)
+    return sent
+
+
+@shared_task(name="arb.send_pending_promo_emails", ignore_result=True)
+def send_pending_promo_emails() -> int:
+    """
+    @brief Пакетно рассылает неотправленные промокоды.
+
+    @details Работает только в режиме `PROMO_EMAIL_MODE=batch`. Промокоды
+    с адресом и пустым `sent_at`, выданные не раньше `PROMO_EMAIL_MAX_AGE`
+    секунд назад, забираются пачками по `PROMO_EMAIL_BATCH_SIZE`: короткая
+    транзакция под `SELECT ... FOR UPDATE SKIP LOCKED` только ставит
+    `claimed_at`, и параллельные запуски пропускают захваченные коды, пока
+    не истечёт аренда `PROMO_EMAIL_LEASE`. Письма отправляются вне
+    транзакции, поэтому медленный SMTP не держит блокировки строк. Все
+    пачки запуска идут через одно SMTP-соединение; темп ограничен
+    `PROMO_EMAIL_RATE` писем в секунду. `sent_at` и события `promo_sent`
+    записываются одной операцией на пачку, с неотправленных аренда
+    снимается, и их повторяет следующий запуск.
+
+    @return Число отправленных писем.
+    """
+    if settings.PROMO_EMAIL_MODE != "batch":
+        return 0
+    total = 0
+    failed = set()
+    started = time.monotonic()
+    with get_connection(fail_silently=False) as connection:
+        for _ in range(settings.PROMO_EMAIL_MAX_BATCHES):
+            promos = _claim_promo_batch(failed)
+            if not promos:
+                break
+            sent = _send_batch(connection, promos)
+            unsent = [p.id for p in promos if p not in sent]
+            PromoCode.objects.filter(id__in=[p.id for p in sent]).update(
+                sent_at=timezone.now()
+            )
+            if unsent:
+                PromoCode.objects.filter(id__in=unsent).update(claimed_at=None)
+            event_sink.log_events(
+                [
+                    event_sink.build_event(
+                        p.session_id,
+                        "promo_sent",
+                        {"code": p.code, "email": p.email},
+                    )
+                    for p in sent
+                    if p.session_id
+                ]
+            )
+            total += len(sent)
+            failed.update(unsent)
+            if settings.PROMO_EMAIL_RATE > 0:
+                ahead = total / settings.PROMO_EMAIL_RATE - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+    return total
+
+
+def _claim_promo_batch(exclude: set[int]) -> list[PromoCode]:
+    """
+    @brief Захватывает пачку неотправленных промокодов под аренду.
+
+    @param exclude: id промокодов, уже не отправленных в этом запуске
+    @return Захваченные промокоды (пусто, если захватывать нечего).
+    """
+    now = timezone.now()
+    pending = (
+        PromoCode.objects.filter(
+            sent_at__isnull=True,
+            email__isnull=False,
+            issued_at__gte=now - timedelta(seconds=settings.PROMO_EMAIL_MAX_AGE),
+        )
+        .filter(
+            Q(claimed_at__isnull=True)
+            | Q(claimed_at__lt=now - timedelta(seconds=settings.PROMO_EMAIL_LEASE))
+        )
+        .exclude(email="")
+        .exclude(email__iendswith=UNDELIVERABLE_SUFFIX)
+        .exclude(id__in=exclude)
+    )
+    with transaction.atomic():
+        promos = list(
+            pending.select_for_update(skip_locked=True).order_by("issued_at")[
+                : settings.PROMO_EMAIL_BATCH_SIZE
+            ]
+        )
+        if promos:
+            PromoCode.objects.filter(id__in=[p.id for p in promos]).update(
+                claimed_at=now
+            )
+    return promos
+
+
+@shared_task(name="arb.reap_idle_sessions", ignore_result=True)
+def reap_idle_sessions() -> int:
+    """
+    @brief Деактивирует сессии, простаивающие дольше `SESSION_IDLE_TIMEOUT`.
+
+    @return Число деактивированных сессий.
+    """
+    return session_activity.reap_idle_sessions()
+
+
+@shared_task(name="arb.refill_promo_pool", ignore_result=True)
+def refill_promo_pool() -> int:
+    """
+    @brief Пополняет пулы промокодов кампаний `PROMO_POOL_CAMPAIGNS`.
+
+    @return Число выпущенных кодов.
+    """
+    return sum(
+        promo_pool.refill(campaign) for campaign in settings.PROMO_POOL_CAMPAIGNS
+    )
+
+
+@shared_task(name="arb.compact_view_event_stats", ignore_result=True)
+def compact_view_event_stats(max_batches: int = 20) -> int:
+    """
+    @brief Сворачивает накопившиеся события в агрегаты статистики.
+
+    @param max_batches: Ограничение числа порций за один запуск
+    @return Число обработанных событий.
+    """
+    processed = 0
+    for _ in range(max_batches):
+        batch = rollups.compact_view_events()
+        processed += batch
+        if batch < settings.STATS_COMPACTION_BATCH_SIZE:
+            break
+    return processed
+
+
+@shared_task(name="arb.drain_event_buffer", ignore_result=True)
+def drain_event_buffer() -> int:
+    """
+    @brief Выгружает буфер отложенной записи событий в БД.
+
+    @return Число записанных событий.
+    """
+    return event_sink.drain()
+
+
+@shared_task(name="arb.archive_view_events", ignore_result=True)
+def archive_view_events(older_than_days: int | None = None) -> int:
+    """
+    @brief Переносит закрытые дни лога событий в архивные сегменты.
+
+    @param older_than_days: Возраст в днях (по умолчанию
+    `EVENT_ARCHIVE_OLDER_THAN_DAYS`)
+    @return Число удалённых из БД событий.
+    """
+    if older_than_days is None:
+        older_than_days = settings.EVENT_ARCHIVE_OLDER_THAN_DAYS
+    return sum(archive.archive_events(older_than_days).values())
+
+
+@worker_shutting_down.connect
+def flush_event_buffer_on_shutdown(**_kwargs):
+    """
+    @brief Выгружает буфер событий перед остановкой воркера Celery.
+    """
+    try:
+        event_sink.drain()
+    except Exception:
+        logger.exception("event buffer flush on shutdown failed")
@@ -1,10 +1,152 @@
+import csv
+import gzip
+import importlib
+import json
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
 from uuid import UUID
 
-from django.test import TestCase, override_settings
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from redis import RedisError
 from rest_framework.test import APIClient
 
-from .models import Asset, PromoCode, Session, SessionItemProgress, User, ViewEvent
+from . import (
+    archive,
+    async_views,
+    catalog,
+    db_router,
+    event_schema,
+    event_sink,
+    export,
+    idempotency,
+    live,
+    loadgen,
+    metrics,
+    pool,
+    progress_cache,
+    promo_pool,
+    ratelimit,
+    rollups,
+    scoring,
+    session_activity,
+    tasks,
+    views,
+    warmup,
+    ws,
+)
+from .models import (
+    Asset,
+    AssetDailyStats,
+    AssetTotalStats,
+    PromoCode,
+    Session,
+    SessionItemProgress,
+    User,
+    UserAssetSeen,
+    ViewEvent,
+)
+
+
+class FlakyEmailBackend(LocmemEmailBackend):
+    """Locmem backend that counts connections and rejects `bad@` recipients."""
+
+    created = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        FlakyEmailBackend.created += 1
+
+    def send_messages(self, messages):
+        if any(r.startswith("bad@") for m in messages for r in m.recipients()):
+            raise OSError("recipient refused")
+        return super().send_messages(messages)
+
+
+class BucketRedis:
+    """Redis stand-in whose script hands out `burst` tokens per key, no refill."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+        self.tokens = {}
+
+    def register_script(self, _source):
+        return self.run
+
+    def run(self, keys, args, client):  # noqa: ARG002
+        if self.fail:
+            raise RedisError("down")
+        self.calls.append((keys, args))
+        for key, burst in zip(keys, args[1::2], strict=True):
+            self.tokens.setdefault(key, burst)
+        empty = [i for i, key in enumerate(keys, 1) if self.tokens[key] < 1]
+        if empty:
+            return [0, 1500, empty[0]]
+        for key in keys:
+            self.tokens[key] -= 1
+        return [1, 0, 0]
+
+
+class ListRedis:
+    """Redis stand-in with the list, lock and pipeline calls of `event_sink`."""
+
+    def __init__(self):
+        self.lists = {}
+        self.values = {}
+
+    def rpush(self, key, *items):
+        self.lists.setdefault(key, []).extend(items)
+
+    def lpush(self, key, *items):
+        for item in items:
+            self.lists.setdefault(key, []).insert(0, item)
+
+    def lrange(self, key, start, end):
+        items = self.lists.get(key, [])
+        return items[start : None if end == -1 else end + 1]
+
+    def ltrim(self, key, start, _end):
+        self.lists[key] = self.lists.get(key, [])[start:]
+
+    def set(self, key, value, nx=False, px=None):  # noqa: ARG002
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def pexpire(self, key, _ms):
+        return key in self.values
+
+    def eval(self, _script, _numkeys, key, token):
+        if self.values.get(key) != token:
+            return 0
+        del self.values[key]
+        return 1
+
+    def pipeline(self, transaction=True):  # noqa: ARG002
+        calls = []
+
+        class Pipeline:
+            def __getattr__(_, name):  # noqa: N805
+                return lambda *args: calls.append((name, args))
+
+            def execute(_):  # noqa: N805
+                return [getattr(self, name)(*args) for name, args in calls]
+
+        return Pipeline()
 
 
 @override_settings(
@@ -17,10 +159,13 @@ from .models import Asset, PromoCode, Session, SessionItemProgress, User, ViewEv
 )
 class TestMvpApi(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         Asset.objects.create(slug="a1", name="Asset 1", type="model")
         Asset.objects.create(slug="a2", name="Asset 2", type="model")
         Asset.objects.create(slug="a3", name="Asset 3", type="model")
+        catalog.invalidate()
+        promo_pool.mint("default", 10)
 
     def _start_session(self):
         resp = self.client.post("/api/session/start/", {}, format="json")
@@ -30,9 +175,13 @@ class TestMvpApi(TestCase):
         return session_id
 
     def _view(self, session_id: str, slug: str):
-        return self.client.post(
-            "/api/view/", {"session_id": session_id, "asset_slug": slug}, format="json"
-        )
+        # run on_commit work (progress cache, live updates) as a real commit would
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/api/view/",
+                {"session_id": session_id, "asset_slug": slug},
+                format="json",
+            )
 
     def test_session_start(self):
         session_id = self._start_session()
@@ -153,6 +302,13 @@ class TestMvpApi(TestCase):
             format="json",
         )
         assert r2.status_code == 404
+        for slug in (["a1"], {"slug": "a1"}):
+            r3 = self.client.post(
+                "/api/view/",
+                {"session_id": session_id, "asset_slug": slug},
+                format="json",
+            )
+            assert r3.status_code == 400
 
     def test_view_idempotent_points_award(self):
         session_id = self._start_session()
@@ -218,14 +374,10 @@ class TestMvpApi(TestCase):
         assert r2.status_code == 200
         assert "promo_code" in r2.data
         code = r2.data["promo_code"]
-        assert (
-            ViewEvent.objects.filter(
-                event_type="promo_checked",
-                session_id=session_id,
-                raw_payload__result="issued",
-            ).count()
-            == 1
+        checks = ViewEvent.objects.filter(
+            event_type="promo_checked", session_id=session_id, code=code
         )
+        assert [e.payload["result"] for e in checks] == ["issued"]
         self.client.post(
             "/api/user/email/",
             {"session_id": session_id, "email": "pp@example.com"},
@@ -290,3 +442,1400 @@ class TestMvpApi(TestCase):
         assert r.status_code == 200
         assert r.data["views_today"] == 1
         assert r.data["views_all_time"] == 2
+
+    def _view_batch(self, views):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/api/view/batch/", {"views": views}, format="json")
+
+    def test_view_batch_matches_single_view_semantics(self):
+        s1 = self._start_session()
+        s2 = self._start_session()
+        r = self._view_batch(
+            [
+                {"session_id": s1, "asset_slug": "a1"},
+                {"session_id": s1, "asset_slug": "a1"},
+                {"session_id": s2, "asset_slug": "a2"},
+                {"session_id": s1, "asset_slug": "a2"},
+                {"session_id": s1, "asset_slug": "a3"},
+                {"session_id": s1, "asset_slug": "a3"},
+            ]
+        )
+        assert r.status_code == 200
+        results = r.data["results"]
+        assert [item["awarded_points"] for item in results] == [10, 0, 10, 10, 10, 0]
+        assert [item["session_score"] for item in results] == [10, 10, 10, 20, 30, 30]
+        assert "promo_code" in results[4]
+        assert "promo_code" not in results[5]
+        assert PromoCode.objects.filter(
+            session_id=s1, code=results[4]["promo_code"]
+        ).exists()
+        assert Session.objects.get(id=s1).score == 30
+        sip = SessionItemProgress.objects.get(session_id=s1, asset__slug="a1")
+        assert sip.times_viewed == 2
+        assert (
+            ViewEvent.objects.filter(event_type="viewed_asset", session_id=s1).count()
+            == 5
+        )
+        assert (
+            ViewEvent.objects.filter(
+                event_type="first_view_awarded", session_id=s1
+            ).count()
+            == 3
+        )
+
+    def test_view_batch_continues_existing_progress(self):
+        session_id = self._start_session()
+        self._view(session_id, "a1")
+        with mock.patch.object(live, "publish") as publish:
+            r = self._view_batch(
+                [
+                    {"session_id": session_id, "asset_slug": "a1"},
+                    {"session_id": session_id, "asset_slug": "a2"},
+                ]
+            )
+        assert [item["awarded_points"] for item in r.data["results"]] == [0, 10]
+        # only the first view is pushed, then the progress, like register_view
+        publish.assert_called_once_with(
+            UUID(session_id),
+            {
+                "type": "score",
+                "asset_slug": "a2",
+                "awarded_points": 10,
+                "session_score": 20,
+            },
+            {
+                "type": "progress",
+                "total_assets": 3,
+                "viewed_assets": 2,
+                "remaining_assets": 1,
+                "total_score": 20,
+            },
+        )
+        sip = SessionItemProgress.objects.get(session_id=session_id, asset__slug="a1")
+        assert sip.times_viewed == 2
+        pr = self.client.get(f"/api/progress/?session_id={session_id}")
+        assert pr.data["viewed_assets"] == 2
+        assert pr.data["total_score"] == 20
+
+    def test_view_batch_per_item_errors(self):
+        session_id = self._start_session()
+        r = self._view_batch(
+            [
+                {"session_id": session_id},
+                {"session_id": "not-a-uuid", "asset_slug": "a1"},
+                {
+                    "session_id": "00000000-0000-0000-0000-000000000000",
+                    "asset_slug": "a1",
+                },
+                {"session_id": session_id, "asset_slug": "nope"},
+                "garbage",
+                {"session_id": session_id, "asset_slug": ["a1"]},
+                {"session_id": session_id, "asset_slug": "a1"},
+            ]
+        )
+        assert r.status_code == 200
+        statuses = [item["status"] for item in r.data["results"]]
+        assert statuses == [400, 400, 404, 404, 400, 400, 200]
+        assert r.data["results"][6]["awarded_points"] == 10
+
+    def test_view_batch_rejects_bad_envelope(self):
+        assert self._view_batch([]).status_code == 400
+        r = self.client.post("/api/view/batch/", {"views": "x"}, format="json")
+        assert r.status_code == 400
+        with self.settings(VIEW_BATCH_MAX_ITEMS=1):
+            session_id = self._start_session()
+            r2 = self._view_batch(
+                [
+                    {"session_id": session_id, "asset_slug": "a1"},
+                    {"session_id": session_id, "asset_slug": "a2"},
+                ]
+            )
+            assert r2.status_code == 400
+
+    def test_progress_served_from_session_cache(self):
+        session_id = self._start_session()
+        self._view(session_id, "a1")
+        self._view(session_id, "a2")
+        record = progress_cache.get_session_progress(session_id)
+        assert record["score"] == 20
+        assert progress_cache.viewed_count(record) == 2
+        assert progress_cache.is_completed(record) is False
+        # only the progress_viewed insert: no Asset/SessionItemProgress/Session reads
+        with self.assertNumQueries(1):
+            pr = self.client.get(f"/api/progress/?session_id={session_id}")
+        assert pr.data["viewed_assets"] == 2
+        assert pr.data["total_score"] == 20
+
+    def test_progress_cache_rebuilt_after_eviction(self):
+        session_id = self._start_session()
+        self._view(session_id, "a1")
+        self._view(session_id, "a2")
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            pr = self.client.get(f"/api/progress/?session_id={session_id}")
+        assert pr.data["viewed_assets"] == 2
+        assert pr.data["total_score"] == 20
+        assert progress_cache.get_session_progress(session_id)["score"] == 20
+        cache.clear()
+        r = self._view(session_id, "a3")
+        assert "promo_code" in r.data
+        assert progress_cache.is_completed(
+            progress_cache.get_session_progress(session_id)
+        )
+
+    def test_asset_catalog_serves_lookups_without_queries(self):
+        catalog.get_catalog()
+        with self.assertNumQueries(0):
+            current = catalog.get_catalog()
+            assert current.total == 3
+            assert current.by_slug["a1"].name == "Asset 1"
+            assert current.campaign_counts == {"default": 3}
+
+    def test_asset_catalog_invalidated_on_asset_change(self):
+        first = catalog.get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            Asset.objects.create(slug="a4", name="Asset 4", type="model", campaign="x")
+        current = catalog.get_catalog()
+        assert current.version != first.version
+        assert current.total == 4
+        assert current.campaign_counts == {"default": 3, "x": 1}
+        with self.captureOnCommitCallbacks(execute=True):
+            Asset.objects.filter(slug="a4").delete()
+        assert "a4" not in catalog.get_catalog().by_slug
+
+    def test_asset_catalog_picks_up_remote_version_change(self):
+        with self.settings(ASSET_CATALOG_CHECK_INTERVAL=0):
+            first = catalog.get_catalog()
+            Asset.objects.filter(slug="a1").update(name="Renamed")
+            assert catalog.get_catalog() is first
+            # another process bumped the shared version
+            cache.set(catalog.VERSION_KEY, "other-worker", timeout=None)
+            assert catalog.get_catalog().by_slug["a1"].name == "Renamed"
+
+    def test_stats_from_rollups_match_raw_log(self):
+        s1 = self._start_session()
+        s2 = self._start_session()
+        yesterday = timezone.now() - timezone.timedelta(days=1)
+        ViewEvent.objects.create(
+            session=Session.objects.get(id=s2),
+            asset=Asset.objects.get(slug="a3"),
+            raw_payload={},
+            timestamp=yesterday,
+        )
+        self._view(s1, "a1")
+        self._view(s1, "a1")
+        self._view(s2, "a2")
+        before = self.client.get("/api/stats/").data
+        with self.settings(STATS_COMPACTION_LAG=0):
+            assert rollups.compact_view_events() > 0
+            assert rollups.compact_view_events() == 0
+        totals = dict(AssetTotalStats.objects.values_list("asset__slug", "views"))
+        assert totals == {"a1": 2, "a2": 1, "a3": 1}
+        assert AssetDailyStats.objects.filter(day=yesterday.date()).count() == 1
+        after = self.client.get("/api/stats/").data
+        assert after == before
+        assert after["views_today"] == 3
+        assert after["views_all_time"] == 4
+
+        self._view(s2, "a1")
+        tail = self.client.get("/api/stats/").data
+        assert tail["views_today"] == 4
+        assert tail["views_all_time"] == 5
+
+    def test_stats_compaction_skips_recent_events(self):
+        session_id = self._start_session()
+        self._view(session_id, "a1")
+        with self.settings(STATS_COMPACTION_LAG=3600):
+            assert rollups.compact_view_events() == 0
+        assert not AssetTotalStats.objects.exists()
+        assert self.client.get("/api/stats/").data["views_all_time"] == 1
+
+    def test_archive_events_moves_compacted_days(self):
+        session = Session.objects.get(id=self._start_session())
+        a1 = Asset.objects.get(slug="a1")
+        a2 = Asset.objects.get(slug="a2")
+        old = timezone.now() - timezone.timedelta(days=40)
+        older = old - timezone.timedelta(days=1)
+        for ts, asset in [(older, a1), (old, a1), (old, a2)]:
+            ViewEvent.objects.create(
+                session=session,
+                asset=asset,
+                raw_payload={"slug": asset.slug},
+                timestamp=ts,
+            )
+        ViewEvent.objects.create(
+            session=session,
+            asset=None,
+            event_type="promo_checked",
+            raw_payload={"result": "not_completed"},
+            timestamp=old,
+        )
+        with self.settings(STATS_COMPACTION_LAG=0):
+            rollups.compact_view_events()
+        late = ViewEvent.objects.create(
+            session=session, asset=a2, raw_payload={}, timestamp=old
+        )
+        before = self.client.get("/api/stats/").data
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            self.settings(EVENT_ARCHIVE_DIR=tmp, EVENT_ARCHIVE_CHUNK_SIZE=1),
+        ):
+            assert archive.archive_events(30) == {older.date(): 1}
+            assert ViewEvent.objects.filter(timestamp__lt=old).count() == 0
+            assert ViewEvent.objects.filter(id=late.id).exists()
+
+            with self.settings(STATS_COMPACTION_LAG=0):
+                rollups.compact_view_events()
+            out = StringIO()
+            call_command("archive_events", "--older-than", "30", stdout=out)
+            assert "archived 4 events" in out.getvalue()
+            assert not ViewEvent.objects.filter(
+                timestamp__date__lte=old.date()
+            ).exists()
+            assert self.client.get("/api/stats/").data == before
+
+            assert archive.archived_days() == [older.date(), old.date()]
+            assert len(archive.segments_for_day(old.date())) == 1
+            views = archive.aggregate(by=("day", "asset"), event_types=["viewed_asset"])
+            assert views == {
+                (older.date(), a1.id): 1,
+                (old.date(), a1.id): 1,
+                (old.date(), a2.id): 2,
+            }
+            events = list(archive.iter_events(old.date(), old.date()))
+            assert [e["id"] for e in events] == sorted(e["id"] for e in events)
+            promo = next(e for e in events if e["event_type"] == "promo_checked")
+            assert promo["asset"] is None
+            assert promo["session"] == session.id
+            assert promo["payload"] == {"result": "not_completed"}
+            assert abs(promo["timestamp"] - old) < timezone.timedelta(microseconds=1)
+
+    def test_event_sink_buffer_roundtrip(self):
+        session_id = self._start_session()
+        asset = Asset.objects.get(slug="a1")
+        event = event_sink.build_event(
+            session_id, "viewed_asset", {"asset_slug": "a1", "x": [1, 2]}, asset.id
+        )
+        restored = event_sink.decode_event(event_sink.encode_event(event))
+        assert str(restored.session_id) == session_id
+        assert restored.asset_id == asset.id
+        assert restored.event_type == "viewed_asset"
+        assert restored.timestamp == event.timestamp
+        assert restored.payload == {"asset_slug": "a1", "x": [1, 2]}
+        assert restored.data == event.data
+        assert restored.raw_payload == {"x": [1, 2]}
+
+    def test_event_payloads_use_schema_columns(self):
+        session_id = self._start_session()
+        self.client.post(
+            "/api/view/",
+            {"session_id": session_id, "asset_slug": "a1", "device": "ios"},
+            format="json",
+        )
+        for slug in ("a2", "a3"):
+            self._view(session_id, slug)
+        self.client.get(f"/api/progress/?session_id={session_id}")
+        code = self.client.get(f"/api/promo/?session_id={session_id}").data[
+            "promo_code"
+        ]
+        events = ViewEvent.objects.filter(session_id=session_id).order_by("id")
+        payloads = {e.event_type: e.payload for e in events}
+        assert payloads["session_started"] == {"event": "session_started"}
+        assert events[1].payload == {
+            "session_id": session_id,
+            "asset_slug": "a1",
+            "device": "ios",
+        }
+        assert events[1].raw_payload == {"device": "ios"}
+        assert payloads["first_view_awarded"] == {
+            "asset_slug": "a3",
+            "awarded_points": 10,
+        }
+        assert payloads["progress_viewed"]["remaining_assets"] == 0
+        assert payloads["promo_issued"] == {"code": code, "existing": True}
+        assert payloads["promo_checked"] == {"result": "issued", "code": code}
+        assert all(e.data is not None for e in events)
+        assert not events.exclude(event_type="viewed_asset").filter(
+            raw_payload__isnull=False
+        )
+        assert events.filter(code=code).count() == 3
+
+        with self.settings(EVENT_PAYLOAD_MAX_BYTES=64):
+            big = event_sink.build_event(
+                session_id, "viewed_asset", {"asset_slug": "a1", "blob": "x" * 100}
+            )
+        assert big.raw_payload == {event_schema.TRUNCATED_KEY: 111}
+        assert big.payload["asset_slug"] == "a1"
+
+    def test_compact_event_payloads_converts_legacy_rows(self):
+        session = Session.objects.get(id=self._start_session())
+        legacy = [
+            ViewEvent.objects.create(
+                session=session,
+                event_type="promo_checked",
+                raw_payload={"result": "exists", "code": "PROMO-X"},
+            ),
+            ViewEvent.objects.create(
+                session=session,
+                raw_payload={"session_id": str(session.id), "asset_slug": 5},
+            ),
+            ViewEvent.objects.create(
+                session=session, event_type="custom", raw_payload={"k": "v"}
+            ),
+        ]
+        before = [e.payload for e in legacy]
+        out = StringIO()
+        call_command("compact_event_payloads", "--dry-run", stdout=out)
+        assert ViewEvent.objects.filter(code="PROMO-X").count() == 0
+        call_command("compact_event_payloads", stdout=out)
+        assert "converted 2 of 3 legacy events" in out.getvalue()
+        assert "promo_checked" in out.getvalue()
+        rows = [ViewEvent.objects.get(id=e.id) for e in legacy]
+        assert [e.payload for e in rows] == before
+        assert rows[0].code == "PROMO-X"
+        assert rows[0].raw_payload is None
+        assert rows[1].raw_payload == {"asset_slug": 5}
+        assert rows[2].data is None
+
+    def test_event_sink_writes_inline_without_redis(self):
+        session_id = self._start_session()
+        with self.settings(EVENT_BUFFER_TYPES=frozenset({"progress_viewed"})):
+            self.client.get(f"/api/progress/?session_id={session_id}")
+            assert event_sink.drain() == 0
+        assert (
+            ViewEvent.objects.filter(
+                event_type="progress_viewed", session_id=session_id
+            ).count()
+            == 1
+        )
+
+    @override_settings(
+        EVENT_BUFFER_TYPES=frozenset({"progress_viewed", "broken"}),
+        EVENT_BUFFER_BATCH_SIZE=3,
+    )
+    def test_event_buffer_drain_locks_and_dead_letters_bad_items(self):
+        session_id = self._start_session()
+        fake = ListRedis()
+        bulk_create = ViewEvent.objects.bulk_create
+
+        def reject_broken(events, *args, **kwargs):
+            if any(e.event_type == "broken" for e in events):
+                raise IntegrityError("broken")
+            return bulk_create(events, *args, **kwargs)
+
+        with (
+            mock.patch.object(event_sink, "get_redis", return_value=fake),
+            mock.patch.object(
+                ViewEvent.objects, "bulk_create", side_effect=reject_broken
+            ),
+        ):
+            for _ in range(2):
+                self.client.get(f"/api/progress/?session_id={session_id}")
+            event_sink.log_event(session_id, "broken", {})
+            fake.rpush(event_sink.BUFFER_KEY, "not json")
+            buffered = list(fake.lists[event_sink.BUFFER_KEY])
+            assert len(buffered) == 4
+
+            fake.set(event_sink.LOCK_KEY, "other run")
+            assert event_sink.drain() == 0
+            assert fake.lists[event_sink.BUFFER_KEY] == buffered
+            del fake.values[event_sink.LOCK_KEY]
+
+            with (
+                mock.patch.object(
+                    event_sink, "_insert", side_effect=OperationalError("gone")
+                ),
+                self.assertRaises(OperationalError),  # noqa: PT027
+            ):
+                event_sink.drain()
+            assert fake.lists[event_sink.BUFFER_KEY] == buffered
+            assert event_sink.LOCK_KEY not in fake.values
+
+            with self.assertLogs("arb.event_sink", "ERROR"):
+                assert event_sink.drain() == 2
+        assert fake.lists[event_sink.BUFFER_KEY] == []
+        assert fake.lists[event_sink.DEAD_KEY] == [buffered[2], "not json"]
+        assert (
+            ViewEvent.objects.filter(
+                session_id=session_id, event_type="progress_viewed"
+            ).count()
+            == 2
+        )
+
+    def _count_statements(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func()
+        statements = [
+            q["sql"]
+            for q in ctx.captured_queries
+            if not q["sql"].upper().startswith(("SAVEPOINT", "RELEASE", "ROLLBACK"))
+        ]
+        return result, len(statements)
+
+    def test_view_event_query_budget(self):
+        budget = scoring.VIEW_EVENT_QUERY_BUDGET
+        session_id = self._start_session()
+        catalog.get_catalog()
+        r, n = self._count_statements(lambda: self._view(session_id, "a1"))
+        assert r.data["awarded_points"] == 10
+        assert n <= budget["first"]
+        r, n = self._count_statements(lambda: self._view(session_id, "a1"))
+        assert r.data["awarded_points"] == 0
+        assert n <= budget["repeat"]
+        self._view(session_id, "a2")
+        r, n = self._count_statements(lambda: self._view(session_id, "a3"))
+        assert "promo_code" in r.data
+        assert n <= budget["completing"]
+        r, n = self._count_statements(lambda: self._view(session_id, "a3"))
+        assert "promo_code" not in r.data
+        assert n <= budget["repeat"]
+
+    def test_last_seen_coalesced_and_idle_sessions_reaped(self):
+        session_id = self._start_session()
+        stamp = Session.objects.get(id=session_id).last_seen
+        self._view(session_id, "a1")
+        with CaptureQueriesContext(connection) as ctx:
+            self._view(session_id, "a1")
+        assert not [
+            q for q in ctx.captured_queries if 'UPDATE "arb_session"' in q["sql"]
+        ]
+        assert Session.objects.get(id=session_id).last_seen == stamp
+
+        old = timezone.now() - timezone.timedelta(hours=3)
+        Session.objects.filter(id=session_id).update(last_seen=old)
+        self._view(session_id, "a1")
+        assert Session.objects.get(id=session_id).last_seen > old
+
+        idle = [self._start_session() for _ in range(5)]
+        Session.objects.filter(id__in=idle).update(last_seen=old)
+        assert session_activity.reap_idle_sessions(chunk_size=2, max_chunks=2) == 4
+        assert tasks.reap_idle_sessions() == 1
+        assert set(
+            Session.objects.filter(is_active=False).values_list("id", flat=True)
+        ) == {UUID(i) for i in idle}
+        assert Session.objects.get(id=session_id).is_active
+
+        self._view(idle[0], "a2")
+        revived = Session.objects.get(id=idle[0])
+        assert revived.is_active
+        assert revived.last_seen > old
+
+    def test_linked_session_first_views_update_user_score(self):
+        session1 = self._start_session()
+        session2 = self._start_session()
+        for session_id in (session1, session2):
+            self.client.post(
+                "/api/user/email/",
+                {"session_id": session_id, "email": "seen@example.com"},
+                format="json",
+            )
+        user = User.objects.get(email="seen@example.com")
+        _, n = self._count_statements(lambda: self._view(session1, "a1"))
+        assert n <= scoring.VIEW_EVENT_QUERY_BUDGET["first_linked"]
+        self._view(session2, "a1")
+        self.client.post(
+            "/api/view/batch/",
+            {
+                "views": [
+                    {"session_id": session2, "asset_slug": "a2"},
+                    {"session_id": session1, "asset_slug": "a2"},
+                ]
+            },
+            format="json",
+        )
+        user.refresh_from_db()
+        assert user.total_score == 20
+        assert UserAssetSeen.objects.filter(user=user).count() == 2
+        with self.assertNumQueries(2):
+            r = self.client.get(f"/api/progress/?user_id={user.id}")
+        assert r.data["viewed_assets"] == 2
+        assert r.data["total_score"] == 20
+
+    def test_user_email_relink_does_not_double_count(self):
+        session_id = self._start_session()
+        self._view(session_id, "a1")
+        self._view(session_id, "a2")
+        for _ in range(2):
+            r = self.client.post(
+                "/api/user/email/",
+                {"session_id": session_id, "email": "again@example.com"},
+                format="json",
+            )
+            assert r.data["user_total_score"] == 20
+        asset_ids = Asset.objects.filter(slug__in=["a1", "a2"]).values_list(
+            "id", flat=True
+        )
+        assert scoring.mark_assets_seen(r.data["user_id"], asset_ids) == 0
+
+    def test_user_email_counts_views_committed_after_session_load(self):
+        session_id = self._start_session()
+        stale = Session.objects.get(id=session_id)
+        self._view(session_id, "a1")
+        reply = views._link_email(stale, "late@example.com")  # noqa: SLF001
+        assert reply["user_total_score"] == 10
+        assert UserAssetSeen.objects.filter(user_id=reply["user_id"]).count() == 1
+
+    @override_settings(
+        EMAIL_BACKEND="arb.tests.FlakyEmailBackend",
+        PROMO_EMAIL_MODE="batch",
+        PROMO_EMAIL_BATCH_SIZE=2,
+        PROMO_EMAIL_RATE=0,
+        PROMO_EMAIL_RETRIES=0,
+    )
+    def test_promo_emails_sent_in_batches(self):
+        session_id = self._start_session()
+        for slug in ("a1", "a2", "a3"):
+            self._view(session_id, slug)
+        self.client.post(
+            "/api/user/email/",
+            {"session_id": session_id, "email": "first@example.com"},
+            format="json",
+        )
+        assert mail.outbox == []
+        now = timezone.now()
+        for i, email in enumerate(
+            ["x1@example.com", "bad@example.com", "x2@example.com"]
+        ):
+            PromoCode.objects.create(code=f"P{i}", email=email, issued_at=now)
+        PromoCode.objects.create(
+            code="OLD",
+            email="old@example.com",
+            issued_at=now - timezone.timedelta(days=3),
+        )
+        with self.settings(PROMO_EMAIL_MODE="task"):
+            assert tasks.send_pending_promo_emails() == 0
+
+        FlakyEmailBackend.created = 0
+        with self.assertLogs("arb.tasks", "WARNING"):
+            assert tasks.send_pending_promo_emails() == 3
+        assert FlakyEmailBackend.created == 1
+        assert sorted(m.to[0] for m in mail.outbox) == [
+            "first@example.com",
+            "x1@example.com",
+            "x2@example.com",
+        ]
+        unsent = PromoCode.objects.filter(sent_at__isnull=True, email__isnull=False)
+        assert sorted(unsent.values_list("code", flat=True)) == ["OLD", "P1"]
+        sent_events = ViewEvent.objects.filter(event_type="promo_sent")
+        assert [e.payload["email"] for e in sent_events] == ["first@example.com"]
+
+        assert PromoCode.objects.get(code="P1").claimed_at is None
+
+        mail.outbox.clear()
+        with self.assertLogs("arb.tasks", "WARNING"):
+            assert tasks.send_pending_promo_emails() == 0
+        assert mail.outbox == []
+
+        PromoCode.objects.create(
+            code="LEASED", email="x3@example.com", issued_at=now, claimed_at=now
+        )
+        mail.outbox.clear()
+        with self.assertLogs("arb.tasks", "WARNING"):
+            assert tasks.send_pending_promo_emails() == 0
+        with (
+            self.settings(PROMO_EMAIL_LEASE=0),
+            self.assertLogs("arb.tasks", "WARNING"),
+        ):
+            assert tasks.send_pending_promo_emails() == 1
+        assert [m.to[0] for m in mail.outbox] == ["x3@example.com"]
+
+    def test_promocode_unique_per_session(self):
+        session = Session.objects.get(id=self._start_session())
+        PromoCode.objects.create(code="FIRST", session=session)
+        with self.assertRaises(IntegrityError), transaction.atomic():  # noqa: PT027
+            PromoCode.objects.create(code="SECOND", session=session)
+
+    def test_promo_codes_claimed_from_pool(self):
+        pool = set(promo_pool.available("default").values_list("code", flat=True))
+        session_id = self._start_session()
+        for slug in ("a1", "a2", "a3"):
+            r = self._view(session_id, slug)
+        code = r.data["promo_code"]
+        assert code in pool
+        promo = PromoCode.objects.get(code=code)
+        assert str(promo.session_id) == session_id
+        assert promo.issued_at is not None
+        assert promo_pool.available("default").count() == 9
+
+        with self.settings(PROMO_POOL_LOW_WATERMARK=5, PROMO_POOL_TARGET=12):
+            assert tasks.refill_promo_pool() == 0
+            spare = promo_pool.available("default").values_list("id", flat=True)[3:]
+            PromoCode.objects.filter(id__in=list(spare)).delete()
+            assert tasks.refill_promo_pool() == 9
+        assert promo_pool.available("default").count() == 12
+
+        out = StringIO()
+        call_command(
+            "mint_promo_codes",
+            "--campaign",
+            "partner",
+            "--count",
+            "4",
+            stdout=out,
+            stderr=StringIO(),
+        )
+        partner = out.getvalue().split()
+        assert len(partner) == 4
+        assert set(partner) == set(
+            promo_pool.available("partner").values_list("code", flat=True)
+        )
+
+        promo_pool.available("default").delete()
+        other = self._start_session()
+        with self.assertLogs("arb.scoring", "WARNING"):
+            for slug in ("a1", "a2", "a3"):
+                r = self._view(other, slug)
+        assert r.data["promo_code"].startswith("PROMO-")
+        assert PromoCode.objects.get(code=r.data["promo_code"]).campaign == "default"
+
+        # an inline code colliding with an issued one is drawn again
+        third = self._start_session()
+        self._view(third, "a1")
+        self._view(third, "a2")
+        with (
+            mock.patch.object(
+                promo_pool, "generate_code", side_effect=[code, "PROMO-FRESH"]
+            ),
+            self.assertLogs("arb.scoring", "WARNING"),
+        ):
+            r = self._view(third, "a3")
+        assert r.status_code == 200
+        assert r.data["promo_code"] == "PROMO-FRESH"
+        assert str(PromoCode.objects.get(code=code).session_id) == session_id
+
+    def test_used_promocode_not_reissued(self):
+        session_id = self._start_session()
+        for slug in ("a1", "a2", "a3"):
+            r = self._view(session_id, slug)
+        PromoCode.objects.filter(code=r.data["promo_code"]).update(
+            used_at=timezone.now()
+        )
+        r2 = self.client.get(f"/api/promo/?session_id={session_id}")
+        assert r2.status_code == 404
+        assert PromoCode.objects.filter(session_id=session_id).count() == 1
+
+    def test_loadtest_command_in_process(self):
+        out = StringIO()
+        with self.assertRaises(CommandError):  # noqa: PT027
+            call_command("loadtest", visitors=3, stdout=out)
+        assert not Session.objects.exists()
+        with mock.patch.object(views.send_promocode_email, "delay") as delay:
+            call_command(
+                "loadtest",
+                visitors=3,
+                concurrency=1,
+                seed=1,
+                allow_writes=True,
+                stdout=out,
+            )
+        delay.assert_not_called()
+        promo = PromoCode.objects.filter(session__isnull=False).first()
+        assert promo.email.endswith("@loadtest.invalid")
+        assert tasks.send_promocode_email(promo.code) is False
+        with self.settings(PROMO_EMAIL_MODE="batch"):
+            assert tasks.send_pending_promo_emails() == 0
+        assert mail.outbox == []
+        report = out.getvalue()
+        assert "3 visitors, 21 requests" in report
+        assert "0 errors" in report
+        assert Session.objects.count() == 3
+        assert PromoCode.objects.filter(session__isnull=False).count() == 3
+        assert loadgen.percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0  # noqa: PLR2004
+        assert loadgen.percentile([1.0, 2.0, 3.0, 4.0], 99) == 4.0  # noqa: PLR2004
+
+    def _metrics(self):
+        staff, _ = get_user_model().objects.get_or_create(
+            username="prometheus", defaults={"is_staff": True}
+        )
+        self.client.force_authenticate(staff)
+        try:
+            return self.client.get("/api/metrics/")
+        finally:
+            self.client.force_authenticate(None)
+
+    def test_request_metrics_and_server_timing(self):
+        metrics.reset()
+        session_id = self._start_session()
+        r = self._view(session_id, "a1")
+        timing = r["Server-Timing"]
+        assert timing.startswith("app;dur=")
+        queries = int(timing.split('desc="')[1].split()[0])
+        assert queries >= scoring.VIEW_EVENT_QUERY_BUDGET["first"]
+        self._view(session_id, "a1")
+        self.client.get("/api/nope/")
+        assert self.client.get("/api/metrics/").status_code == 403
+        r = self._metrics()
+        assert r.status_code == 200
+        assert r["Content-Type"].startswith("text/plain; version=0.0.4")
+        body = r.content.decode()
+        assert 'arb_request_duration_seconds_count{route="view_event"} 2' in body
+        assert 'arb_request_db_queries_bucket{route="view_event",le="+Inf"} 2' in body
+        assert 'arb_request_db_queries_sum{route="view_event"} 0' not in body
+        assert 'arb_http_requests_total{route="session_start",status="201"} 1' in body
+        assert 'arb_http_requests_total{route="unmatched",status="404"} 1' in body
+
+    def test_idempotency_key_replays_write_requests(self):
+        metrics.reset()
+        key = {"HTTP_IDEMPOTENCY_KEY": "start-1"}
+        r1 = self.client.post("/api/session/start/", {}, format="json", **key)
+        r2 = self.client.post("/api/session/start/", {}, format="json", **key)
+        assert r1.status_code == r2.status_code == 201
+        assert json.loads(r2.content) == r1.data
+        assert r2[idempotency.REPLAYED_HEADER] == "true"
+        assert Session.objects.count() == 1
+        # another client reusing the key starts its own session
+        r3 = self.client.post(
+            "/api/session/start/", {}, format="json", REMOTE_ADDR="10.0.0.2", **key
+        )
+        assert idempotency.REPLAYED_HEADER not in r3
+        assert r3.data["session_id"] != r1.data["session_id"]
+        session_id = r1.data["session_id"]
+        body = {"session_id": session_id, "asset_slug": "a1"}
+        key = {"HTTP_IDEMPOTENCY_KEY": "view-1"}
+        self.client.post("/api/view/", body, format="json", **key)
+        events = ViewEvent.objects.count()
+        r = self.client.post("/api/view/", body, format="json", **key)
+        assert json.loads(r.content)["awarded_points"] == 10  # noqa: PLR2004
+        assert ViewEvent.objects.count() == events
+        body["asset_slug"] = "a2"
+        r = self.client.post("/api/view/", body, format="json", **key)
+        assert r.status_code == 422  # noqa: PLR2004
+        assert not SessionItemProgress.objects.filter(asset__slug="a2").exists()
+        # a duplicate arriving while the first request still runs
+        client = f"session:{session_id}"
+        first = cache.get(idempotency._cache_key("view_event", client, "view-1"))  # noqa: SLF001
+        cache.set(
+            idempotency._cache_key("view_event", client, "view-2"),  # noqa: SLF001
+            {"state": idempotency.PENDING, "fingerprint": first["fingerprint"]},
+        )
+        body["asset_slug"] = "a1"
+        with self.settings(IDEMPOTENCY_WAIT=0):
+            r = self.client.post(
+                "/api/view/", body, format="json", HTTP_IDEMPOTENCY_KEY="view-2"
+            )
+        assert r.status_code == 409  # noqa: PLR2004
+        body = self._metrics().content.decode()
+        for route, result, count in (
+            ("session_start", "stored", 2),
+            ("session_start", "replayed", 1),
+            ("view_event", "mismatch", 1),
+            ("view_event", "conflict", 1),
+        ):
+            assert (
+                f'arb_idempotency_requests_total{{route="{route}",result="{result}"}}'
+                f" {count}" in body
+            )
+
+    def test_rate_limit_token_buckets(self):
+        metrics.reset()
+        session_id = self._start_session()
+        other_id = self._start_session()
+        fake = BucketRedis()
+        limits = {"view_event": "ip=50/3,session=1/2"}
+        with (
+            self.settings(RATE_LIMITS=limits),
+            mock.patch.object(ratelimit, "get_redis", return_value=fake),
+        ):
+            ratelimit.reset()
+            codes = [self._view(session_id, "a1").status_code for _ in range(3)]
+            assert codes == [200, 200, 429]
+            r = self._view(session_id, "a1")
+            assert r["Retry-After"] == "2"
+            assert r.json()["detail"] == "Too many requests (session limit)."
+            assert self._view(other_id, "a1").status_code == 200  # noqa: PLR2004
+            # the ip bucket is shared by both sessions and runs out first
+            r = self._view(other_id, "a2")
+            assert r.json()["detail"] == "Too many requests (ip limit)."
+            keys, args = fake.calls[0]
+            assert keys == [
+                "arb:rl:view_event:ip:127.0.0.1",
+                f"arb:rl:view_event:session:{session_id}",
+            ]
+            assert args == [50.0, 3, 1.0, 2]
+            # routes without limits and a Redis outage never reject
+            assert self.client.get("/api/stats/").status_code == 200  # noqa: PLR2004
+            fake.fail = True
+            assert self._view(other_id, "a1").status_code == 200  # noqa: PLR2004
+        ratelimit.reset()
+        body = self._metrics().content.decode()
+        for result, count in (
+            ("allowed", 3),
+            ("limited_session", 2),
+            ("limited_ip", 1),
+            ("unavailable", 1),
+        ):
+            assert (
+                f'arb_rate_limit_requests_total{{route="view_event",result="{result}"}}'
+                f" {count}" in body
+            )
+        with self.assertRaises(ValueError):  # noqa: PT027
+            ratelimit.parse_limits("user=1/2")
+
+    def test_replica_router_sticks_sessions_after_writes(self):
+        session_id = self._start_session()
+        router = db_router.ReplicaRouter()
+        with self.settings(DATABASE_REPLICAS=["replica_1", "replica_2"]):
+            db_router._health.update(  # noqa: SLF001
+                {"replica_1": (time.monotonic(), True)}
+            )
+            with mock.patch.object(db_router, "replica_lag", return_value=30.0):
+                assert db_router.choose_replica() == "replica_1"
+                # the lag check is cached until DB_REPLICA_CHECK_INTERVAL
+                db_router.replica_lag.assert_called_once_with("replica_2")
+            assert db_router.choose_replica(session_id) == "replica_1"
+            self._view(session_id, "a1")
+            assert db_router.choose_replica(session_id) is None
+            token = db_router._replica.set("replica_1")  # noqa: SLF001
+            try:
+                # TestCase runs inside a transaction, which pins reads
+                assert router.db_for_read(Session) == "default"
+                with mock.patch.object(connection, "in_atomic_block", False):  # noqa: FBT003
+                    assert router.db_for_read(Session) == "replica_1"
+                    assert router.db_for_write(Session) == "default"
+            finally:
+                db_router._replica.reset(token)  # noqa: SLF001
+            assert router.allow_migrate("replica_2", "arb") is False
+        db_router._health.clear()  # noqa: SLF001
+        r = self.client.get("/api/progress/", {"session_id": session_id})
+        assert r.data["viewed_assets"] == 1
+
+    def test_connection_pool_bounds_and_recycles(self):
+        metrics.reset()
+        opened, closed, broken = [], [], set()
+
+        def factory():
+            opened.append(object())
+            return opened[-1]
+
+        conns = pool.Pool(
+            "db",
+            factory,
+            dispose=closed.append,
+            check=lambda conn: conn not in broken,
+            max_size=2,
+            max_idle=60,
+            max_lifetime=120,
+            check_after=1,
+            timeout=0.05,
+        )
+        first, fresh = conns.acquire()
+        assert fresh
+        second, _ = conns.acquire()
+        with self.assertRaises(pool.PoolTimeout):  # noqa: PT027
+            conns.acquire()
+        conns.release(first)
+        assert conns.acquire() == (first, False)
+        conns.release(second, discard=True)
+        assert closed == [second]
+        conns.release(first)
+        entry = conns._idle[-1]  # noqa: SLF001
+        # idle past check_after: pinged, and a dead connection is replaced
+        entry.released -= 2
+        broken.add(first)
+        third, fresh = conns.acquire()
+        assert fresh
+        assert third is not first
+        assert closed == [second, first]
+        # too old to go back into the pool
+        conns._busy[id(third)].created -= 121  # noqa: SLF001
+        conns.release(third)
+        assert closed[-1] is third
+        assert conns.stats() == {"size": 0, "idle": 0, "busy": 0, "max_size": 2}
+        body = metrics.render()
+        for event, count in (
+            ("opened", 3),
+            ("reused", 1),
+            ("exhausted", 1),
+            ("broken", 2),
+            ("recycled", 1),
+        ):
+            assert (
+                f'arb_db_pool_connections_total{{route="db",event="{event}"}} '
+                f"{count}" in body
+            )
+        assert 'arb_db_pool_wait_seconds_count{route="db"} 5' in body
+
+    def test_warmup_steps_and_pool_after_fork(self):
+        assert set(warmup.preload()) == {"imports", "urls", "catalog"}
+        assert set(warmup.warm_worker()) == {"db", "redis", "catalog"}
+        # a failing step is logged and timed, the rest still runs
+        with (
+            mock.patch.object(warmup, "_ping_db", side_effect=RuntimeError),
+            self.assertLogs("arb.warmup", "ERROR"),
+        ):
+            assert set(warmup.warm_worker()) == {"db", "redis", "catalog"}
+
+        closed = []
+        conns = pool.Pool("fork", object, dispose=closed.append, max_size=1)
+        held, _ = conns.acquire()
+        pool._forget_after_fork()  # noqa: SLF001
+        # the child forgets the parent's connections without closing them
+        assert conns.stats()["size"] == 0
+        assert conns.acquire()[0] is not held
+        assert closed == []
+
+    def _call_async(self, view, method: str, path: str, body=None):
+        factory = RequestFactory()
+        if method == "POST":
+            request = factory.post(
+                path, json.dumps(body or {}), content_type="application/json"
+            )
+        else:
+            request = factory.get(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = async_to_sync(view)(request)
+        return response.status_code, json.loads(response.content or "{}")
+
+    def test_async_views_follow_sync_contract(self):
+        code, data = self._call_async(
+            async_views.session_start, "POST", "/api/session/start/"
+        )
+        assert code == 201
+        session_id = data["session_id"]
+        assert ViewEvent.objects.filter(
+            session_id=session_id, event_type="session_started"
+        ).exists()
+        for slug, points in (("a1", 10), ("a1", 0), ("a2", 10), ("a3", 10)):
+            code, data = self._call_async(
+                async_views.view_event,
+                "POST",
+                "/api/view/",
+                {"session_id": session_id, "asset_slug": slug},
+            )
+            assert code == 200
+            assert data["awarded_points"] == points
+        assert data["session_score"] == 30
+        promo_code = data["promo_code"]
+        code, data = self._call_async(
+            async_views.progress, "GET", f"/api/progress/?session_id={session_id}"
+        )
+        assert data == {
+            "total_assets": 3,
+            "viewed_assets": 3,
+            "remaining_assets": 0,
+            "total_score": 30,
+        }
+        code, data = self._call_async(
+            async_views.promo, "GET", f"/api/promo/?session_id={session_id}"
+        )
+        assert (code, data) == (200, {"promo_code": promo_code})
+
+    def test_async_views_errors(self):
+        code, data = self._call_async(async_views.view_event, "POST", "/api/view/", {})
+        assert code == 400
+        for session_id in ("not-a-uuid", "00000000-0000-0000-0000-000000000000"):
+            code, data = self._call_async(
+                async_views.view_event,
+                "POST",
+                "/api/view/",
+                {"session_id": session_id, "asset_slug": "a1"},
+            )
+            assert code == 404
+            code, _ = self._call_async(
+                async_views.progress, "GET", f"/api/progress/?session_id={session_id}"
+            )
+            assert code == 404
+        code, data = self._call_async(
+            async_views.view_event,
+            "POST",
+            "/api/view/",
+            {"session_id": "not-a-uuid", "asset_slug": {"a": 1}},
+        )
+        assert (code, data) == (400, {"detail": "asset_slug must be a string"})
+        code, data = self._call_async(
+            async_views.promo, "GET", "/api/promo/?email=nobody@example.com"
+        )
+        assert (code, data) == (404, {"detail": "not_found"})
+        code, _ = self._call_async(async_views.progress, "POST", "/api/progress/")
+        assert code == 405
+
+    def test_promo_for_anonymous_session_ignores_other_sessions_codes(self):
+        other = self._start_session()
+        for slug in ("a1", "a2", "a3"):
+            self._view(other, slug)
+        session_id = self._start_session()
+        r = self.client.get(f"/api/promo/?session_id={session_id}")
+        assert r.status_code == 404
+        code, _ = self._call_async(
+            async_views.promo, "GET", f"/api/promo/?session_id={session_id}"
+        )
+        assert code == 404
+
+    def test_session_websocket_handles_messages_and_pushes_updates(self):
+        session_id = self._start_session()
+
+        def connect(path, origin=None):
+            headers = [(b"host", b"testserver")]
+            if origin:
+                headers.append((b"origin", origin.encode()))
+            return ApplicationCommunicator(
+                ws.application,
+                {
+                    "type": "websocket",
+                    "path": path,
+                    "headers": headers,
+                    "client": ("10.0.0.1", 5000),
+                },
+            )
+
+        async def send(comm, message):
+            # commit what the message wrote, as the socket's own transaction would
+            capture = self.captureOnCommitCallbacks(execute=True)
+            await sync_to_async(capture.__enter__)()
+            await comm.send_input({"type": "websocket.receive", "text": message})
+            reply = await receive(comm)
+            await sync_to_async(capture.__exit__)(None, None, None)
+            return reply
+
+        async def receive(comm):
+            return json.loads((await comm.receive_output(1))["text"])
+
+        def http_view(slug):
+            assert self._view(session_id, slug).status_code == 200
+
+        async def scenario():
+            for path, origin in (
+                ("/api/ws/session/00000000-0000-0000-0000-000000000000/", None),
+                ("/api/ws/session/not-a-uuid/", None),
+                (f"/api/ws/session/{session_id}/", "https://evil.example"),
+            ):
+                comm = connect(path, origin)
+                await comm.send_input({"type": "websocket.connect"})
+                assert await comm.receive_output(1) == {
+                    "type": "websocket.close",
+                    "code": ws.CLOSE_NOT_FOUND,
+                }
+
+            comm = connect(f"/api/ws/session/{session_id}/", "http://localhost:3000")
+            await comm.send_input({"type": "websocket.connect"})
+            assert await comm.receive_output(1) == {"type": "websocket.accept"}
+            reply = await send(
+                comm, json.dumps({"type": "view", "asset_slug": "a1", "id": 7})
+            )
+            assert reply == {
+                "type": "view",
+                "session_id": session_id,
+                "asset_slug": "a1",
+                "awarded_points": 10,
+                "session_score": 10,
+                "id": 7,
+            }
+            # the socket's own view is pushed to it as well once committed
+            assert (await receive(comm))["type"] == "score"
+            assert (await receive(comm))["remaining_assets"] == 2
+            reply = await send(comm, json.dumps({"type": "view", "asset_slug": "zz"}))
+            assert (reply["type"], reply["status"]) == ("error", 404)
+            assert (await send(comm, "[1]"))["status"] == 400
+            assert (await send(comm, '{"type": "promo"}'))["status"] == 400
+            assert (await send(comm, '{"type": ["view"]}'))["status"] == 400
+            reply = await send(comm, '{"type": "view", "asset_slug": ["a1"]}')
+            assert reply["status"] == 400
+            reply = await send(comm, '{"type": "email", "email": {"a": 1}}')
+            assert reply["status"] == 400
+            with (
+                mock.patch.object(
+                    progress_cache, "get_session_progress", side_effect=RuntimeError
+                ),
+                self.assertLogs("arb.ws", "ERROR"),
+            ):
+                reply = await send(comm, '{"type": "progress", "id": 9}')
+            assert reply == {
+                "type": "error",
+                "status": 500,
+                "detail": "Internal server error",
+                "id": 9,
+            }
+            reply = await send(comm, '{"type": "progress"}')
+            assert reply["viewed_assets"] == 1
+            assert reply["total_score"] == 10
+
+            # views over HTTP reach the socket once committed
+            await sync_to_async(http_view)("a2")
+            assert await receive(comm) == {
+                "type": "score",
+                "asset_slug": "a2",
+                "awarded_points": 10,
+                "session_score": 20,
+            }
+            assert (await receive(comm))["remaining_assets"] == 1
+            await sync_to_async(http_view)("a3")
+            assert (await receive(comm))["type"] == "score"
+            assert (await receive(comm))["remaining_assets"] == 0
+            promo = await receive(comm)
+            assert promo["type"] == "promo_issued"
+            reply = await send(
+                comm, json.dumps({"type": "email", "email": "ws@example.com"})
+            )
+            assert (reply["type"], reply["user_total_score"]) == ("email", 30)
+
+            await comm.send_input({"type": "websocket.disconnect", "code": 1000})
+            await comm.wait(1)
+            assert not live.get_hub().queues
+            return promo["promo_code"]
+
+        with mock.patch.object(
+            ws, "_call", new=lambda func, *args: sync_to_async(func)(*args)
+        ):
+            code = async_to_sync(scenario)()
+        assert PromoCode.objects.get(code=code).email == "ws@example.com"
+        assert (
+            ViewEvent.objects.filter(
+                session_id=session_id, event_type="viewed_asset"
+            ).count()
+            == 3
+        )
+
+    def test_conditional_get_by_version_counters(self):
+        def write(func, *args):
+            with self.captureOnCommitCallbacks(execute=True):
+                return func(*args)
+
+        def get(path, etag=None):
+            headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+            return self.client.get(path, **headers)
+
+        session_id = write(self._start_session)
+        progress = f"/api/progress/?session_id={session_id}"
+        promo = f"/api/promo/?session_id={session_id}"
+        first = get(progress)
+        etag = first["ETag"]
+        assert first.status_code == 200
+        assert "no-cache" in first["Cache-Control"]
+        with CaptureQueriesContext(connection) as queries:
+            r = get(progress, etag)
+        assert (r.status_code, r["ETag"], len(queries)) == (304, etag, 0)
+        # a first view bumps the session; a repeat view changes nothing
+        self._view(session_id, "a1")
+        r = get(progress, etag)
+        assert r.status_code == 200
+        assert r["ETag"] != etag
+        etag = r["ETag"]
+        self._view(session_id, "a1")
+        assert get(progress, etag).status_code == 304
+
+        stats = get("/api/stats/")
+        assert get("/api/stats/", stats["ETag"]).status_code == 304
+        assert get(promo).status_code == 404
+        assert not get(promo).has_header("ETag")
+        write(
+            self.client.post,
+            "/api/user/email/",
+            {"session_id": session_id, "email": "etag@example.com"},
+            "json",
+        )
+        user_progress = f"/api/progress/?user_id={User.objects.get().id}"
+        user_etag = get(user_progress)["ETag"]
+        self._view(session_id, "a2")
+        self._view(session_id, "a3")
+        assert get("/api/stats/", stats["ETag"]).status_code == 200
+        assert get(user_progress, user_etag).status_code == 200
+        r = get(promo)
+        assert r.status_code == 200
+        promo_etag = r["ETag"]
+        assert get(promo, promo_etag).status_code == 304
+        code, _ = self._call_async(async_views.promo, "GET", promo)
+        assert code == 200
+        request = RequestFactory().get(promo, HTTP_IF_NONE_MATCH=promo_etag)
+        assert async_to_sync(async_views.promo)(request).status_code == 304
+        # redeemed through the admin: the post_save signal bumps versions
+        code = PromoCode.objects.get(session_id=session_id)
+        code.used_at = timezone.now()
+        write(code.save)
+        assert get(promo, promo_etag).status_code == 404
+
+        # fresh versions are not tagged when the answer came from a replica
+        with (
+            override_settings(DATABASE_REPLICAS=["default"]),
+            mock.patch.object(db_router, "choose_replica", return_value="default"),
+        ):
+            self._view(self._start_session(), "a1")
+            assert not get("/api/stats/").has_header("ETag")
+
+    def test_first_viewed_asset_persisted_and_backfilled(self):
+        s1 = self._start_session()
+        s2 = self._start_session()
+        s3 = self._start_session()
+        self._view(s1, "a2")
+        self._view(s1, "a1")
+        self._view(s1, "a2")
+        self._view_batch(
+            [
+                {"session_id": s2, "asset_slug": "a1"},
+                {"session_id": s2, "asset_slug": "a3"},
+            ]
+        )
+        a1, a2 = (Asset.objects.get(slug=slug).id for slug in ("a1", "a2"))
+        first = dict(Session.objects.values_list("id", "first_asset_id"))
+        assert first == {UUID(s1): a2, UUID(s2): a1, UUID(s3): None}
+        with CaptureQueriesContext(connection) as queries:
+            counts = rollups.collect_asset_counts(timezone.localdate())
+        assert counts[1] == {a1: 1, a2: 1}
+        assert not any("EXISTS" in q["sql"].upper() for q in queries)
+
+        # sessions started before the columns existed
+        Session.objects.update(first_asset=None, first_viewed_at=None)
+        out = StringIO()
+        call_command("backfill_first_views", "--batch-size", "2", stdout=out)
+        assert "2 sessions backfilled" in out.getvalue()
+        assert dict(Session.objects.values_list("id", "first_asset_id")) == first
+        session = Session.objects.get(id=s1)
+        assert session.first_viewed_at == (
+            SessionItemProgress.objects.get(session=session, asset_id=a2).viewed_at
+        )
+
+    def test_campaign_progress_from_viewed_bitmaps(self):
+        assert dict(Asset.objects.values_list("slug", "ordinal")) == {
+            "a1": 0,
+            "a2": 1,
+            "a3": 2,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            a4 = Asset.objects.create(slug="a4", name="A4", type="model", campaign="x")
+        assert a4.ordinal == 0
+        s1 = self._start_session()
+        r = self._view(s1, "a4")
+        # the only asset of campaign "x": its completion issues the code
+        assert "promo_code" in r.data
+        assert Session.objects.get(id=s1).viewed_bits == {"x": "1"}
+        with self.assertNumQueries(1):
+            pr = self.client.get(f"/api/progress/?session_id={s1}&campaign=x")
+        assert (pr.data["total_assets"], pr.data["viewed_assets"]) == (1, 1)
+        pr = self.client.get(f"/api/progress/?session_id={s1}")
+        assert (pr.data["total_assets"], pr.data["viewed_assets"]) == (4, 1)
+        pr = self.client.get(f"/api/progress/?session_id={s1}&campaign=default")
+        assert pr.data["remaining_assets"] == 3
+        assert (
+            self.client.get(f"/api/progress/?session_id={s1}&campaign=y").status_code
+            == 404
+        )
+
+        s2 = self._start_session()
+        r = self._view_batch(
+            [{"session_id": s2, "asset_slug": slug} for slug in ("a3", "a1", "a2")]
+        )
+        code = r.data["results"][2]["promo_code"]
+        assert Session.objects.get(id=s2).viewed_bits == {"default": "7"}
+        r = self.client.get(f"/api/promo/?session_id={s2}&campaign=x")
+        assert r.data == {"promo_code": code}
+
+        # moved or deleted assets never hand their bit to another asset
+        with self.captureOnCommitCallbacks(execute=True):
+            a1 = Asset.objects.get(slug="a1")
+            a1.campaign = "x"
+            a1.save()
+            a5 = Asset.objects.create(slug="a5", name="A5", type="model")
+        assert (a1.ordinal, a5.ordinal) == (1, 3)
+        pr = self.client.get(f"/api/progress/?session_id={s2}&campaign=default")
+        assert (pr.data["total_assets"], pr.data["viewed_assets"]) == (3, 2)
+        # sessions that viewed the moved asset keep it under its new campaign
+        assert Session.objects.get(id=s2).viewed_bits == {"default": "7", "x": "2"}
+        pr = self.client.get(f"/api/progress/?session_id={s2}&campaign=x")
+        assert (pr.data["total_assets"], pr.data["viewed_assets"]) == (2, 1)
+        self._view(s2, "a4")
+        record = progress_cache.get_session_progress(UUID(s2))
+        assert progress_cache.is_completed(record, "x")
+
+        # the migration rebuilds the bitmaps from SessionItemProgress
+        migration = importlib.import_module(
+            "arb.migrations.0010_asset_ordinal_viewed_bits"
+        )
+        Session.objects.update(viewed_bits={})
+        migration.fill_viewed_bits(apps, None)
+        assert Session.objects.get(id=s2).viewed_bits == {"default": "6", "x": "3"}
+
+    def test_promo_without_campaign_requires_every_campaign(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Asset.objects.create(slug="a4", name="A4", type="model", campaign="x")
+        session_id = self._start_session()
+        for slug in ("a1", "a2", "a3"):
+            r = self._view(session_id, slug)
+        # completing the viewed asset's campaign issues the code right away
+        code = r.data["promo_code"]
+        record = progress_cache.get_session_progress(UUID(session_id))
+        assert progress_cache.is_completed(record, "default")
+        assert not progress_cache.is_completed(record)
+        assert not progress_cache.is_completed(record, "x")
+        promo = f"/api/promo/?session_id={session_id}"
+        # a held code is returned whatever campaign is asked for
+        for query in ("", "&campaign=x", "&campaign=default"):
+            assert self.client.get(promo + query).data == {"promo_code": code}
+
+        PromoCode.objects.filter(code=code).delete()
+        pr = self.client.get(f"/api/progress/?session_id={session_id}")
+        assert pr.data["remaining_assets"] == 1
+        assert self.client.get(promo).data == {"detail": "not_completed"}
+        assert self.client.get(promo + "&campaign=x").status_code == 404
+        r = self.client.get(promo + "&campaign=default")
+        assert "promo_code" in r.data
+        assert self.client.get(promo + "&campaign=x").data == r.data
+
+    def test_export_streams_keyset_pages(self):
+        s1 = self._start_session()
+        s2 = self._start_session()
+        for session_id, slug in [(s1, "a1"), (s2, "a2"), (s1, "a2"), (s1, "a1")]:
+            self._view(session_id, slug)
+        url = "/api/export/events/"
+        assert self.client.get(url).status_code == 403
+        staff = get_user_model().objects.create_user("analyst", is_staff=True)
+        self.client.force_authenticate(staff)
+
+        with self.settings(EXPORT_PAGE_SIZE=2):
+            r = self.client.get(url)
+            assert r.streaming
+            assert r["Content-Type"] == "application/x-ndjson"
+            rows = [json.loads(line) for line in r.getvalue().splitlines()]
+        keys = [(row["session_id"], row["timestamp"], row["id"]) for row in rows]
+        assert keys == sorted(keys, key=lambda k: (UUID(k[0]).hex, k[1], k[2]))
+        assert sorted(row["id"] for row in rows) == sorted(
+            ViewEvent.objects.values_list("id", flat=True)
+        )
+        viewed = [row for row in rows if row["event_type"] == "viewed_asset"]
+        assert viewed[0]["payload"]["asset_slug"] in ("a1", "a2")
+
+        r = self.client.get(
+            url,
+            {"event_type": "first_view_awarded", "campaign": "default"},
+            HTTP_ACCEPT_ENCODING="gzip",
+        )
+        assert r["Content-Encoding"] == "gzip"
+        lines = gzip.decompress(r.getvalue()).splitlines()
+        assert len(lines) == 3
+        assert {json.loads(line)["asset"] for line in lines} == {"a1", "a2"}
+
+        with self.settings(EXPORT_PAGE_SIZE=1):
+            r = self.client.get(
+                "/api/export/progress/", {"output": "csv", "since": "2000-01-01"}
+            )
+            table = list(csv.reader(r.getvalue().decode().splitlines()))
+        assert table[0] == list(export.PROGRESS_FIELDS)
+        assert len(table) == 1 + SessionItemProgress.objects.count()
+        tomorrow = (timezone.localdate() + timezone.timedelta(days=1)).isoformat()
+        r = self.client.get("/api/export/progress/", {"since": tomorrow})
+        assert r.getvalue() == b""
+        for params in ({"since": "yesterday"}, {"event_type": "x"}, {"campaign": "y"}):
+            r = self.client.get("/api/export/progress/", params)
+            assert r.status_code == 400
+        assert self.client.get("/api/export/users/").status_code == 400
+
+        blocks = export.render("events", "ndjson", export.parse_filters({}))
+
+        async def consume():
+            return [block async for block in export.aiterate(blocks)]
+
+        assert b"".join(async_to_sync(consume)()).count(b"\n") == len(rows)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/events.csv.gz"
+            out = StringIO()
+            call_command(
+                "export_data",
+                "events",
+                "--format=csv",
+                "--gzip",
+                "--event-type=viewed_asset",
+                f"--output={path}",
+                stdout=out,
+            )
+            with gzip.open(path, "rt") as fh:
+                assert len(list(csv.reader(fh))) == 1 + len(viewed)
+        assert "bytes written" in out.getvalue()
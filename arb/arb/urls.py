@@ -2,21 +2,28 @@
 @file urls.py
 @brief Маршруты HTTP API для проекта.
 
-Сопоставляет URL-пути с обработчиками из `views`.
+Сопоставляет URL-пути с обработчиками из `views`. При `ASYNC_VIEWS`
+горячие эндпоинты обслуживаются асинхронными версиями из `async_views`.
 """
 
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+hot = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path("api/admin/", admin.site.urls),
     path("api/health/", views.health_check, name="health_check"),
-    path("api/session/start/", views.session_start, name="session_start"),
-    path("api/view/", views.view_event, name="view_event"),
+    path("api/metrics/", views.metrics_view, name="metrics"),
+    path("api/session/start/", hot.session_start, name="session_start"),
+    path("api/view/", hot.view_event, name="view_event"),
+    path("api/view/batch/", views.view_batch, name="view_batch"),
     path("api/user/email/", views.user_email, name="user_email"),
-    path("api/progress/", views.progress, name="progress"),
-    path("api/promo/", views.promo, name="promo"),
+    path("api/progress/", hot.progress, name="progress"),
+    path("api/promo/", hot.promo, name="promo"),
     path("api/stats/", views.stats, name="stats"),
+    path("api/export/<slug:kind>/", views.export_data, name="export_data"),
 ]
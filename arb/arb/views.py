@@ -4,35 +4,50 @@
 
 Содержит представления (DRF function-based views) для старта сессии,
 регистрации событий просмотра, привязки email, получения прогресса,
-выдачи промокодов и сводных статистик. Вспомогательные функции
-инкапсулируют вычисление очков и условий выдачи промокода.
+выдачи промокодов, сводных статистик и выгрузки данных для аналитики.
+Начисление очков и условия выдачи
+промокода вынесены в `scoring`.
 """
 
 import logging
+import uuid
 
 from django.conf import settings
-from django.db.models import Count, OuterRef, Subquery
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from . import (
+    catalog,
+    db_router,
+    etags,
+    event_sink,
+    export,
+    idempotency,
+    live,
+    metrics,
+    progress_cache,
+    rollups,
+    scoring,
+    session_activity,
+)
 from .models import (
-    Asset,
     PromoCode,
     Session,
     SessionItemProgress,
     User,
-    ViewEvent,
 )
-from .tasks import send_promocode_email
+from .tasks import is_mailable, send_promocode_email
 
 logger = logging.getLogger(__name__)
 
-FIRST_VIEW_POINTS = 10
-
 
 def health_check(_request):
     """
@@ -47,81 +62,22 @@ def health_check(_request):
     )
 
 
-def _compute_session_viewed_count(session: Session) -> int:
-    """
-    @brief Количество просмотренных (хотя бы один раз) активов в сессии.
-
-    @param session: Объект `Session`
-    @return Число уникальных активов с `times_viewed > 0`.
-    """
-    return (
-        SessionItemProgress.objects.filter(session=session, times_viewed__gt=0)
-        .only("id")
-        .count()
-    )
-
-
-def _compute_user_total_score(user: User) -> int:
-    """
-    @brief Пересчёт общего балла пользователя.
-
-    @details Суммирует уникальные активы, просмотренные в любых сессиях
-    пользователя, и умножает на константу `FIRST_VIEW_POINTS`.
-
-    @param user: Объект `User`
-    @return Число очков.
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics_view(_request):
     """
-    unique_viewed_assets = (
-        SessionItemProgress.objects.filter(session__user=user, times_viewed__gt=0)
-        .values_list("asset_id", flat=True)
-        .distinct()
-        .count()
-    )
-    return unique_viewed_assets * FIRST_VIEW_POINTS
+    @brief Метрики производительности в текстовом формате Prometheus.
 
+    @details Доступно только персоналу (`is_staff`): сборщик авторизуется
+    служебной учётной записью через HTTP Basic.
 
-def _issue_promocode_if_completed(session: Session, return_existing: bool = True):
-    """
-    @brief Выдаёт промокод, если сессия просмотрела все активы.
-
-    @param session: Объект `Session`
-    @param return_existing: Возвращать ли ранее неиспользованный промокод
-    @return Код промо или None.
+    @param _request: HTTP-запрос
+    @return Гистограммы времени, SQL и размера ответа по маршрутам.
     """
-    total_assets = Asset.objects.count()
-    if total_assets == 0:
-        return None
-    viewed = _compute_session_viewed_count(session)
-    if viewed < total_assets:
-        return None
-    existing = session.promo_codes.filter(used_at__isnull=True).first()
-    if existing:
-        if return_existing:
-            ViewEvent.objects.create(
-                session=session,
-                asset=None,
-                event_type="promo_issued",
-                raw_payload={"code": existing.code, "existing": True},
-            )
-            return existing.code
-        return None
-    code = f"PROMO-{session.id.hex[:8].upper()}-{timezone.now().strftime('%H%M%S')}"
-    promo = PromoCode.objects.create(
-        code=code,
-        session=session,
-        user=session.user if session.user_id else None,
-        email=(session.user.email if session.user_id else session.pending_email),
-        issued_at=timezone.now(),
-    )
-    ViewEvent.objects.create(
-        session=session,
-        asset=None,
-        event_type="promo_issued",
-        raw_payload={"code": promo.code, "existing": False},
-    )
-    return promo.code
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
+@idempotency.idempotent("session_start")
 @api_view(["POST"])
 def session_start(request):  # noqa: ARG001
     """
@@ -131,20 +87,21 @@ def session_start(request):  # noqa: ARG001
     @return Идентификатор созданной сессии.
     """
     session = Session.objects.create(last_seen=timezone.now(), is_active=True)
-    ViewEvent.objects.create(
-        session=session,
-        asset=None,
-        event_type="session_started",
-        raw_payload={"event": "session_started"},
-    )
+    event_sink.log_event(session.id, "session_started", {"event": "session_started"})
+    progress_cache.init_session_progress(session)
+    db_router.stick(session.id)
+    etags.start_session(session.id)
     return Response({"session_id": str(session.id)}, status=status.HTTP_201_CREATED)
 
 
+@idempotency.idempotent("view_event")
 @api_view(["POST"])
 def view_event(request):
     """
     @brief Регистрирует просмотр актива и начисляет очки за первый просмотр.
 
+    @details Транзакционная часть вынесена в `scoring.register_view`.
+
     @param request: JSON с полями `session_id`, `asset_slug` и доп. payload
     @return Информация о начисленных очках и текущем счёте сессии.
     """
@@ -154,50 +111,226 @@ def view_event(request):
         return Response(
             {"detail": "session_id and asset_slug are required"}, status=400
         )
-    session = get_object_or_404(Session, id=session_id)
-    asset = get_object_or_404(Asset, slug=asset_slug)
-    ViewEvent.objects.create(
-        session=session,
-        asset=asset,
-        raw_payload=request.data,
-    )
-    sip, created = SessionItemProgress.objects.get_or_create(
-        session=session, asset=asset
-    )
-    awarded_points = 0
-    if sip.times_viewed == 0:
-        sip.viewed_at = timezone.now()
-        awarded_points = FIRST_VIEW_POINTS
-        session.score = session.score + FIRST_VIEW_POINTS
-        ViewEvent.objects.create(
-            session=session,
-            asset=asset,
-            event_type="first_view_awarded",
-            raw_payload={
-                "asset_slug": asset.slug,
-                "awarded_points": FIRST_VIEW_POINTS,
-            },
-        )
-    sip.times_viewed = sip.times_viewed + 1
-    sip.save()
-    session.last_seen = timezone.now()
-    session.save(update_fields=["score", "last_seen"])
-    promo_code = _issue_promocode_if_completed(session, return_existing=False)
-    payload = {
-        "session_id": str(session.id),
-        "asset_slug": asset.slug,
-        "awarded_points": awarded_points,
-        "session_score": session.score,
-    }
-    if promo_code:
-        payload["promo_code"] = promo_code
+    if not isinstance(asset_slug, str):
+        return Response({"detail": "asset_slug must be a string"}, status=400)
+    asset = catalog.get_asset_or_404(asset_slug)
+    payload = scoring.register_view(session_id, asset, request.data)
     return Response(payload, status=status.HTTP_200_OK)
 
 
+def _parse_uuid(value) -> uuid.UUID | None:
+    """
+    @brief Безопасный разбор UUID из пользовательского ввода.
+
+    @param value: Строка или иное значение из запроса
+    @return Объект `UUID` либо None, если значение некорректно.
+    """
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+@idempotency.idempotent("view_batch")
+@api_view(["POST"])
+def view_batch(request):
+    """
+    @brief Пакетная регистрация просмотров для одной или нескольких сессий.
+
+    @details Семантика начисления очков и выдачи промокода совпадает с
+    `view_event`, но сессии, активы и прогресс загружаются несколькими
+    запросами на весь пакет, а события и прогресс пишутся пакетно.
+    Элементы обрабатываются строго в порядке следования. После фиксации
+    каждой сессии, как и в `view_event`, рассылаются баллы за впервые
+    просмотренные активы и итоговый прогресс.
+
+    @param request: JSON с полем `views` — список объектов с полями
+    `session_id`, `asset_slug` и доп. payload
+    @return Список результатов по каждому элементу в исходном порядке.
+    """
+    items = request.data.get("views")
+    if not isinstance(items, list) or not items:
+        return Response({"detail": "views must be a non-empty list"}, status=400)
+    max_items = settings.VIEW_BATCH_MAX_ITEMS
+    if len(items) > max_items:
+        return Response(
+            {"detail": f"views must contain at most {max_items} items"}, status=400
+        )
+
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict):
+            parsed.append(None)
+            continue
+        parsed.append(
+            (_parse_uuid(item.get("session_id")), item.get("asset_slug"), item)
+        )
+    session_ids = {p[0] for p in parsed if p and p[0]}
+    slugs = {p[1] for p in parsed if p and isinstance(p[1], str)}
+
+    with transaction.atomic():
+        sessions = Session.objects.select_for_update().in_bulk(session_ids)
+        current_catalog = catalog.get_catalog()
+        assets = {
+            slug: current_catalog.by_slug[slug]
+            for slug in slugs
+            if slug in current_catalog.by_slug
+        }
+        progress_map = {
+            (sip.session_id, sip.asset_id): sip
+            for sip in SessionItemProgress.objects.filter(
+                session_id__in=sessions.keys(),
+                asset_id__in=[a.id for a in assets.values()],
+            )
+        }
+        with_open_promo = set(
+            PromoCode.objects.filter(
+                session_id__in=sessions.keys(), used_at__isnull=True
+            ).values_list("session_id", flat=True)
+        )
+
+        now = timezone.now()
+        results = []
+        events = []
+        new_progress = []
+        touched_progress = {}
+        touched_sessions = {}
+        awarded_sessions = set()
+        score_messages = {}
+        seen_by_user = {}
+        completing = {}
+        for entry in parsed:
+            if entry is None:
+                results.append({"status": 400, "detail": "view must be an object"})
+                continue
+            session_id, asset_slug, item = entry
+            if not session_id or not asset_slug:
+                results.append(
+                    {
+                        "status": 400,
+                        "detail": "session_id and asset_slug are required",
+                    }
+                )
+                continue
+            if not isinstance(asset_slug, str):
+                results.append({"status": 400, "detail": "asset_slug must be a string"})
+                continue
+            session = sessions.get(session_id)
+            asset = assets.get(asset_slug)
+            if session is None or asset is None:
+                results.append({"status": 404, "detail": "Not found."})
+                continue
+
+            events.append(
+                event_sink.build_event(session.id, "viewed_asset", item, asset.id)
+            )
+            key = (session.id, asset.id)
+            sip = progress_map.get(key)
+            if sip is None:
+                sip = SessionItemProgress(session=session, asset=asset)
+                progress_map[key] = sip
+                new_progress.append(sip)
+            elif sip.pk is not None:
+                touched_progress[sip.pk] = sip
+            awarded_points = 0
+            if sip.times_viewed == 0:
+                sip.viewed_at = now
+                awarded_points = scoring.FIRST_VIEW_POINTS
+                session.score = session.score + scoring.FIRST_VIEW_POINTS
+                progress_cache.mark_viewed(session, asset)
+                awarded_sessions.add(session.id)
+                score_messages.setdefault(session.id, []).append(
+                    {
+                        "type": "score",
+                        "asset_slug": asset.slug,
+                        "awarded_points": awarded_points,
+                        "session_score": session.score,
+                    }
+                )
+                if session.first_asset_id is None:
+                    session.first_asset_id = asset.id
+                    session.first_viewed_at = now
+                if session.user_id:
+                    seen_by_user.setdefault(session.user_id, []).append(asset.id)
+                events.append(
+                    event_sink.build_event(
+                        session.id,
+                        "first_view_awarded",
+                        {
+                            "asset_slug": asset.slug,
+                            "awarded_points": scoring.FIRST_VIEW_POINTS,
+                        },
+                        asset.id,
+                    )
+                )
+            sip.times_viewed = sip.times_viewed + 1
+            if session_activity.touch(session, now) or awarded_points:
+                touched_sessions[session.id] = session
+
+            if (
+                session.id not in with_open_promo
+                and session.id not in completing
+                and progress_cache.is_completed(
+                    progress_cache.build_session_progress(session), asset.campaign
+                )
+            ):
+                completing[session.id] = (len(results), asset.campaign)
+            results.append(
+                {
+                    "status": 200,
+                    "session_id": str(session.id),
+                    "asset_slug": asset.slug,
+                    "awarded_points": awarded_points,
+                    "session_score": session.score,
+                }
+            )
+
+        event_sink.log_events(events)
+        SessionItemProgress.objects.bulk_create(new_progress)
+        SessionItemProgress.objects.bulk_update(
+            touched_progress.values(), ["viewed_at", "times_viewed"]
+        )
+        Session.objects.bulk_update(
+            touched_sessions.values(),
+            [
+                "score",
+                "last_seen",
+                "is_active",
+                "first_asset",
+                "first_viewed_at",
+                "viewed_bits",
+            ],
+        )
+        for user_id, asset_ids in seen_by_user.items():
+            scoring.mark_assets_seen(user_id, asset_ids)
+        for session_id in awarded_sessions:
+            record = progress_cache.refresh_session_progress(sessions[session_id])
+            live.publish_on_commit(
+                session_id,
+                *score_messages[session_id],
+                {"type": "progress", **progress_cache.progress_payload(record)},
+            )
+        db_router.stick(*awarded_sessions)
+        etags.bump(
+            session_ids=awarded_sessions,
+            user_ids={sessions[sid].user_id for sid in awarded_sessions},
+        )
+        for session_id, (index, campaign) in completing.items():
+            promo_code = scoring.issue_promocode_if_completed(
+                sessions[session_id], return_existing=False, campaign=campaign
+            )
+            if promo_code:
+                results[index]["promo_code"] = promo_code
+
+    return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+@idempotency.idempotent("user_email")
 @api_view(["POST"])
 def user_email(request):
     """
-    @brief Привязывает email к сессии и пользователю, пересчитывает баллы.
+    @brief Привязывает email к сессии и пользователю, начисляет баллы
+    за впервые увиденные пользователем активы.
 
     @param request: JSON с полями `session_id`, `email`
     @return Данные пользователя и его суммарный балл.
@@ -207,77 +340,80 @@ def user_email(request):
     if not session_id or not email:
         return Response({"detail": "session_id and email are required"}, status=400)
     session = get_object_or_404(Session, id=session_id)
+    return Response(_link_email(session, email), status=status.HTTP_200_OK)
+
+
+def _link_email(session: Session, email: str) -> dict:
+    """
+    @brief Привязывает email к сессии (общая часть `user_email` и WebSocket).
+
+    @param session: Объект `Session` (перечитывается под блокировкой)
+    @param email: Адрес пользователя
+    @return Тело ответа `user_email`.
+    """
     user, _ = User.objects.get_or_create(email=email)
-    session.user = user
-    session.pending_email = email
-    session.last_seen = timezone.now()
-    session.save(update_fields=["user", "pending_email", "last_seen"])
-    ViewEvent.objects.create(
-        session=session,
-        asset=None,
-        event_type="email_submitted",
-        raw_payload={"email": email},
-    )
-    user.total_score = _compute_user_total_score(user)
-    user.save(update_fields=["total_score"])
-    promo_code = _issue_promocode_if_completed(session)
+    with transaction.atomic():
+        # register_view locks the same row: a view committed before this
+        # point is in the fresh bits, a later one already sees the user
+        session = Session.objects.select_for_update().get(id=session.id)
+        session.user = user
+        session.pending_email = email
+        touched = session_activity.touch(session, timezone.now())
+        session.save(update_fields=["user", "pending_email", *touched])
+        db_router.stick(session.id)
+        etags.link_session(session.id, user.id)
+        event_sink.log_event(session.id, "email_submitted", {"email": email})
+        record = progress_cache.build_session_progress(session)
+        if scoring.mark_assets_seen(user.id, progress_cache.viewed_asset_ids(record)):
+            user.refresh_from_db(fields=["total_score"])
+    promo_code = scoring.issue_promocode_if_completed(session, record=record)
     if promo_code:
         PromoCode.objects.filter(code=promo_code).update(user=user, email=email)
-        try:
-            send_promocode_email.delay(promo_code)
-        except Exception:  # noqa: BLE001
-            logger.exception("Как оно вообще тут упало? Увольте бэкэндера")
-    return Response(
-        {
-            "session_id": str(session.id),
-            "user_id": str(user.id),
-            "email": user.email,
-            "user_total_score": user.total_score,
-        },
-        status=status.HTTP_200_OK,
-    )
+        if settings.PROMO_EMAIL_MODE != "batch" and is_mailable(email):
+            try:
+                send_promocode_email.delay(promo_code)
+            except Exception:  # noqa: BLE001
+                logger.exception("Как оно вообще тут упало? Увольте бэкэндера")
+    return {
+        "session_id": str(session.id),
+        "user_id": str(user.id),
+        "email": user.email,
+        "user_total_score": user.total_score,
+    }
 
 
+@etags.conditional("progress", etags.progress_versions)
+@db_router.replica_reads
 @api_view(["GET"])
 def progress(request):
     """
     @brief Возвращает прогресс по сессии или пользователю.
 
-    @param request: Query `session_id` или `user_id`
+    @param request: Query `session_id` или `user_id`, необязательный `campaign`
     @return Общее число активов, просмотренные и оставшиеся, и очки.
     """
     session_id = request.query_params.get("session_id")
     user_id = request.query_params.get("user_id")
+    campaign = request.query_params.get("campaign")
     if not session_id and not user_id:
         return Response({"detail": "session_id or user_id is required"}, status=400)
-    total_assets = Asset.objects.count()
+    catalog.check_campaign(campaign)
     if session_id:
-        session = get_object_or_404(Session, id=session_id)
-        viewed_assets = _compute_session_viewed_count(session)
-        payload = {
-            "total_assets": total_assets,
-            "viewed_assets": viewed_assets,
-            "remaining_assets": max(total_assets - viewed_assets, 0),
-            "total_score": session.score,
-        }
-        ViewEvent.objects.create(
-            session=session,
-            asset=None,
-            event_type="progress_viewed",
-            raw_payload=payload,
-        )
+        parsed_id = _parse_uuid(session_id)
+        record = progress_cache.get_session_progress(parsed_id) if parsed_id else None
+        if record is None:
+            session = get_object_or_404(Session, id=session_id)
+            parsed_id = session.id
+            record = progress_cache.refresh_session_progress(session)
+        payload = progress_cache.progress_payload(record, campaign)
+        event_sink.log_event(parsed_id, "progress_viewed", payload)
         return Response(payload)
+    total_assets = catalog.get_catalog().campaign_total(campaign)
     user = get_object_or_404(User, id=user_id)
-    user_score = _compute_user_total_score(user)
-    if user.total_score != user_score:
-        user.total_score = user_score
-        user.save(update_fields=["total_score"])
-    viewed_assets = (
-        SessionItemProgress.objects.filter(session__user=user, times_viewed__gt=0)
-        .values_list("asset_id", flat=True)
-        .distinct()
-        .count()
-    )
+    seen = user.seen_assets.all()
+    if campaign is not None:
+        seen = seen.filter(asset__campaign=campaign)
+    viewed_assets = seen.count()
     return Response(
         {
             "total_assets": total_assets,
@@ -288,22 +424,33 @@ def progress(request):
     )
 
 
+@etags.conditional("promo", etags.promo_versions)
+@db_router.replica_reads
 @api_view(["GET"])
 def promo(request):
     """
     @brief Возвращает активный промокод для пользователя/сессии, если он есть.
 
-    @param request: Query `session_id` или `user_id` или `email`
+    @details Без `campaign` код выдаётся за завершение всех кампаний, с ним —
+    за завершение указанной. Все кампании выдают коды из одного пула, и
+    сессии выдаётся не более одного кода, поэтому `campaign` влияет только
+    на право получить новый код: уже выданный неиспользованный код
+    возвращается при любом `campaign`.
+
+    @param request: Query `session_id` или `user_id` или `email`,
+    необязательный `campaign`
     @return JSON с `promo_code` либо 404, если условия не выполнены.
     """
     session_id = request.query_params.get("session_id")
     user_id = request.query_params.get("user_id")
     email = request.query_params.get("email")
+    campaign = request.query_params.get("campaign")
 
     if not any([session_id, user_id, email]):
         return Response(
             {"detail": "session_id or user_id or email is required"}, status=400
         )
+    catalog.check_campaign(campaign)
 
     user = None
     session = None
@@ -318,15 +465,18 @@ def promo(request):
         if not user:
             return Response({"detail": "not_found"}, status=404)
 
-    existing_promo = PromoCode.objects.filter(user=user, used_at__isnull=True).first()
+    existing_promo = (
+        PromoCode.objects.filter(user=user, used_at__isnull=True).first()
+        if user is not None
+        else None
+    )
     if existing_promo:
         if session:
             result = "issued" if existing_promo.session_id == session.id else "exists"
-            ViewEvent.objects.create(
-                session=session,
-                asset=None,
-                event_type="promo_checked",
-                raw_payload={"result": result, "code": existing_promo.code},
+            event_sink.log_event(
+                session.id,
+                "promo_checked",
+                {"result": result, "code": existing_promo.code},
             )
         return Response({"promo_code": existing_promo.code})
 
@@ -334,26 +484,22 @@ def promo(request):
         session = Session.objects.filter(user=user).order_by("-last_seen").first()
 
     if session:
-        code = _issue_promocode_if_completed(session, return_existing=True)
+        code = scoring.issue_promocode_if_completed(
+            session, return_existing=True, campaign=campaign
+        )
         if code:
-            ViewEvent.objects.create(
-                session=session,
-                asset=None,
-                event_type="promo_checked",
-                raw_payload={"result": "issued", "code": code},
+            event_sink.log_event(
+                session.id, "promo_checked", {"result": "issued", "code": code}
             )
             return Response({"promo_code": code})
 
     if session:
-        ViewEvent.objects.create(
-            session=session,
-            asset=None,
-            event_type="promo_checked",
-            raw_payload={"result": "not_completed"},
-        )
+        event_sink.log_event(session.id, "promo_checked", {"result": "not_completed"})
     return Response({"detail": "not_completed"}, status=404)
 
 
+@etags.conditional("stats", etags.stats_versions)
+@db_router.replica_reads
 @api_view(["GET"])
 def stats(_request):
     """
@@ -361,52 +507,22 @@ def stats(_request):
 
     @details Находит актив по комбинированному скорингу из долей:
     сегодняшние просмотры, «первым в сессии», и суммарные просмотры.
+    Счётчики берутся из агрегатов `rollups` с досчётом хвоста лога,
+    «первым в сессии» — из `Session.first_asset`.
 
     @param _request: HTTP-запрос
     @return JSON с `best_asset`, `views_today`, `views_all_time`.
     """
     today = timezone.localdate()
-    base_filter = {"event_type": "viewed_asset", "asset__isnull": False}
-    views_all_time = ViewEvent.objects.filter(**base_filter).count()
-    views_today_qs = ViewEvent.objects.filter(timestamp__date=today, **base_filter)
-    views_today = views_today_qs.count()
+    today_counts, first_counts, all_counts = rollups.collect_asset_counts(today)
+    views_today = sum(today_counts.values())
+    views_all_time = sum(all_counts.values())
 
-    best_asset_payload = None
+    best_asset_id = None
     if views_today == 0:
-        all_counts_qs = (
-            ViewEvent.objects.filter(**base_filter)
-            .values("asset_id")
-            .annotate(cnt=Count("id"))
-            .order_by("-cnt")
-        )
-        if all_counts_qs.exists():
-            best_asset_id = all_counts_qs.first()["asset_id"]
-            asset = Asset.objects.get(id=best_asset_id)
-            best_asset_payload = {"slug": asset.slug, "name": asset.name}
+        if all_counts:
+            best_asset_id = max(all_counts, key=lambda aid: (all_counts[aid], -aid))
     else:
-        today_counts_qs = views_today_qs.values("asset_id").annotate(cnt=Count("id"))
-        today_counts = {row["asset_id"]: row["cnt"] for row in today_counts_qs}
-
-        all_counts_qs = (
-            ViewEvent.objects.filter(**base_filter)
-            .values("asset_id")
-            .annotate(cnt=Count("id"))
-        )
-        all_counts = {row["asset_id"]: row["cnt"] for row in all_counts_qs}
-
-        first_asset_sub = (
-            ViewEvent.objects.filter(session=OuterRef("pk"), **base_filter)
-            .order_by("timestamp")
-            .values("asset_id")[:1]
-        )
-        firsts_qs = (
-            Session.objects.annotate(first_asset_id=Subquery(first_asset_sub))
-            .values("first_asset_id")
-            .exclude(first_asset_id=None)
-            .annotate(cnt=Count("id"))
-        )
-        first_counts = {row["first_asset_id"]: row["cnt"] for row in firsts_qs}
-
         max_today = max(today_counts.values()) if today_counts else 0
         max_first = max(first_counts.values()) if first_counts else 0
         max_all = max(all_counts.values()) if all_counts else 0
@@ -415,7 +531,6 @@ def stats(_request):
             set(today_counts.keys()) | set(all_counts.keys()) | set(first_counts.keys())
         )
 
-        best_asset_id = None
         best_score = -1.0
         best_tiebreak = (-1,)
 
@@ -440,8 +555,10 @@ def stats(_request):
                 best_asset_id = aid
                 best_tiebreak = tiebreak
 
-        if best_asset_id is not None:
-            asset = Asset.objects.get(id=best_asset_id)
+    best_asset_payload = None
+    if best_asset_id is not None:
+        asset = catalog.get_catalog().by_id.get(best_asset_id)
+        if asset is not None:
             best_asset_payload = {"slug": asset.slug, "name": asset.name}
 
     return Response(
@@ -451,3 +568,38 @@ def stats(_request):
             "views_all_time": views_all_time,
         }
     )
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def export_data(request, kind):
+    """
+    @brief Потоковая выгрузка событий или прогресса для аналитиков.
+
+    @details Строки читаются страницами по ключу (см. `export`) с реплики,
+    если она настроена, и отдаются по мере чтения; при
+    `Accept-Encoding: gzip` поток сжимается на лету. Доступно только
+    администраторам (сессия админки или Basic-аутентификация).
+
+    @param request: Query `since`, `until`, `event_type`, `campaign` и
+    `output` (`ndjson` по умолчанию или `csv`)
+    @param kind: `events` или `progress`
+    @return Потоковый ответ с файлом выгрузки либо 400.
+    """
+    fmt = request.query_params.get("output", "ndjson")
+    try:
+        filters = export.parse_filters(request.query_params)
+        blocks = export.render(kind, fmt, filters, using=db_router.choose_replica())
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=400)
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    if gzipped:
+        blocks = export.gzip_blocks(blocks)
+    if isinstance(request._request, ASGIRequest):  # noqa: SLF001
+        blocks = export.aiterate(blocks)
+    response = StreamingHttpResponse(blocks, content_type=export.FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{kind}.{fmt}"'
+    if gzipped:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
@@ -0,0 +1,124 @@
+"""
+@file warmup.py
+@brief Прогрев процесса приложения до приёма запросов.
+
+Первый запрос холодного воркера платит за ленивую инициализацию: сборку
+URL-резолвера, импорт DRF и его рендереров, импорт Celery-приложения
+через `views → tasks`, соединение с MySQL и Redis, загрузку каталога
+активов. Прогрев выполняет это заранее в два шага:
+
+- `preload()` — в мастер-процессе gunicorn до fork (`preload_app`):
+  импорт и сборка всего, что не держит соединений, и каталог активов
+  (соединения с БД закрываются до fork, данные каталога наследуются);
+- `warm_worker()` — в каждом воркере после fork, до того как он начнёт
+  принимать запросы: соединения с MySQL и Redis и проверка версии
+  каталога.
+
+Оба шага возвращают длительности этапов в миллисекундах и пишут их в лог.
+"""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.urls import get_resolver, reverse
+from django.utils.module_loading import import_string
+
+from . import catalog
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# modules the first request would otherwise import lazily
+MODULES = (
+    "arb.views",
+    "arb.async_views",
+    "arb.tasks",
+    "rest_framework.renderers",
+    "rest_framework.parsers",
+    "rest_framework.negotiation",
+)
+
+
+def _timed(steps: dict, name: str, func) -> None:
+    started = time.perf_counter()
+    try:
+        func()
+    except Exception:
+        logger.exception("warm-up step %s failed", name)
+    steps[name] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def _resolve_urls() -> None:
+    from rest_framework.settings import api_settings  # noqa: PLC0415
+
+    resolver = get_resolver()
+    for pattern in resolver.url_patterns:
+        # routes with arguments (export) are admin-only and left cold
+        if getattr(pattern, "name", None) and not pattern.pattern.converters:
+            resolver.resolve(reverse(pattern.name))
+    # DRF instantiates its renderer/parser classes from settings on first use
+    api_settings.DEFAULT_RENDERER_CLASSES  # noqa: B018
+    api_settings.DEFAULT_PARSER_CLASSES  # noqa: B018
+
+
+def _import_modules() -> None:
+    for name in MODULES:
+        importlib.import_module(name)
+    # backends the session and messages middleware load on the first request
+    importlib.import_module(settings.SESSION_ENGINE)
+    import_string(settings.SESSION_SERIALIZER)
+    import_string(settings.MESSAGE_STORAGE)
+
+
+def _ping_db() -> None:
+    for conn in connections.all(initialized_only=False):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+
+def _ping_redis() -> None:
+    client = get_redis()
+    if client is not None:
+        client.ping()
+    cache.get("warmup")
+
+
+def preload() -> dict:
+    """
+    @brief Прогрев до fork: импорты, URL, каталог активов.
+
+    @return Длительности этапов, мс.
+    """
+    steps = {}
+    _timed(steps, "imports", _import_modules)
+    _timed(steps, "urls", _resolve_urls)
+    _timed(steps, "catalog", catalog.get_catalog)
+    # forked workers must not share the master's sockets
+    connections.close_all()
+    logger.info("preload warm-up: %s", steps)
+    return steps
+
+
+def warm_worker() -> dict:
+    """
+    @brief Прогрев воркера: соединения с БД и Redis, версия каталога.
+
+    @details Соединение с БД после прогрева закрывается обычным способом,
+    то есть с бэкендом `arb.mysql_pool` возвращается в пул воркера.
+
+    @return Длительности этапов, мс.
+    """
+    steps = {}
+    _timed(steps, "db", _ping_db)
+    _timed(steps, "redis", _ping_redis)
+    _timed(steps, "catalog", catalog.get_catalog)
+    for conn in connections.all(initialized_only=True):
+        conn.close()
+    logger.info("worker warm-up: %s", steps)
+    return steps
@@ -0,0 +1,248 @@
+"""
+@file ws.py
+@brief WebSocket сессии: приём просмотров и живые обновления прогресса.
+
+Клиент открывает одно соединение `/api/ws/session/<session_id>/` на всю
+сессию вместо отдельного HTTPS-запроса на каждый распознанный актив и
+опроса `progress`/`promo`. По соединению идут JSON-сообщения с полем
+`type`; необязательное поле `id` возвращается в ответе без изменений:
+
+- `view` (`asset_slug` и доп. payload) — то же, что `POST /api/view/`;
+- `email` (`email`) — то же, что `POST /api/user/email/`;
+- `progress` — то же, что `GET /api/progress/?session_id=...`.
+
+Ответ повторяет тело HTTP-ответа с полем `type` запроса; ошибки приходят
+как `{"type": "error", "status": ..., "detail": ...}`. Независимо от
+запросов сервер присылает `score`, `progress` и `promo_issued`, когда они
+меняются, в том числе от просмотров, пришедших по HTTP или в другой
+воркер (см. `live.py`). Сообщения `view` и `email` списывают токены из
+тех же корзин, что и HTTP-маршруты `view_event` и `user_email`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import re
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404
+
+from . import catalog, event_sink, live, metrics, progress_cache, ratelimit, scoring
+from .models import Session
+from .views import _link_email, _parse_uuid
+
+logger = logging.getLogger(__name__)
+
+PATH = re.compile(r"^/api/ws/session/(?P<session_id>[^/]+)/$")
+# the handshake is refused before accept, which servers answer with HTTP 403
+CLOSE_NOT_FOUND = 4404
+
+
+class MessageError(Exception):
+    """Сообщение клиента нельзя обработать; уходит клиенту как `error`."""
+
+    def __init__(self, status: int, detail: str, **extra) -> None:
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.extra = extra
+
+
+def _view(session_id, ip: str, data: dict) -> dict:
+    asset_slug = data.get("asset_slug")
+    if not asset_slug:
+        raise MessageError(400, "asset_slug is required")
+    if not isinstance(asset_slug, str):
+        raise MessageError(400, "asset_slug must be a string")
+    _limit("view_event", session_id, ip)
+    asset = catalog.get_asset_or_404(asset_slug)
+    payload = {k: v for k, v in data.items() if k not in ("type", "id")}
+    payload["session_id"] = str(session_id)
+    return scoring.register_view(session_id, asset, payload)
+
+
+def _email(session_id, ip: str, data: dict) -> dict:
+    email = data.get("email")
+    if not email:
+        raise MessageError(400, "email is required")
+    if not isinstance(email, str):
+        raise MessageError(400, "email must be a string")
+    _limit("user_email", session_id, ip)
+    return _link_email(_session(session_id), email)
+
+
+def _progress(session_id, _ip: str, _data: dict) -> dict:
+    record = progress_cache.get_session_progress(session_id)
+    if record is None:
+        record = progress_cache.refresh_session_progress(_session(session_id))
+    payload = progress_cache.progress_payload(record)
+    event_sink.log_event(session_id, "progress_viewed", payload)
+    return payload
+
+
+def _invalid(_session_id, _ip: str, _data: dict) -> dict:
+    raise MessageError(400, "type must be one of: view, email, progress")
+
+
+HANDLERS = {
+    "view": _view,
+    "email": _email,
+    "progress": _progress,
+    "invalid": _invalid,
+}
+
+
+def _session(session_id) -> Session:
+    session = Session.objects.filter(id=session_id).first()
+    if session is None:
+        raise Http404("No Session matches the given query.")
+    return session
+
+
+def _limit(route: str, session_id, ip: str) -> None:
+    allowed, retry_after, scope = ratelimit.consume(
+        route, {"ip": ip, "session": str(session_id)}
+    )
+    if not allowed:
+        raise MessageError(
+            429,
+            f"Too many requests ({scope} limit).",
+            retry_after=round(retry_after, 3),
+        )
+
+
+def handle_message(session_id, ip: str, text: str) -> dict:
+    """
+    @brief Обрабатывает одно сообщение клиента.
+
+    @param session_id: Идентификатор сессии соединения (UUID)
+    @param ip: Адрес клиента (для корзин ограничения частоты)
+    @param text: Текст сообщения
+    @return Ответ клиенту; ошибки обработки, включая непредвиденные,
+    возвращаются сообщением `error`, а не исключением.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        metrics.increment(metrics.WS_MESSAGES_TOTAL, "invalid", "400")
+        return {"type": "error", "status": 400, "detail": "JSON parse error"}
+    kind = data.get("type")
+    if not isinstance(kind, str) or kind not in HANDLERS:
+        kind = "invalid"
+    try:
+        reply = {"type": kind, **HANDLERS[kind](session_id, ip, data)}
+        metrics.increment(metrics.WS_MESSAGES_TOTAL, kind, "ok")
+    except MessageError as exc:
+        metrics.increment(metrics.WS_MESSAGES_TOTAL, kind, str(exc.status))
+        reply = {"type": "error", "status": exc.status, "detail": exc.detail}
+        reply.update(exc.extra)
+    except Http404 as exc:
+        metrics.increment(metrics.WS_MESSAGES_TOTAL, kind, "404")
+        reply = {"type": "error", "status": 404, "detail": str(exc)}
+    except Exception:
+        # one bad frame must not take the socket down with it
+        logger.exception("websocket %s message failed", kind)
+        metrics.increment(metrics.WS_MESSAGES_TOTAL, kind, "500")
+        reply = {"type": "error", "status": 500, "detail": "Internal server error"}
+    if "id" in data:
+        reply["id"] = data["id"]
+    return reply
+
+
+def _in_request(func, *args):
+    # a socket lives for the whole visit, so DB connections are handed back
+    # per message, the way request_started/request_finished do for HTTP
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def _call(func, *args):
+    """Выполняет синхронный код сообщения в своём потоке, как запрос ASGI."""
+    async with ThreadSensitiveContext():
+        return await sync_to_async(_in_request)(func, *args)
+
+
+def _headers(scope) -> dict[str, str]:
+    return {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+
+
+def _origin_allowed(headers: dict[str, str]) -> bool:
+    origin = headers.get("origin")
+    if origin is None:
+        return True
+    host = origin.partition("://")[2]
+    return origin in settings.CORS_ALLOWED_ORIGINS or host == headers.get("host")
+
+
+def _client_ip(scope, headers: dict[str, str]) -> str:
+    header = settings.RATE_LIMIT_IP_HEADER
+    forwarded = headers.get(header.lower()) if header else None
+    client = scope.get("client")
+    return (forwarded or (client[0] if client else None) or "-").strip()
+
+
+def _find_session(session_id):
+    parsed_id = _parse_uuid(session_id)
+    if parsed_id is None:
+        return None
+    return Session.objects.filter(id=parsed_id).values_list("id", flat=True).first()
+
+
+async def application(scope, receive, send):
+    """
+    @brief ASGI-приложение WebSocket сессии.
+
+    @param scope: Scope соединения с типом `websocket`
+    @param receive: Канал входящих событий ASGI
+    @param send: Канал исходящих событий ASGI
+    """
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    headers = _headers(scope)
+    match = PATH.match(scope["path"])
+    session_id = None
+    if match and _origin_allowed(headers):
+        session_id = await _call(_find_session, match["session_id"])
+    if session_id is None:
+        await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+        return
+    await send({"type": "websocket.accept"})
+    ip = _client_ip(scope, headers)
+    lock = asyncio.Lock()
+
+    async def reply(text: str) -> None:
+        async with lock:
+            await send({"type": "websocket.send", "text": text})
+
+    async def push(queue: asyncio.Queue) -> None:
+        while True:
+            await reply(await queue.get())
+
+    hub = live.get_hub()
+    queue = await hub.subscribe(str(session_id))
+    pusher = asyncio.create_task(push(queue))
+    try:
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message["type"] != "websocket.receive":
+                continue
+            text = message.get("text")
+            if text is None:
+                text = (message.get("bytes") or b"").decode("utf-8", "replace")
+            answer = await _call(handle_message, session_id, ip, text)
+            await reply(json.dumps(answer))
+    finally:
+        pusher.cancel()
+        await hub.unsubscribe(str(session_id), queue)
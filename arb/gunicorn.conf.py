@@ -0,0 +1,55 @@
+# ruff: noqa: INP001
+"""
+@file gunicorn.conf.py
+@brief Конфигурация gunicorn для продакшен-режима (`SERVER_MODE=gunicorn`).
+
+Приложение загружается в мастер-процессе до fork (`preload_app`), там же
+выполняется `warmup.preload()`; воркеры наследуют импортированный код,
+собранные URL и каталог активов. Каждый воркер после fork прогревает свои
+соединения (`warmup.warm_worker()`) в `post_worker_init`, то есть до того,
+как начнёт принимать запросы. При `ASYNC_VIEWS` обслуживает ASGI-приложение
+воркерами uvicorn, иначе WSGI-приложение потоковыми воркерами `gthread`.
+Все параметры берутся из окружения.
+"""
+
+import decouple
+
+bind = decouple.config("GUNICORN_BIND", default="0.0.0.0:8000")
+workers = decouple.config("WEB_CONCURRENCY", default=2, cast=int)
+threads = decouple.config("GUNICORN_THREADS", default=8, cast=int)
+if decouple.config("ASYNC_VIEWS", default=False, cast=bool):
+    wsgi_app = "arb.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "arb.wsgi:application"
+    worker_class = "gthread"
+preload_app = True
+timeout = decouple.config("GUNICORN_TIMEOUT", default=30, cast=int)
+graceful_timeout = decouple.config("GUNICORN_GRACEFUL_TIMEOUT", default=30, cast=int)
+keepalive = decouple.config("GUNICORN_KEEPALIVE", default=5, cast=int)
+# recycle workers now and then to bound slow leaks; jitter avoids all at once
+max_requests = decouple.config("GUNICORN_MAX_REQUESTS", default=10000, cast=int)
+max_requests_jitter = decouple.config(
+    "GUNICORN_MAX_REQUESTS_JITTER", default=1000, cast=int
+)
+accesslog = None
+errorlog = "-"
+loglevel = decouple.config("GUNICORN_LOG_LEVEL", default="info")
+
+WARMUP = decouple.config("SERVER_WARMUP", default=True, cast=bool)
+
+
+def when_ready(server):
+    if WARMUP:
+        from arb import warmup  # noqa: PLC0415
+
+        steps = warmup.preload()
+        server.log.info("preload warm-up done: %s", steps)
+
+
+def post_worker_init(worker):
+    if WARMUP:
+        from arb import warmup  # noqa: PLC0415
+
+        steps = warmup.warm_worker()
+        worker.log.info("worker %s warm: %s", worker.pid, steps)
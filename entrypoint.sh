@@ -18,6 +18,28 @@ else
   echo "Skipping migrations (SKIP_MIGRATIONS=$SKIP_MIGRATIONS)"
 fi
 
+# "serve" starts the HTTP server chosen by SERVER_MODE:
+#   gunicorn  - preforking server with warm-up (gunicorn.conf.py), production
+#   uvicorn   - plain uvicorn with WEB_CONCURRENCY workers
+#   runserver - Django development server
+if [ "$1" = "serve" ]; then
+  case "${SERVER_MODE:-gunicorn}" in
+    gunicorn)
+      exec gunicorn -c gunicorn.conf.py
+      ;;
+    uvicorn)
+      exec uvicorn arb.asgi:application --host 0.0.0.0 --port 8000 --no-access-log
+      ;;
+    runserver)
+      exec python manage.py runserver 0.0.0.0:8000
+      ;;
+    *)
+      echo "Unknown SERVER_MODE=$SERVER_MODE" >&2
+      exit 1
+      ;;
+  esac
+fi
+
 exec "$@"
 
 